@@ -0,0 +1,153 @@
+"""
+Concurrency load test for the SQLite settings in Database.dbConfig: several
+writer processes (like gunicorn workers registering users) and reader
+processes (like /verify-user) share one database file, first with SQLite's
+defaults (rollback journal, synchronous=FULL), then with the tuned settings
+(WAL, synchronous=NORMAL, mmap, cache size, busy_timeout).
+
+Usage:
+    python benchmarks/bench_db_concurrency.py [--writers N] [--readers N] [--seconds S]
+
+Reports p50/p99/max latency of writes and reads and how many failed.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(SRC)
+
+
+def make_app(uri, tuned):
+    from flask import Flask
+    from Database.flaskSQL import db
+    from Database.dbConfig import engine_options, tune_engine
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    if tuned:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    db.init_app(app)
+    with app.app_context():
+        if tuned:
+            tune_engine(db.engine)
+    return app
+
+
+def registration(worker, i):
+    key = f"{worker:08x}{i:056x}"
+    return {
+        'name': f"USER {worker}-{i}",
+        'date_of_birth': date(1990, 1, 2),
+        'images': [{'image_url': f"aa/bb/{key}.jpg", 'content_hash': key, 'size': 1000}],
+        'documents': [{
+            'document_url': f"aa/bb/{key}.jpg",
+            'document_name': f"front_{worker}_{i}.jpg",
+            'document_type': 'ID',
+            'extracted_text': "USER\n1990-01-02\n",
+            'content_hash': key,
+            'size': 1000
+        }]
+    }
+
+
+def writer(uri, tuned, worker, deadline, results):
+    from Database.flaskSQL import db
+    from Database.userRepository import UserRepository
+
+    app = make_app(uri, tuned)
+    latencies, errors = [], 0
+    with app.app_context():
+        repository = UserRepository()
+        i = 0
+        while time.time() < deadline:
+            start = time.perf_counter()
+            try:
+                repository.create_user(registration(worker, i))
+                db.session.commit()
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                db.session.rollback()
+                errors += 1
+            i += 1
+    results.put(('write', latencies, errors))
+
+
+def reader(uri, tuned, worker, deadline, results):
+    import random
+    from Database.flaskSQL import User, db
+
+    app = make_app(uri, tuned)
+    latencies, errors = [], 0
+    with app.app_context():
+        while time.time() < deadline:
+            start = time.perf_counter()
+            try:
+                count = db.session.query(db.func.max(User.user_id)).scalar() or 1
+                user = db.session.get(User, random.randint(1, count))
+                if user is not None:
+                    len(user.images), len(user.documents)
+                db.session.rollback()
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                db.session.rollback()
+                errors += 1
+    results.put(('read', latencies, errors))
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run(label, tuned, args):
+    from Database.flaskSQL import db
+
+    uri = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}"
+    app = make_app(uri, tuned)
+    with app.app_context():
+        db.create_all()
+        db.engine.dispose()
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    # Leave time for the workers to start before the clock runs
+    deadline = time.time() + 3 + args.seconds
+    processes = [context.Process(target=writer, args=(uri, tuned, n, deadline, results)) for n in range(args.writers)]
+    processes += [context.Process(target=reader, args=(uri, tuned, n, deadline, results)) for n in range(args.readers)]
+    for process in processes:
+        process.start()
+    collected = {'write': ([], 0), 'read': ([], 0)}
+    for _ in processes:
+        kind, latencies, errors = results.get()
+        collected[kind] = (collected[kind][0] + latencies, collected[kind][1] + errors)
+    for process in processes:
+        process.join()
+
+    print(label)
+    for kind, (latencies, errors) in collected.items():
+        print(f"  {kind:<5} {len(latencies):7d} ok {errors:5d} failed  "
+              f"p50 {percentile(latencies, 0.5) * 1000:7.1f} ms  p99 {percentile(latencies, 0.99) * 1000:7.1f} ms  "
+              f"max {max(latencies, default=float('nan')) * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.writers} writer and {args.readers} reader processes for {args.seconds:.0f} s")
+    run("SQLite defaults", False, args)
+    run("dbConfig tuned (WAL, synchronous=NORMAL)", True, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Startup time and per-process memory of a web worker looking up stored face
+embeddings, as the number of registered faces grows:
+
+    rows     every encoding deserialized from Image.face_encoding blobs
+             into a dict in the worker's own heap
+    matrix   the shared float32 matrix (Database.embeddingMatrix) mapped
+             read-only, pages shared through the OS page cache
+
+Usage:
+    python benchmarks/bench_embedding_matrix.py [--faces 10000,100000,1000000] [--lookups N]
+
+Each measurement runs in a fresh process: open the store, then look up
+--lookups random images. RssAnon is the worker's private memory; RssFile
+counts mapped file pages, which every worker shares.
+"""
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+def rss():
+    fields = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('RssAnon', 'RssFile'):
+                fields[key] = int(value.split()[0]) / 1024
+    return fields
+
+
+def build(directory, faces):
+    from Database.embeddingMatrix import EmbeddingMatrix
+
+    rng = np.random.default_rng(0)
+    conn = sqlite3.connect(os.path.join(directory, 'rows.db'))
+    conn.execute("CREATE TABLE image (image_id INTEGER PRIMARY KEY, face_encoding BLOB)")
+    matrix = EmbeddingMatrix(os.path.join(directory, 'matrix'))
+    for start in range(0, faces, 50000):
+        encodings = rng.normal(size=(min(50000, faces - start), 128))
+        conn.executemany("INSERT INTO image VALUES (?, ?)",
+                         ((start + i + 1, e.tobytes()) for i, e in enumerate(encodings)))
+        matrix.append_many((start + i + 1, e) for i, e in enumerate(encodings))
+    conn.commit()
+    conn.close()
+
+
+def child(mode, directory, faces, lookups):
+    from Database.embeddingMatrix import EmbeddingMatrix
+    from Database.embeddingStore import deserialize_encoding
+
+    baseline = rss()['RssAnon']
+    start = time.perf_counter()
+    if mode == 'rows':
+        conn = sqlite3.connect(os.path.join(directory, 'rows.db'))
+        store = {image_id: deserialize_encoding(blob)
+                 for image_id, blob in conn.execute("SELECT image_id, face_encoding FROM image")}
+        get = store.get
+    else:
+        get = EmbeddingMatrix(os.path.join(directory, 'matrix')).get
+    startup = time.perf_counter() - start
+
+    ids = np.random.default_rng(1).integers(1, faces + 1, size=lookups)
+    start = time.perf_counter()
+    for image_id in ids:
+        get(int(image_id))
+    per_lookup = (time.perf_counter() - start) / lookups
+
+    memory = rss()
+    print(f"  {mode:<7} startup {startup * 1000:9.1f} ms  lookup {per_lookup * 1e6:6.1f} us  "
+          f"RssAnon +{memory['RssAnon'] - baseline:7.1f} MB  RssFile {memory['RssFile']:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--faces', default='10000,100000,1000000')
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--child', nargs=3, metavar=('MODE', 'DIR', 'FACES'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        mode, directory, faces = args.child
+        child(mode, directory, int(faces), args.lookups)
+        return
+
+    for faces in (int(n) for n in args.faces.split(',')):
+        directory = tempfile.mkdtemp()
+        build(directory, faces)
+        print(f"{faces} faces")
+        for mode in ('rows', 'matrix'):
+            subprocess.run([sys.executable, __file__, '--lookups', str(args.lookups),
+                            '--child', mode, directory, str(faces)], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Faces/sec of each face detector backend of Extraction.imageCompare on a
+sample set of images, detecting on the same downscaled copy the service
+uses (DETECT_MAX_SIDE).
+
+Usage:
+    python benchmarks/bench_face_detectors.py [image or directory ...]
+        [--backends haar,dnn,hog,cnn] [--upsample N] [--repeat N]
+
+Without images a synthetic 4032x3024 photo is used, which measures speed
+only (no detector finds a face in it). The dnn backend needs FACE_DNN_MODEL
+(and FACE_DNN_CONFIG); without it the Haar cascade is measured in its place.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Extraction.imageCompare import Image_compare, get_detector
+from Extraction.preprocess import read_image
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def sample_images(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(os.path.join(path, name) for name in os.listdir(path) if name.lower().endswith(EXTENSIONS))
+        else:
+            yield path
+
+
+def synthetic_image():
+    rng = np.random.default_rng(0)
+    image = rng.integers(90, 160, size=(3024, 4032, 3), dtype=np.uint8)
+    path = os.path.join(tempfile.mkdtemp(), 'synthetic.jpg')
+    cv2.imwrite(path, image)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--backends', default='haar,dnn,hog,cnn')
+    parser.add_argument('--upsample', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    paths = list(sample_images(args.images)) or [synthetic_image()]
+    rgbs = [cv2.cvtColor(read_image(path), cv2.COLOR_BGR2RGB) for path in paths]
+    print(f"{len(rgbs)} images, {args.repeat} passes each")
+
+    for name in args.backends.split(','):
+        try:
+            backend = get_detector(name)
+        except Exception as e:
+            print(f"  {name:<5} unavailable: {e}")
+            continue
+        comparator = Image_compare(detector=backend, upsample=args.upsample)
+        comparator.locate_faces(rgbs[0])  # warm up
+
+        faces, found = 0, 0
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for rgb in rgbs:
+                boxes = comparator.locate_faces(rgb)
+                faces += len(boxes)
+                found += bool(boxes)
+        elapsed = time.perf_counter() - start
+        images = len(rgbs) * args.repeat
+        label = name if backend.name == name else f"{name} ({backend.name})"
+        print(f"  {label:<12} {images / elapsed:8.1f} images/s  {faces / elapsed:8.1f} faces/s  "
+              f"{elapsed / images * 1000:8.1f} ms/image  face found in {found / images:.0%} of images")
+
+
+if __name__ == '__main__':
+    main()
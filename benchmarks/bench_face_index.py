@@ -0,0 +1,85 @@
+"""
+Insert rate, search latency and recall of the duplicate-face index
+(Database.faceIndex) against an exact scan of every registered face.
+
+Usage:
+    python benchmarks/bench_face_index.py [--faces N] [--queries N] [--nprobe 4,8,16]
+
+Synthetic 128-d embeddings are drawn around random unit-norm identities,
+one face per identity, like a population registering once. Each query is a
+fresh noisy sample of an indexed identity, i.e. the same person registering
+again, and counts as recalled when the index returns the face the exact
+scan finds nearest.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Database.embeddingMatrix import EmbeddingMatrix
+from Database.faceIndex import FaceIndex
+
+NOISE = 0.03
+
+
+def identities(rng, count, dim=128):
+    centers = rng.normal(size=(count, dim)).astype(np.float32)
+    return centers / np.linalg.norm(centers, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--faces', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=10000)
+    parser.add_argument('--nprobe', default='1,4,8,16,32')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    directory = tempfile.mkdtemp()
+    matrix = EmbeddingMatrix(os.path.join(directory, 'embeddings'))
+    index = FaceIndex(matrix, os.path.join(directory, 'face_index'), train_min=args.faces + 1)
+
+    start = time.perf_counter()
+    for offset in range(0, args.faces, args.batch):
+        count = min(args.batch, args.faces - offset)
+        faces = identities(rng, count) + rng.normal(scale=NOISE, size=(count, 128)).astype(np.float32)
+        matrix.append_many((offset + i, face) for i, face in enumerate(faces))
+        index.update()
+    elapsed = time.perf_counter() - start
+    print(f"inserted {args.faces} faces in {elapsed:.1f} s ({args.faces / elapsed:,.0f} faces/s)")
+
+    vectors = np.asarray(matrix.snapshot()[2])
+    picked = rng.choice(args.faces, size=args.queries, replace=False)
+    queries = vectors[picked] + rng.normal(scale=NOISE, size=(args.queries, 128)).astype(np.float32)
+
+    def measure(label):
+        latencies, hits = [], 0
+        for query, truth in zip(queries, expected):
+            start = time.perf_counter()
+            found = index.search(query, k=1)
+            latencies.append(time.perf_counter() - start)
+            hits += bool(found) and found[0]['image_id'] == truth
+        latencies.sort()
+        print(f"  {label:<22} p50 {latencies[len(latencies) // 2] * 1000:8.2f} ms  "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:8.2f} ms  recall@1 {hits / len(queries):.3f}")
+
+    expected = [int(np.argmin(np.linalg.norm(vectors - query, axis=1))) for query in queries]
+    print("search")
+    measure("exact scan (untrained)")
+
+    start = time.perf_counter()
+    index.train()
+    print(f"trained {index.stats()['nlist']} lists in {time.perf_counter() - start:.1f} s")
+    for nprobe in (int(n) for n in args.nprobe.split(',')):
+        index.nprobe = nprobe
+        measure(f"IVF nprobe={nprobe}")
+
+
+if __name__ == '__main__':
+    main()
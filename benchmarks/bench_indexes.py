@@ -0,0 +1,116 @@
+"""
+Query plans and latency of the lookups behind user.images, user.documents
+and /verify-user's token check, before and after the user_id and
+token_hash indexes (migration 0003).
+
+Usage:
+    python benchmarks/bench_indexes.py [--rows N] [--users N] [--queries N] [--database-uri URI]
+
+Fills image and document with N rows each (default 1,000,000) spread over
+--users users, one profile with a token per user, then runs the same queries
+without and with the indexes and prints SQLite's EXPLAIN QUERY PLAN.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Database.flaskSQL import User, Profile, Image, Document, db, hash_token
+
+INDEXES = ['ix_image_user_id', 'ix_document_user_id', 'ix_profile_token_hash']
+CHUNK = 50000
+
+
+def fill(conn, rows, users):
+    conn.execute(sa.insert(User), [{'user_id': i, 'name': f"USER {i}"} for i in range(1, users + 1)])
+    conn.execute(sa.insert(Profile), [
+        {'user_id': i, 'verification': True, 'token': f"token-{i}", 'token_hash': hash_token(f"token-{i}")}
+        for i in range(1, users + 1)
+    ])
+    for start in range(0, rows, CHUNK):
+        ids = range(start, min(rows, start + CHUNK))
+        conn.execute(sa.insert(Image), [
+            {'image_url': f"aa/bb/{i:064x}.jpg", 'user_id': random.randint(1, users)} for i in ids
+        ])
+        conn.execute(sa.insert(Document), [
+            {'document_url': f"aa/bb/{i:064x}.jpg", 'document_name': f"d{i}.jpg", 'document_type': 'ID',
+             'user_id': random.randint(1, users)} for i in ids
+        ])
+
+
+def queries(users):
+    """ The statements the app issues, with a random bound parameter """
+    return {
+        'user.images': (sa.select(Image).where(Image.user_id == sa.bindparam('v')),
+                        lambda: random.randint(1, users)),
+        'user.documents': (sa.select(Document).where(Document.user_id == sa.bindparam('v')),
+                           lambda: random.randint(1, users)),
+        'token lookup': (sa.select(Profile).where(Profile.token_hash == sa.bindparam('v')),
+                         lambda: hash_token(f"token-{random.randint(1, users)}"))
+    }
+
+
+def plan(conn, statement, value):
+    sql = str(statement.compile(conn))
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", (value,)).all()
+    return '; '.join(row[-1] for row in rows)
+
+
+def measure(conn, label, users, count):
+    print(label)
+    for name, (statement, value) in queries(users).items():
+        print(f"  {name:<15} plan: {plan(conn, statement, value())}")
+        # Stop early after 5 s: full scans take long enough to time with fewer runs
+        repeats = 0
+        start = time.perf_counter()
+        while repeats < count and time.perf_counter() - start < 5:
+            conn.execute(statement, {'v': value()}).all()
+            repeats += 1
+        elapsed = (time.perf_counter() - start) / repeats
+        print(f"  {name:<15} {elapsed * 1000:9.3f} ms/query over {repeats} queries")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--database-uri')
+    args = parser.parse_args()
+
+    uri = args.database_uri or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'indexes.db')}"
+    engine = sa.create_engine(uri)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # Schema as it was before migration 0003
+        for name in INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX {name}")
+        start = time.perf_counter()
+        fill(conn, args.rows, args.users)
+        print(f"{args.rows} images, {args.rows} documents, {args.users} users on {uri} "
+              f"(filled in {time.perf_counter() - start:.1f} s)")
+
+    with engine.connect() as conn:
+        measure(conn, "Without indexes", args.users, args.queries)
+
+    with engine.begin() as conn:
+        start = time.perf_counter()
+        for table in (Image.__table__, Document.__table__, Profile.__table__):
+            for index in table.indexes:
+                if index.name in INDEXES:
+                    index.create(bind=conn)
+        print(f"Indexes built in {time.perf_counter() - start:.1f} s")
+
+    with engine.connect() as conn:
+        measure(conn, "With indexes", args.users, args.queries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Compare per-document OCR latency and peak RSS of the pytesseract backend
+(a tesseract process per image) against pooled in-process tesserocr handles.
+
+Usage:
+    python benchmarks/bench_ocr_backends.py [image ...] [--repeat N] [--config "--psm 6"]
+
+Without images a synthetic ID-card-sized JPEG is used. Each backend runs in
+a fresh process so peak RSS isn't shared; for pytesseract the peak of the
+tesseract child processes is reported separately. The OCR cache is
+disabled so every document is recognised.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.append(SRC)
+
+
+def synthetic_image(path):
+    image = np.full((1012, 1600, 3), 235, dtype=np.uint8)
+    cv2.putText(image, "JOHN DOE", (120, 400), cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 8)
+    cv2.putText(image, "1990-01-02", (120, 600), cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 8)
+    cv2.imwrite(path, image)
+    return path
+
+
+def run_backend(name, images, repeat, config, results):
+    from Extraction.imageO import ImageExtractor, OCRCache
+    from Extraction.ocrBackends import create_ocr_backend
+
+    backend = create_ocr_backend(name, config=config)
+    if backend.name != name:
+        results.put((name, None))
+        return
+    extractor = ImageExtractor(cache=OCRCache(memory_items=0), tesseract_config=config, ocr_backend=backend)
+
+    extractor.process_and_extract(images[0])  # warm up
+    timings = []
+    for _ in range(repeat):
+        for path in images:
+            start = time.perf_counter()
+            text = extractor.process_and_extract(path)
+            timings.append(time.perf_counter() - start)
+            if text.startswith('Error processing image'):
+                raise RuntimeError(text)
+
+    # ru_maxrss is in KiB on Linux
+    results.put((name, {
+        'timings': timings,
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'child_rss': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--config', default='', help='tesseract config string')
+    parser.add_argument('--backends', default='pytesseract,tesserocr')
+    args = parser.parse_args()
+
+    images = args.images or [synthetic_image(os.path.join(tempfile.mkdtemp(), 'card.jpg'))]
+    context = multiprocessing.get_context('spawn')
+
+    print(f"{len(images)} image(s) x {args.repeat} repeats, config={args.config!r}")
+    for name in args.backends.split(','):
+        results = context.Queue()
+        process = context.Process(target=run_backend, args=(name, images, args.repeat, args.config, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            print(f"  {name:<12} failed (exit code {process.exitcode})")
+            continue
+
+        _, result = results.get()
+        if result is None:
+            print(f"  {name:<12} not available")
+            continue
+
+        timings = sorted(result['timings'])
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"  {name:<12} mean {statistics.mean(timings) * 1000:8.1f} ms  p95 {p95 * 1000:8.1f} ms  "
+              f"peak RSS {result['rss'] / 2**20:7.1f} MiB  child peak RSS {result['child_rss'] / 2**20:7.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
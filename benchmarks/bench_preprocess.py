@@ -0,0 +1,104 @@
+"""
+Compare the full-resolution path against downscale-before-detect for face
+detection and OCR preprocessing.
+
+Usage:
+    python benchmarks/bench_preprocess.py [image ...] [--repeat N] [--ocr]
+
+Without images a synthetic 4032x3024 (12 MP phone camera) JPEG is used.
+Face detection is skipped if face_recognition is not installed; --ocr also
+runs Tesseract on both binarized images.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Extraction.preprocess import DETECT_MAX_SIDE, OCR_MAX_SIDE, downscale, read_scaled, scale_boxes
+
+
+def measure(fn, repeat):
+    """ Return (mean seconds, peak traced bytes) over repeat runs """
+    fn()  # warm up
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def synthetic_image(path):
+    rng = np.random.default_rng(0)
+    image = rng.integers(90, 160, size=(3024, 4032, 3), dtype=np.uint8)
+    cv2.putText(image, "JOHN DOE 1990-01-02", (400, 1500), cv2.FONT_HERSHEY_SIMPLEX, 8, (0, 0, 0), 20)
+    cv2.imwrite(path, image)
+    return path
+
+
+def ocr_full(path):
+    gray = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2GRAY)
+    return cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+
+def ocr_reduced(path):
+    gray, _ = read_scaled(path, OCR_MAX_SIDE, grayscale=True)
+    return cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+
+def report(label, full, reduced):
+    print(f"  {label:<22} full {full[0] * 1000:8.1f} ms {full[1] / 2**20:7.1f} MiB | "
+          f"reduced {reduced[0] * 1000:8.1f} ms {reduced[1] / 2**20:7.1f} MiB | "
+          f"x{full[0] / max(reduced[0], 1e-9):.1f} faster")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--ocr', action='store_true', help='also time Tesseract')
+    args = parser.parse_args()
+
+    images = args.images or [synthetic_image(os.path.join(tempfile.mkdtemp(), 'synthetic.jpg'))]
+
+    try:
+        import face_recognition
+    except ImportError:
+        face_recognition = None
+        print("face_recognition not installed, skipping face detection")
+
+    print(f"DETECT_MAX_SIDE={DETECT_MAX_SIDE} OCR_MAX_SIDE={OCR_MAX_SIDE} repeat={args.repeat}")
+    for path in images:
+        height, width = cv2.imread(path).shape[:2]
+        print(f"{path} ({width}x{height})")
+
+        report("OCR preprocess", measure(lambda: ocr_full(path), args.repeat),
+               measure(lambda: ocr_reduced(path), args.repeat))
+
+        if args.ocr:
+            import pytesseract
+            report("OCR preprocess+tess", measure(lambda: pytesseract.image_to_string(ocr_full(path)), 1),
+                   measure(lambda: pytesseract.image_to_string(ocr_reduced(path)), 1))
+
+        if face_recognition is not None:
+            rgb = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+
+            def detect_reduced():
+                small, scale = downscale(rgb, DETECT_MAX_SIDE)
+                return scale_boxes(face_recognition.face_locations(small), scale, rgb.shape)
+
+            report("face detect (HOG)", measure(lambda: face_recognition.face_locations(rgb), args.repeat),
+                   measure(detect_reduced, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
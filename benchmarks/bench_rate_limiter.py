@@ -0,0 +1,85 @@
+"""
+Throughput of the rate limiter check itself, for Flask-Limiter's default
+memory:// storage and the shared SQLite storage (Database.rateLimitStore),
+and how many requests each lets through when several worker processes
+share one limit.
+
+Usage:
+    python benchmarks/bench_rate_limiter.py [--processes N] [--checks N] [--keys N]
+
+Each process calls the limiter's hit() --checks times over --keys client
+addresses with a limit that is never reached, then all processes hit one
+"30 per minute" key 100 times each. With per-process memory storage every
+worker allows 30; with the shared storage they allow 30 together.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from limits import parse, storage, strategies
+
+import Database.rateLimitStore  # registers sqlite://
+
+STRATEGIES = {
+    'fixed-window': strategies.FixedWindowRateLimiter,
+    'sliding-window-counter': strategies.SlidingWindowCounterRateLimiter
+}
+
+
+def worker(uri, strategy, checks, keys, shared_hits, results):
+    limiter = STRATEGIES[strategy](storage.storage_from_string(uri))
+    roomy = parse("1000000 per hour")
+    start = time.perf_counter()
+    for i in range(checks):
+        limiter.hit(roomy, f"10.0.{i % keys // 256}.{i % 256}")
+    elapsed = time.perf_counter() - start
+
+    strict = parse("30 per minute")
+    allowed = sum(limiter.hit(strict, "203.0.113.7") for _ in range(shared_hits))
+    results.put((checks, elapsed, allowed))
+
+
+def run(label, uri, strategy, args):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(uri, strategy, args.checks, args.keys, 100, results))
+        for _ in range(args.processes)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    wall = time.perf_counter() - start
+
+    checks = sum(c for c, _, _ in collected)
+    per_check = sum(e for _, e, _ in collected) / checks
+    allowed = sum(a for _, _, a in collected)
+    print(f"  {label:<44} {checks / wall:9.0f} checks/s total  {per_check * 1e6:7.1f} us/check  "
+          f"shared limit 30/min allowed {allowed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--checks', type=int, default=20000)
+    parser.add_argument('--keys', type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{args.processes} processes x {args.checks} checks over {args.keys} client keys")
+    for strategy in STRATEGIES:
+        print(strategy)
+        run("memory:// (per process)", "memory://", strategy, args)
+        path = os.path.join(tempfile.mkdtemp(), 'ratelimit.db')
+        run("sqlite:// (shared)", f"sqlite:///{path}", strategy, args)
+
+
+if __name__ == '__main__':
+    main()
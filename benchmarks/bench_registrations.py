@@ -0,0 +1,107 @@
+"""
+Compare registration write throughput: the per-object ORM path that
+get_document used (add User, flush, add Image/Document/Profile, commit),
+UserRepository with one transaction per registration, and UserRepository
+with many registrations per transaction (group commit).
+
+Usage:
+    python benchmarks/bench_registrations.py [--count N] [--group N] [--database-uri URI]
+
+Defaults to a fresh SQLite file in a temporary directory. Rows/sec counts
+the User, Image, Document and Profile rows written.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+from flask import Flask
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Database.flaskSQL import User, Profile, Image, Document, db
+from Database.blobRefs import acquire_blob
+from Database.userRepository import UserRepository
+
+ROWS_PER_REGISTRATION = 5  # User, 2 Image, Document, Profile
+
+
+def registration(i):
+    return {
+        'name': f"USER {i}",
+        'date_of_birth': date(1990, 1, 2),
+        'images': [
+            {'image_url': f"aa/bb/front{i}.jpg", 'content_hash': f"{i:064x}", 'size': 1000},
+            {'image_url': f"aa/bb/back{i}.jpg", 'content_hash': f"{i + 10**9:064x}", 'size': 1000}
+        ],
+        'documents': [{
+            'document_url': f"aa/bb/front{i}.jpg",
+            'document_name': f"front_{i}.jpg",
+            'document_type': 'ID',
+            'extracted_text': f"USER {i}\n1990-01-02\n",
+            'content_hash': f"{i:064x}",
+            'size': 1000
+        }]
+    }
+
+
+def orm_path(registrations, group):
+    for r in registrations:
+        user = User(name=r['name'], date_of_birth=r['date_of_birth'])
+        db.session.add(user)
+        db.session.flush()
+        for image in r['images']:
+            db.session.add(Image(image_url=image['image_url'], content_hash=image['content_hash'], user_id=user.user_id))
+            acquire_blob(image['content_hash'], image['image_url'], image['size'])
+        for document in r['documents']:
+            db.session.add(Document(
+                document_url=document['document_url'], document_name=document['document_name'],
+                document_type=document['document_type'], extracted_text=document['extracted_text'],
+                content_hash=document['content_hash'], user_id=user.user_id
+            ))
+            acquire_blob(document['content_hash'], document['document_url'], document['size'])
+        db.session.add(Profile(user_id=user.user_id, verification=True))
+        db.session.commit()
+
+
+def repository_path(registrations, group):
+    repository = UserRepository()
+    for start in range(0, len(registrations), group):
+        repository.create_users(registrations[start:start + group])
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--group', type=int, default=64, help='registrations per group commit')
+    parser.add_argument('--database-uri')
+    args = parser.parse_args()
+
+    uri = args.database_uri or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    db.init_app(app)
+
+    cases = [
+        ('ORM add/flush/commit', orm_path, 1),
+        ('repository, 1 per txn', repository_path, 1),
+        (f"repository, {args.group} per txn", repository_path, args.group)
+    ]
+    print(f"{args.count} registrations per case on {uri}")
+    with app.app_context():
+        for offset, (label, run, group) in enumerate(cases):
+            db.drop_all()
+            db.create_all()
+            registrations = [registration(offset * args.count + i) for i in range(args.count)]
+            start = time.perf_counter()
+            run(registrations, group)
+            elapsed = time.perf_counter() - start
+            rows = args.count * ROWS_PER_REGISTRATION
+            print(f"  {label:<26} {elapsed:7.2f} s  {args.count / elapsed:9.0f} registrations/s  {rows / elapsed:9.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare whole-card OCR against region-of-interest OCR (only the detected
+text lines, or the fields of a document_type template).
+
+Usage:
+    python benchmarks/bench_roi_ocr.py [image ...] [--repeat N] [--backend tesserocr]
+                                       [--templates templates.json --document-type ID]
+                                       [--roi-workers N]
+
+Without images a synthetic ID card is used. The OCR cache is disabled so
+every crop is recognised; the share of card pixels sent to Tesseract is
+reported next to the latency.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Extraction.imageO import ImageExtractor, OCRCache, load_field_templates
+from Extraction.ocrBackends import create_ocr_backend
+
+
+class CountingBackend:
+    """ Wraps an OCR backend to count the pixels it is asked to read """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.name = backend.name
+        self.pixels = 0
+
+    def image_to_string(self, image, config=''):
+        self.pixels += image.shape[0] * image.shape[1]
+        return self.backend.image_to_string(image, config=config)
+
+    def stats(self):
+        return self.backend.stats()
+
+
+def synthetic_card(path):
+    image = np.full((1012, 1600, 3), 235, dtype=np.uint8)
+    cv2.rectangle(image, (1150, 150), (1500, 600), (60, 60, 60), -1)
+    cv2.putText(image, "REPUBLIC ID CARD", (100, 120), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 5)
+    cv2.putText(image, "JOHN DOE", (100, 400), cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 8)
+    cv2.putText(image, "1990-01-02", (100, 600), cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 8)
+    cv2.putText(image, "ADDRESS 1 MAIN ST", (100, 800), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 5)
+    cv2.imwrite(path, image)
+    return path
+
+
+def run(extractor, counter, path, document_type, repeat):
+    """ Return (mean seconds, share of card pixels OCRed, parsed fields) """
+    counter.pixels = 0
+    text = extractor.process_and_extract(path, document_type=document_type)
+    if text.startswith('Error processing image'):
+        raise RuntimeError(text)
+    area = counter.pixels / extractor.last_processed_image.size
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        extractor.process_and_extract(path, document_type=document_type)
+    return (time.perf_counter() - start) / repeat, area, extractor.parse_ocr_data(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--backend', default='pytesseract')
+    parser.add_argument('--templates', help='field template JSON, see OCR_TEMPLATES_PATH')
+    parser.add_argument('--document-type')
+    parser.add_argument('--roi-workers', type=int, default=1)
+    args = parser.parse_args()
+
+    images = args.images or [synthetic_card(os.path.join(tempfile.mkdtemp(), 'card.jpg'))]
+    counter = CountingBackend(create_ocr_backend(args.backend))
+    templates = load_field_templates(args.templates) if args.templates else {}
+
+    def extractor(mode):
+        return ImageExtractor(cache=OCRCache(memory_items=0), ocr_backend=counter, mode=mode,
+                              templates=templates, roi_workers=args.roi_workers)
+
+    full, roi = extractor('full'), extractor('roi')
+    print(f"backend={counter.name} roi_workers={args.roi_workers} repeat={args.repeat}")
+    for path in images:
+        print(path)
+        full_time, full_area, full_fields = run(full, counter, path, args.document_type, args.repeat)
+        roi_time, roi_area, roi_fields = run(roi, counter, path, args.document_type, args.repeat)
+        print(f"  full {full_time * 1000:8.1f} ms {full_area:6.1%} of pixels  {full_fields}")
+        print(f"  roi  {roi_time * 1000:8.1f} ms {roi_area:6.1%} of pixels  {roi_fields}  "
+              f"x{full_time / max(roi_time, 1e-9):.1f} faster")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+HTTP load test for a running collect server, e.g. the development server
+(python src/dataCollection/collect.py) against gunicorn -c gunicorn.conf.py.
+
+Usage:
+    python benchmarks/load_test.py [--url URL] [--scenario NAME] [--concurrency N]
+                                   [--seconds S] [--image FRONT.jpg] [--selfie SELFIE.jpg]
+
+Scenarios:
+    verify      GET /verify-user with a token (I/O bound)
+    documents   POST /get-documents with --image as front and back (CPU bound)
+    token       POST /generate-token with --selfie (CPU bound)
+    mixed       verify with one in five requests a documents upload
+
+A user is registered with --image and a token issued with --selfie first;
+without images a synthetic card is used, which only gets a token when the
+face models are stubbed out. Reports requests/sec, latency percentiles and
+status codes.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib import request as urlrequest
+from urllib.error import HTTPError
+
+
+def synthetic_card():
+    import cv2
+    import numpy as np
+
+    image = np.full((400, 300, 3), 120, np.uint8)
+    image[100:300, 75:225] = 200
+    cv2.putText(image, 'JOHN DOE', (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    cv2.putText(image, '1990-01-02', (20, 360), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    return cv2.imencode('.jpg', image)[1].tobytes()
+
+
+def multipart(files, fields=None):
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, value in (fields or {}).items():
+        body += f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode()
+    for name, data in files.items():
+        # Document names are unique per upload second and filename, so vary the filename
+        body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{boundary[:8]}.jpg\"\r\n"
+                 f"Content-Type: image/jpeg\r\n\r\n").encode()
+        body += data + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return bytes(body), f"multipart/form-data; boundary={boundary}"
+
+
+def call(url, data=None, headers=None, content_type=None):
+    req = urlrequest.Request(url, data=data, headers=dict(headers or {}))
+    if content_type:
+        req.add_header('Content-Type', content_type)
+    try:
+        with urlrequest.urlopen(req, timeout=120) as response:
+            return response.status, response.read()
+    except HTTPError as e:
+        return e.code, e.read()
+
+
+class Scenario:
+    def __init__(self, url, image, selfie):
+        self.url = url.rstrip('/')
+        self.image = image
+        self.selfie = selfie
+        self.token = None
+
+    def setup(self):
+        status, body = self.documents()
+        if status != 200:
+            raise SystemExit(f"Registration failed: {status} {body[:200]}")
+        status, body = self.generate_token()
+        if status == 200:
+            self.token = json.loads(body)['access_token']
+        else:
+            print(f"No token ({status}); verify requests will be rejected")
+
+    def documents(self):
+        data, content_type = multipart({'documentFront': self.image, 'documentBack': self.image}, {'document_type': 'ID'})
+        return call(f"{self.url}/get-documents", data, content_type=content_type)
+
+    def generate_token(self):
+        data, content_type = multipart({'selfie': self.selfie})
+        return call(f"{self.url}/generate-token", data, content_type=content_type)
+
+    def verify(self):
+        return call(f"{self.url}/verify-user", headers={'Authorization': f"Bearer {self.token}"})
+
+
+def run(scenario, name, concurrency, seconds):
+    actions = {
+        'verify': lambda i: scenario.verify(),
+        'documents': lambda i: scenario.documents(),
+        'token': lambda i: scenario.generate_token(),
+        'mixed': lambda i: scenario.documents() if i % 5 == 0 else scenario.verify()
+    }
+    action = actions[name]
+    deadline = time.perf_counter() + seconds
+    latencies, statuses, lock = [], Counter(), threading.Lock()
+
+    def client(offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status, _ = action(i)
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] += 1
+            i += concurrency
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+
+    def percentile(q):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000 if latencies else float('nan')
+
+    print(f"{name:<10} c={concurrency:<3} {len(latencies) / wall:8.1f} req/s  p50 {percentile(0.5):7.1f} ms  "
+          f"p99 {percentile(0.99):7.1f} ms  statuses {dict(statuses)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=os.getenv('LOAD_TEST_URL', 'http://127.0.0.1:5000'))
+    parser.add_argument('--scenario', default='all', choices=['all', 'verify', 'documents', 'token', 'mixed'])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--image')
+    parser.add_argument('--selfie')
+    args = parser.parse_args()
+
+    image = open(args.image, 'rb').read() if args.image else synthetic_card()
+    selfie = open(args.selfie, 'rb').read() if args.selfie else image
+    scenario = Scenario(args.url, image, selfie)
+    scenario.setup()
+
+    # token last: each issued token supersedes the one the other scenarios use
+    names = ['verify', 'documents', 'mixed', 'token'] if args.scenario == 'all' else [args.scenario]
+    for name in names:
+        run(scenario, name, args.concurrency, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
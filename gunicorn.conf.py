@@ -0,0 +1,49 @@
+"""
+gunicorn settings for the collect app:
+
+    gunicorn -c gunicorn.conf.py
+
+Web workers are threaded (gthread): most request time is spent waiting on
+the database, storage and the face/OCR process pools, so threads serve
+I/O-bound endpoints like /verify-user concurrently. CPU-bound work (face
+encoding, OCR) runs in each web worker's process pools, which split the
+host's cores between the web workers, and /get-documents and
+/generate-token may hold at most CPU_REQUEST_SLOTS threads of a worker.
+
+The app and its dlib/Tesseract models are loaded once in the master
+(preload_app) and shared copy-on-write by the forked workers.
+"""
+import os
+import multiprocessing
+
+wsgi_app = 'dataCollection.wsgi:create_app()'
+pythonpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+bind = os.getenv('BIND', f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 5000)}")
+
+preload_app = True
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_WORKERS', 2))
+threads = int(os.getenv('WEB_THREADS', 8))
+# Face verification and synchronous OCR can take a while on a busy host
+timeout = int(os.getenv('WEB_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then to bound fragmentation from large image buffers
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+# Size the process pools before the app is imported in the master
+cores = multiprocessing.cpu_count()
+os.environ.setdefault('FACE_ENGINE_WORKERS', str(max(1, cores // workers)))
+os.environ.setdefault('OCR_WORKERS', str(max(1, cores // workers)))
+os.environ.setdefault('CPU_REQUEST_SLOTS', str(max(1, threads // 2)))
+
+
+def post_fork(server, worker):
+    from dataCollection.wsgi import after_fork
+    # age counts the workers spawned since the master started: only the first
+    # requeues interrupted OCR jobs, not each worker or later replacements
+    after_fork(requeue_jobs=worker.age == 1)
@@ -0,0 +1,72 @@
+import os
+import sys
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import engine_from_config, pool
+from sqlalchemy.engine import make_url
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Database.flaskSQL import db
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+
+def database_url():
+    """
+    URL of the database to migrate, from `alembic -x url=...` or DATABASE_URI.
+    There is no default: collect.py and mod.py resolve a relative SQLite path
+    against their own instance folders, so a guess could migrate the wrong
+    file. Give SQLite databases by absolute path.
+    """
+    url = context.get_x_argument(as_dictionary=True).get('url') or os.getenv('DATABASE_URI')
+    if not url:
+        raise SystemExit("Set DATABASE_URI (or pass -x url=...) to the database the app uses, "
+                         "e.g. sqlite:////app/src/dataCollection/instance/uiv.db")
+    parsed = make_url(url)
+    if parsed.get_backend_name() == 'sqlite' and parsed.database not in (None, '', ':memory:') \
+            and not os.path.isabs(parsed.database):
+        raise SystemExit(f"Relative SQLite path in {url}: the apps resolve it against their instance folder, "
+                         "give the absolute path of the database file instead")
+    return url
+
+
+config.set_main_option('sqlalchemy.url', database_url().replace('%', '%%'))
+target_metadata = db.metadata
+
+
+def run_migrations_offline():
+    context.configure(
+        url=config.get_main_option('sqlalchemy.url'),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=True
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connectable = engine_from_config(
+        config.get_section(config.config_ini_section, {}),
+        prefix='sqlalchemy.',
+        poolclass=pool.NullPool
+    )
+    with connectable.connect() as connection:
+        # SQLite can't ALTER most things in place; batch mode rebuilds the table
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            render_as_batch=connection.dialect.name == 'sqlite'
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
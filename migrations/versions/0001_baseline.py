@@ -0,0 +1,57 @@
+"""Baseline schema: user, profile, image, document
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+Databases created by db.create_all() before migrations existed already have
+these tables; mark them with `alembic stamp 0001` and upgrade from there.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user',
+        sa.Column('user_id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(100), nullable=True),
+        sa.Column('date_of_birth', sa.Date(), nullable=True)
+    )
+    op.create_table(
+        'profile',
+        sa.Column('profile_ID', sa.Integer(), primary_key=True),
+        sa.Column('verification', sa.Boolean(), nullable=False),
+        sa.Column('token', sa.String(255), nullable=True),
+        sa.Column('token_expiry', sa.DateTime(), nullable=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.user_id'), nullable=False, unique=True)
+    )
+    op.create_table(
+        'image',
+        sa.Column('image_id', sa.Integer(), primary_key=True),
+        sa.Column('image_url', sa.String(), nullable=False),
+        sa.Column('upload_date', sa.DateTime(), nullable=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.user_id'), nullable=True)
+    )
+    op.create_table(
+        'document',
+        sa.Column('document_id', sa.Integer(), primary_key=True),
+        sa.Column('document_url', sa.String(), nullable=False),
+        sa.Column('document_name', sa.String(15), nullable=False, unique=True),
+        sa.Column('document_type', sa.String(15), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.user_id'), nullable=True),
+        sa.Column('extracted_text', sa.Text(), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_table('document')
+    op.drop_table('image')
+    op.drop_table('profile')
+    op.drop_table('user')
@@ -0,0 +1,77 @@
+"""Stored face encodings, content-addressed blobs and OCR jobs
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases the apps have run against already have some of these (earlier
+    # versions added them at startup, db.create_all() creates new tables in
+    # full), so only create what is missing
+    image_columns = _columns('image')
+    with op.batch_alter_table('image') as batch:
+        if 'face_encoding' not in image_columns:
+            batch.add_column(sa.Column('face_encoding', sa.LargeBinary(), nullable=True))
+        if 'content_hash' not in image_columns:
+            batch.add_column(sa.Column('content_hash', sa.String(64), nullable=True))
+    if 'ix_image_content_hash' not in _indexes('image'):
+        op.create_index('ix_image_content_hash', 'image', ['content_hash'])
+
+    if 'content_hash' not in _columns('document'):
+        with op.batch_alter_table('document') as batch:
+            batch.add_column(sa.Column('content_hash', sa.String(64), nullable=True))
+    if 'ix_document_content_hash' not in _indexes('document'):
+        op.create_index('ix_document_content_hash', 'document', ['content_hash'])
+
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'blob' not in tables:
+        op.create_table(
+            'blob',
+            sa.Column('content_hash', sa.String(64), primary_key=True),
+            sa.Column('storage_path', sa.String(), nullable=False),
+            sa.Column('size', sa.Integer(), nullable=True),
+            sa.Column('ref_count', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True)
+        )
+    if 'job' not in tables:
+        op.create_table(
+            'job',
+            sa.Column('job_id', sa.String(32), primary_key=True),
+            sa.Column('status', sa.String(15), nullable=False),
+            sa.Column('document_url', sa.String(), nullable=False),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.user_id'), nullable=True),
+            sa.Column('document_id', sa.Integer(), sa.ForeignKey('document.document_id'), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True)
+        )
+
+
+def downgrade():
+    op.drop_table('job')
+    op.drop_table('blob')
+    with op.batch_alter_table('document') as batch:
+        batch.drop_index('ix_document_content_hash')
+        batch.drop_column('content_hash')
+    with op.batch_alter_table('image') as batch:
+        batch.drop_index('ix_image_content_hash')
+        batch.drop_column('content_hash')
+        batch.drop_column('face_encoding')
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
@@ -0,0 +1,69 @@
+"""Index image/document user_id and profile token_hash
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+user.images and user.documents filter on user_id, which had no index, and
+/verify-user matched tokens by string. token_hash (SHA-256 of the token) is
+filled in for tokens already issued so they keep working after the upgrade.
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created by db.create_all() already have these, so skip whatever exists
+    if 'ix_image_user_id' not in _indexes('image'):
+        op.create_index('ix_image_user_id', 'image', ['user_id'])
+    if 'ix_document_user_id' not in _indexes('document'):
+        op.create_index('ix_document_user_id', 'document', ['user_id'])
+
+    if 'token_hash' not in _columns('profile'):
+        with op.batch_alter_table('profile') as batch:
+            batch.add_column(sa.Column('token_hash', sa.String(64), nullable=True))
+
+    profile = sa.table(
+        'profile',
+        sa.column('profile_ID', sa.Integer),
+        sa.column('token', sa.String),
+        sa.column('token_hash', sa.String)
+    )
+    conn = op.get_bind()
+    rows = conn.execute(sa.select(profile.c.profile_ID, profile.c.token).where(
+        profile.c.token.isnot(None), profile.c.token_hash.is_(None)
+    )).all()
+    for profile_id, token in rows:
+        conn.execute(profile.update().where(profile.c.profile_ID == profile_id).values(token_hash=hash_token(token)))
+
+    if 'ix_profile_token_hash' not in _indexes('profile'):
+        op.create_index('ix_profile_token_hash', 'profile', ['token_hash'])
+
+
+def downgrade():
+    op.drop_index('ix_profile_token_hash', 'profile')
+    with op.batch_alter_table('profile') as batch:
+        batch.drop_column('token_hash')
+    op.drop_index('ix_document_user_id', 'document')
+    op.drop_index('ix_image_user_id', 'image')
+
+
+def hash_token(token):
+    # Copy of Database.flaskSQL.hash_token as of this revision, so the migration doesn't change with the app
+    return hashlib.sha256(token.encode()).hexdigest() if token else None
+
+
+def _columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def _indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
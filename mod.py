@@ -1,20 +1,25 @@
-from flask import Flask, request, jsonify, abort
+from flask import Flask, request, jsonify
 import sys
 import os
 import uuid
-import magic
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_bcrypt import Bcrypt
-from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 from flask_jwt_extended import (JWTManager, create_access_token, jwt_required, get_jwt_identity)
 
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.append(project_root)
 
-from Database.flaskSQL import (User, Profile, Image, Document, db)
+from Database.flaskSQL import (User, Profile, db)
+from Database.dbConfig import engine_options, tune_engine
+from Database.userRepository import UserRepository
+from Database.blobRefs import cached_ocr_text, held_blobs, hold_uploads, release_uploads
+from Database.rateLimitStore import storage_uri
+from Storage.contentStore import default_store
+from Storage.uploadStream import UploadReader, UploadRejected
 from Extraction.imageCompare import Image_compare
 from Extraction.imageO import ImageExtractor
 
@@ -34,16 +39,18 @@ app = Flask(__name__)
 bcrypt = Bcrypt(app)
 jwt = JWTManager(app)
 
-# Initialize rate limiter
+# Load environment variables
+load_dotenv()
+
+# Initialize rate limiter. Counters live in a SQLite file shared by all worker
+# processes on the host, so limits aren't multiplied by the worker count
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    storage_uri=storage_uri(),
+    strategy=os.getenv('RATELIMIT_STRATEGY', 'sliding-window-counter')
 )
-
-# Load environment variables
-load_dotenv()
 KEY = os.getenv('JWT_TOKEN')
 
 # Validate required environment variables
@@ -52,71 +59,32 @@ if not os.getenv('JWT_SECRET_KEY'):
     raise EnvironmentError("JWT_SECRET_KEY must be set in environment")
 
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///uiv.db')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
 
-# Define allowed file types and max file size
-ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'pdf'}
+# Define max file size; allowed types are Storage.uploadStream.ALLOWED_EXTENSIONS/ALLOWED_MIME_TYPES
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+# Two documents plus form fields
+MAX_REQUEST_SIZE = 2 * MAX_FILE_SIZE + 64 * 1024
 
 db.init_app(app)
 
 with app.app_context():
+    tune_engine(db.engine)
+    # New tables only; existing databases are upgraded with `alembic upgrade head` at deploy time
     db.create_all()
 
-# Function to check if file is allowed
-def allowed_file(file):
-    # Check file extension
-    if not '.' in file.filename:
-        return False
-    ext = file.filename.rsplit('.', 1)[1].lower()
-    if ext not in ALLOWED_EXTENSIONS:
-        return False
-    
-    # Check file size
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)  # Reset file pointer
-    if file_size > MAX_FILE_SIZE:
-        return False
-    
-    # Verify content type with python-magic
-    mime = magic.Magic(mime=True)
-    file_data = file.read(2048)  # Read a sample of the file
-    file.seek(0)  # Reset file pointer
-    mime_type = mime.from_buffer(file_data)
-    
-    allowed_mime_types = [
-        'image/jpeg', 
-        'image/png', 
-        'application/pdf'
-    ]
-    
-    return mime_type in allowed_mime_types
+# Durable copies of uploads are written in the background while they are processed from memory
+storage_writer = ThreadPoolExecutor(max_workers=2)
 
-# Function to save file to storage with enhanced security
-def save_file_to_storage(file):
-    if not file or not allowed_file(file):
-        logger.warning(f"Invalid file upload attempt: {file.filename if file else 'None'}")
-        raise ValueError("Invalid file type or size")
-    
-    # Generate secure filename with UUID to prevent collisions and path traversal
-    original_extension = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-    secure_filename = f"{uuid.uuid4().hex}.{original_extension}"
-    
-    # Create nested directory structure based on date to organize files
-    upload_date = datetime.now().strftime('%Y/%m/%d')
-    upload_folder = os.path.join('uploads', upload_date)
-    
-    # Create directory if it doesn't exist
-    os.makedirs(upload_folder, exist_ok=True)
-    
-    # Save file
-    file_path = os.path.join(upload_folder, secure_filename)
-    file.save(file_path)
-    
-    logger.info(f"File saved: {file_path}")
-    return file_path
+# Uploads are stored once per unique content, sharded by their SHA-256
+content_store = default_store()
+
+# Uploads are read straight from the request body: each file is checked by extension,
+# sniffed MIME type and size while it is hashed into storage, so a bad upload is refused
+# after its first chunk instead of after Werkzeug has buffered the whole body
+upload_reader = UploadReader(content_store, storage_writer, MAX_FILE_SIZE, MAX_REQUEST_SIZE)
 
 
 # ADDING API ENDPOINTS
@@ -124,31 +92,39 @@ def save_file_to_storage(file):
 @app.route('/get-documents', methods=['POST'])
 @limiter.limit("10/hour")  # Limit to prevent abuse
 def get_document():
+    uploads = {}
     try:
+        # Referenced before they are stored, so a concurrent failing request can't delete them
+        form, uploads = upload_reader.read(request, {'documentBack', 'documentFront'}, reserve=hold_uploads)
+
         # Validate input fields
-        documentType = request.form.get('documentType')
+        documentType = form.get('documentType')
         if not documentType or not isinstance(documentType, str) or len(documentType) > 100:
+            release_uploads(uploads.values(), content_store)
             return jsonify({'error': 'Invalid document type'}), 400
-        
-        documentBack = request.files.get('documentBack')
-        documentFront = request.files.get('documentFront')
+
+        documentBack = uploads.get('documentBack')
+        documentFront = uploads.get('documentFront')
 
         if not all([documentType, documentBack, documentFront]):
+            release_uploads(uploads.values(), content_store)
             return jsonify({'error': 'Missing required fields or files'}), 400
-        
-        try:
-            # Save files with validations
-            doc_back_path = save_file_to_storage(documentBack)
-            doc_front_path = save_file_to_storage(documentFront)
-        except ValueError as e:
-            return jsonify({'error': str(e)}), 400
-        
+
+        # Records must only point at files that are durably stored; they are processed from there
+        documentBack.write.result()
+        documentFront.write.result()
+        front_path = content_store.local_path(documentFront.key)
+
         # Extract data with error handling
         try:
-            extracted_data = extractor.process_and_extract(doc_front_path)
+            # Reuse the OCR text of an identical earlier upload
+            extracted_data = cached_ocr_text(documentFront.digest)
+            if extracted_data is None:
+                extracted_data = extractor.process_and_extract(front_path, document_type=documentType)
             name, dob = extractor.parse_ocr_data(extracted_data)
         except Exception as e:
             logger.error(f"Data extraction error: {str(e)}")
+            release_uploads(uploads.values(), content_store)
             return jsonify({'error': 'Failed to extract data from document'}), 422
         
         # Convert extracted date to a date object if available
@@ -158,47 +134,57 @@ def get_document():
             logger.warning(f"Date parsing error: {str(e)}")
             dob_obj = None
 
+        # The front is kept as the user's image and OCRed document, the back as an image or document
+        registration = {
+            'name': name,
+            'date_of_birth': dob_obj,
+            'verification': True,
+            'images': [{'image_url': documentFront.key, 'content_hash': documentFront.digest, 'size': documentFront.size}],
+            'documents': [{
+                'document_url': documentFront.key,
+                'document_name': str(uuid.uuid4()),  # Don't use original filename
+                'document_type': documentType,
+                'extracted_text': extracted_data,
+                'content_hash': documentFront.digest,
+                'size': documentFront.size
+            }],
+            # The rows take over the references held on the uploads
+            'held_blobs': held_blobs(uploads.values())
+        }
+        if documentBack.key.endswith(('.jpg', '.jpeg', '.png')):
+            registration['images'].append({
+                'image_url': documentBack.key, 'content_hash': documentBack.digest, 'size': documentBack.size
+            })
+        else:
+            registration['documents'].append({
+                'document_url': documentBack.key,
+                'document_name': str(uuid.uuid4()),
+                'document_type': documentType,
+                'content_hash': documentBack.digest,
+                'size': documentBack.size
+            })
+
         # Create database records within a transaction
         try:
-            new_user = User(name=extracted_data.get('name'),
-                        date_of_birth=dob_obj)
-            db.session.add(new_user)
-            db.session.flush()  # Flush to obtain new_user.user_id before commit
-
-            new_image = Image(
-                image_url=doc_front_path, 
-                user_id=new_user.user_id,
-                upload_date=datetime.utcnow()
-            )
-            db.session.add(new_image)
-
-            new_document = Document(
-                document_url=doc_front_path,
-                document_name=str(uuid.uuid4()),  # Don't use original filename
-                document_type=documentType,
-                extracted_text=extracted_data,
-                user_id=new_user.user_id,
-                upload_date=datetime.utcnow()
-            )
-            db.session.add(new_document)
-
-            new_profile = Profile(user_id=new_user.user_id, verification=True)
-            db.session.add(new_profile)
+            created = UserRepository().create_user(registration)
             db.session.commit()
         except Exception as e:
-            db.session.rollback()
             logger.error(f"Database error: {str(e)}")
+            release_uploads(uploads.values(), content_store)
             return jsonify({'error': 'Failed to save data'}), 500
 
         response_data = {
             'name': name,
             'date_of_birth': dob,
-            'userId': new_user.user_id
+            'userId': created['user_id']
         }
 
         return jsonify(response_data), 200
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
         logger.error(f"Unhandled exception in get_document: {str(e)}")
+        release_uploads(uploads.values(), content_store)
         return jsonify({'error': 'An unexpected error occurred'}), 500
 
 
@@ -207,7 +193,10 @@ def get_document():
 @limiter.limit("5/minute; 20/hour")  # More strict rate limiting for authentication
 def generate_token():
     try:
-        data = request.get_json()
+        if request.is_json:
+            data, uploads = request.get_json(silent=True), {}
+        else:
+            data, uploads = upload_reader.read(request, {'selfie'})
         if not data:
             return jsonify({'error': 'No JSON data provided'}), 400
             
@@ -221,29 +210,29 @@ def generate_token():
             # Use same error message to prevent user enumeration
             return jsonify({'error': 'Authentication failed'}), 401
         
-        selfie = request.files.get('selfie')
-        if not selfie:
+        if 'selfie' not in uploads:
             return jsonify({'error': 'Selfie image is required'}), 400
         
-        try:
-            selfie_image_path = save_file_to_storage(selfie)
-        except ValueError as e:
-            return jsonify({'error': str(e)}), 400
+        selfie = uploads['selfie']
 
         if not user.images or len(user.images) == 0:
             # Use same error message to prevent user enumeration
             return jsonify({'error': 'Authentication failed'}), 401
         
+        # Storage keys are read from blob storage by Image_compare
         registered_image_path = user.images[0].image_url
         
         try:
             comparator = Image_compare()
-            match = comparator.compare(selfie_image_path, registered_image_path)
+            selfie.write.result()
+            result = comparator.compare(registered_image_path, content_store.local_path(selfie.key))
         except Exception as e:
             logger.error(f"Face comparison error: {str(e)}")
             return jsonify({'error': 'Face verification failed'}), 500
-        
-        if not match:
+
+        if result['error']:
+            logger.warning(f"Face comparison error for user_id {user_id}: {result['error']}")
+        if not result['match']:
             # Log failed attempts for security monitoring
             logger.warning(f"Failed face verification attempt for user_id: {user_id}")
             return jsonify({'error': 'Authentication failed'}), 401
@@ -255,11 +244,12 @@ def generate_token():
         )
         
         # Update profile with token info
-        user.profile.token = access_token
-        user.profile.token_expiry = datetime.utcnow() + timedelta(hours=1)
+        user.profile.set_token(access_token, datetime.utcnow() + timedelta(hours=1))
         db.session.commit()
 
         return jsonify({'access_token': access_token}), 200
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
         logger.error(f"Unhandled exception in generate_token: {str(e)}")
         return jsonify({'error': 'An unexpected error occurred'}), 500
@@ -277,8 +267,8 @@ def verify_user():
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        profile = Profile.query.filter_by(user_id=user_id).first()
-        if not profile or profile.token != request.headers.get('Authorization').split()[1]:
+        profile = Profile.find_by_token(request.headers.get('Authorization').split()[1])
+        if not profile or str(profile.user_id) != str(user_id):
             return jsonify({'error': 'Invalid authentication'}), 401
         
         if profile.token_expiry < datetime.utcnow():
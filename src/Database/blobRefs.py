@@ -0,0 +1,168 @@
+import logging
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from Database.flaskSQL import Blob, Image, Document, db
+
+logger = logging.getLogger(__name__)
+
+
+def _add_refs(content_hash, delta):
+    # Adjust in SQL so concurrent registrations don't lose updates
+    statement = (
+        update(Blob)
+        .where(Blob.content_hash == content_hash)
+        .values(ref_count=Blob.ref_count + delta)
+        .execution_options(synchronize_session=False)
+    )
+    return db.session.execute(statement).rowcount
+
+
+def acquire_blob(content_hash, storage_path, size=None, count=1):
+    """
+    Count count more Image/Document rows referencing a stored blob. The
+    caller commits the session.
+    """
+    if _add_refs(content_hash, count):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(Blob(content_hash=content_hash, storage_path=storage_path, size=size, ref_count=count))
+    except IntegrityError:
+        # Another worker registered the same content first
+        _add_refs(content_hash, count)
+
+
+def acquire_blobs(refs):
+    """
+    acquire_blob() for many blobs at once, as a single INSERT ... ON CONFLICT
+    DO UPDATE on SQLite and PostgreSQL. The caller commits the session.
+
+    Args:
+        refs (dict): content_hash -> (storage_path, size, count)
+    """
+    if not refs:
+        return
+    dialects = {'sqlite': sqlite, 'postgresql': postgresql}
+    dialect = dialects.get(db.session.get_bind().dialect.name)
+    if dialect is None:
+        for content_hash, (storage_path, size, count) in refs.items():
+            acquire_blob(content_hash, storage_path, size, count=count)
+        return
+
+    statement = dialect.insert(Blob.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=[Blob.__table__.c.content_hash],
+        set_={'ref_count': Blob.__table__.c.ref_count + statement.excluded.ref_count}
+    )
+    now = datetime.now()
+    db.session.execute(statement, [
+        {'content_hash': content_hash, 'storage_path': storage_path, 'size': size,
+         'ref_count': count, 'created_at': now}
+        for content_hash, (storage_path, size, count) in refs.items()
+    ])
+
+
+def hold_blobs(refs):
+    """
+    Reference blobs before their files are written, in a transaction of its
+    own, so that a failing request which stored the same content can't
+    delete the file in between. A registration turns the holds into its
+    rows' references (UserRepository 'held_blobs'); a request that fails
+    gives them back with release_blobs(). Commits the session.
+
+    Args:
+        refs (dict): content_hash -> (storage_path, size, count)
+    """
+    acquire_blobs(refs)
+    db.session.commit()
+
+
+def release_blobs(refs, store):
+    """
+    Drop references to blobs and delete the files whose count reaches zero.
+    A file is deleted before the transaction commits, while the Blob row is
+    still locked by the decrement: a concurrent hold_blobs() waits for it,
+    then finds the file missing and stores it again. Commits the session;
+    the caller rolls back a failed transaction first.
+
+    Args:
+        refs (dict): content_hash -> count to release
+        store (ContentStore): Store the files were written to
+    """
+    refs = {content_hash: count for content_hash, count in refs.items() if count}
+    if not refs:
+        return
+    try:
+        for content_hash, count in sorted(refs.items()):
+            _add_refs(content_hash, -count)
+        unreferenced = Blob.query.filter(Blob.content_hash.in_(list(refs)), Blob.ref_count <= 0).all()
+        for blob in unreferenced:
+            store.delete(*store.split_key(blob.storage_path))
+            db.session.delete(blob)
+            logger.info(f"Deleted unreferenced blob {blob.storage_path}")
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def hold_uploads(uploads):
+    """ hold_blobs() for the accepted uploads of a request (see UploadReader.read's reserve) """
+    refs = {}
+    for upload in uploads:
+        _, _, count = refs.get(upload.digest, (None, None, 0))
+        refs[upload.digest] = (upload.key, upload.size, count + 1)
+    hold_blobs(refs)
+
+
+def held_blobs(uploads):
+    """ References hold_uploads() took on uploads, by content hash, for a registration's 'held_blobs' """
+    return dict(Counter(upload.digest for upload in uploads))
+
+
+def release_uploads(uploads, store):
+    """
+    Give back the references held on the uploads of a registration that was
+    not committed, deleting the files nothing else uses. Rolls back the
+    session first; errors are logged, not raised.
+    """
+    uploads = list(uploads)
+    for upload in uploads:
+        # Let the durable copy land first so it is deleted with the reference, not left behind
+        try:
+            upload.write.result()
+        except Exception:
+            pass
+    try:
+        db.session.rollback()
+        release_blobs(held_blobs(uploads), store)
+    except Exception as e:
+        logger.error(f"Could not release uploads {[upload.key for upload in uploads]}: {e}")
+
+
+def cached_face_encoding(content_hash):
+    """ Stored face encoding (b'' if no face) of an earlier image with the same content """
+    if not content_hash:
+        return None
+    image = Image.query.filter(
+        Image.content_hash == content_hash,
+        Image.face_encoding.isnot(None)
+    ).first()
+    return image.face_encoding if image else None
+
+
+def cached_ocr_text(content_hash):
+    """ OCR text of an earlier document with the same content """
+    if not content_hash:
+        return None
+    document = Document.query.filter(
+        Document.content_hash == content_hash,
+        Document.extracted_text.isnot(None),
+        ~Document.extracted_text.startswith('Error processing image')
+    ).first()
+    return document.extracted_text if document else None
@@ -0,0 +1,79 @@
+import os
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+
+def sqlite_pragmas():
+    """
+    PRAGMAs applied to every SQLite connection, configurable per deployment:
+
+        DB_SQLITE_JOURNAL_MODE   WAL (default): readers don't block the writer
+        DB_SQLITE_SYNCHRONOUS    NORMAL (default): fsync at checkpoints, safe with WAL
+        DB_SQLITE_MMAP_MB        memory-mapped I/O size (default 256)
+        DB_SQLITE_CACHE_MB       page cache per connection (default 64)
+        DB_BUSY_TIMEOUT_MS       wait for the write lock instead of failing (default 5000)
+    """
+    return {
+        'journal_mode': os.getenv('DB_SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.getenv('DB_SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'mmap_size': int(os.getenv('DB_SQLITE_MMAP_MB', 256)) * 1024 * 1024,
+        # Negative cache_size is in KiB
+        'cache_size': -int(os.getenv('DB_SQLITE_CACHE_MB', 64)) * 1024,
+        'busy_timeout': int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000)),
+        'temp_store': 'MEMORY'
+    }
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(uri):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for DATABASE_URI. SQLite connections may be
+    shared by the app's background threads; other databases get a pool sized
+    for the request and worker threads of one process:
+
+        DB_POOL_SIZE (10), DB_MAX_OVERFLOW (20), DB_POOL_TIMEOUT (30 s),
+        DB_POOL_RECYCLE (1800 s)
+    """
+    if is_sqlite(uri):
+        return {
+            'connect_args': {
+                'check_same_thread': False,
+                'timeout': int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000)) / 1000
+            }
+        }
+
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        # Replace connections dropped by the server or a proxy instead of failing a request
+        'pool_pre_ping': True
+    }
+
+
+def tune_engine(engine, pragmas=None):
+    """ Apply sqlite_pragmas() to each new connection of a SQLite engine; other engines are left as is """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = pragmas if pragmas is not None else sqlite_pragmas()
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    # Connections opened before the listener was installed don't have the settings
+    engine.dispose()
+    logger.info(f"SQLite tuned: {pragmas}")
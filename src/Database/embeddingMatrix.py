@@ -0,0 +1,283 @@
+import os
+import logging
+import threading
+
+import numpy as np
+
+from Database.faceIndex import FileLock
+
+logger = logging.getLogger(__name__)
+
+VECTOR_DTYPE = np.float32
+ID_DTYPE = np.int64
+
+
+class EmbeddingMatrix:
+    """
+    Face embeddings of registered images as one float32 matrix file with an
+    image_id sidecar, memory-mapped read-only by every process. Workers
+    share the pages through the OS page cache instead of each deserializing
+    the Image.face_encoding blobs into its own heap, so startup time and
+    per-process memory don't grow with the number of registered faces.
+
+        embeddings.f32   N x dim float32, one row per stored encoding
+        embeddings.ids   N int64 image_ids, the row of each encoding
+
+    Writers append under an exclusive lock on the directory, so there is a
+    single writer at a time across processes. Image ids mostly arrive in
+    increasing order, so the sidecar is searched in place with a binary
+    search. Rows from the first out-of-order append on (an older image
+    encoded late, or a replaced encoding) are indexed in a per-process dict
+    until compact() rewrites the files sorted. The duplicate-face index
+    (FaceIndex) searches these same rows rather than keeping its own copy.
+    """
+
+    def __init__(self, directory, dim=128, compact_after=10000):
+        self.directory = directory
+        self.dim = dim
+        self.compact_after = compact_after
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, 'embeddings.f32')
+        self._ids_path = os.path.join(directory, 'embeddings.ids')
+        self._lock_path = os.path.join(directory, '.lock')
+        for path in (self._vectors_path, self._ids_path):
+            open(path, 'ab').close()
+
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._inode = None
+        self._rows = 0
+        self._sorted = 0
+        self._vectors = np.empty((0, dim), VECTOR_DTYPE)
+        self._ids = np.empty(0, ID_DTYPE)
+        self._unsorted = {}
+        self._refresh()
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._rows
+
+    def __contains__(self, image_id):
+        return self.get(image_id) is not None
+
+    def get(self, image_id):
+        """
+        Stored encoding of an image.
+
+        Args:
+            image_id (int): Image row id
+
+        Returns:
+            numpy.ndarray or None: read-only float32 view into the shared matrix
+        """
+        with self._lock:
+            self._refresh()
+            row = self._row(image_id)
+            vectors = self._vectors
+        if row is None:
+            return None
+        return vectors[row]
+
+    def get_many(self, image_ids):
+        """
+        Stored encodings of several images, gathered into one matrix.
+
+        Returns:
+            tuple: (float32 matrix, the image_ids it has rows for, in order)
+        """
+        with self._lock:
+            self._refresh()
+            rows = [(image_id, self._row(image_id)) for image_id in image_ids]
+            vectors = self._vectors
+        found = [(image_id, row) for image_id, row in rows if row is not None]
+        matrix = vectors[[row for _, row in found]] if found else np.empty((0, self.dim), VECTOR_DTYPE)
+        return matrix, [image_id for image_id, _ in found]
+
+    def append(self, image_id, encoding):
+        """ Store one encoding """
+        self.append_many([(image_id, encoding)])
+
+    def append_many(self, entries):
+        """
+        Store encodings, replacing any earlier encoding of the same image.
+
+        Args:
+            entries (iterable): (image_id, encoding) tuples
+        """
+        entries = list(entries)
+        if not entries:
+            return
+        vectors = np.asarray([encoding for _, encoding in entries], dtype=VECTOR_DTYPE).reshape(-1, self.dim)
+        ids = np.asarray([image_id for image_id, _ in entries], dtype=ID_DTYPE)
+
+        with self._lock, self._file_lock():
+            self._refresh(locked=True)
+            # Readers only use rows present in both files, so the sidecar goes last
+            with open(self._vectors_path, 'ab') as f:
+                f.write(vectors.tobytes())
+            with open(self._ids_path, 'ab') as f:
+                f.write(ids.tobytes())
+            self._refresh(locked=True)
+            compact = len(self._unsorted) >= self.compact_after
+
+        if compact:
+            self.compact_in_background()
+
+    def missing(self, image_ids):
+        """ The image_ids among these that have no stored encoding """
+        image_ids = np.asarray(image_ids, dtype=ID_DTYPE)
+        with self._lock:
+            self._refresh()
+            ids = self._ids
+        return image_ids[~np.isin(image_ids, ids)]
+
+    def snapshot(self):
+        """
+        Every row stored so far, for scanning the whole matrix.
+
+        Returns:
+            tuple: (generation, rows, vectors, ids) where generation changes
+                whenever compact() or reset() moves the rows
+        """
+        with self._lock:
+            self._refresh()
+            return self._inode, self._rows, self._vectors, self._ids
+
+    def compact(self):
+        """
+        Rewrite the files with one row per image, sorted by image_id, so
+        every lookup is a binary search over the sidecar again. Processes
+        that mapped the old files keep reading them until their next access.
+        """
+        with self._lock, self._file_lock():
+            self._refresh(locked=True)
+            rows = self._rows
+            # Last row of each image wins, as for lookups
+            order = np.argsort(self._ids[::-1], kind='stable')
+            ids, first = np.unique(self._ids[::-1][order], return_index=True)
+            keep = rows - 1 - order[first]
+
+            with open(self._vectors_path + '.tmp', 'wb') as f:
+                for start in range(0, len(keep), 65536):
+                    f.write(np.ascontiguousarray(self._vectors[keep[start:start + 65536]]).tobytes())
+            with open(self._ids_path + '.tmp', 'wb') as f:
+                f.write(ids.astype(ID_DTYPE).tobytes())
+            os.replace(self._vectors_path + '.tmp', self._vectors_path)
+            os.replace(self._ids_path + '.tmp', self._ids_path)
+            self._refresh(locked=True)
+        logger.info(f"Compacted embedding matrix from {rows} to {len(keep)} rows")
+
+    def reset(self):
+        """ Drop every stored encoding, e.g. when the files belong to another database """
+        with self._lock, self._file_lock():
+            for path in (self._vectors_path, self._ids_path):
+                with open(path + '.tmp', 'wb'):
+                    pass
+                os.replace(path + '.tmp', path)
+            self._refresh(locked=True)
+
+    def last_image_id(self):
+        """ Highest image_id stored, or 0 if the matrix is empty """
+        with self._lock:
+            self._refresh()
+            return int(self._ids.max()) if self._rows else 0
+
+    def compact_in_background(self):
+        """ compact() in a thread, so the append that triggered it doesn't wait for the rewrite """
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+
+        def run():
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Embedding matrix compaction failed: {e}")
+            finally:
+                with self._lock:
+                    self._compacting = False
+
+        threading.Thread(target=run, name='embedding-compact', daemon=True).start()
+
+    def after_fork(self):
+        """ A compaction thread doesn't survive a fork; the next append restarts it if still needed """
+        self._lock = threading.RLock()
+        self._compacting = False
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            return {
+                'rows': self._rows,
+                'unsorted_rows': len(self._unsorted),
+                'bytes': self._rows * self.dim * VECTOR_DTYPE().itemsize
+            }
+
+    def _row(self, image_id):
+        row = self._unsorted.get(image_id)
+        if row is not None:
+            return row
+        i = int(np.searchsorted(self._ids[:self._sorted], image_id))
+        if i < self._sorted and self._ids[i] == image_id:
+            return i
+        return None
+
+    def _refresh(self, locked=False):
+        """
+        Map rows appended since the last call, or the new files after a
+        compaction. Callers holding the exclusive file lock pass locked.
+
+        compact() replaces the two files one after the other under the
+        exclusive lock. Any change to either file is therefore mapped under
+        the shared lock, so both files are always mapped from the same side
+        of a compaction; while neither changed, the existing maps stay valid.
+        """
+        inode, rows = self._state()
+        if inode == self._inode and rows == self._rows:
+            return
+        with _NoLock() if locked else self._file_lock(shared=True):
+            inode, rows = self._state()
+            if inode != self._inode:
+                # Replaced by compact() or reset(): rows start over in the new files
+                self._inode, self._rows, self._sorted, self._unsorted = inode, 0, 0, {}
+            self._map(rows)
+
+        # Extend the sorted prefix while the new ids keep increasing, index the rest by id
+        new = np.asarray(self._ids[self._rows:rows])
+        if self._sorted == self._rows and len(new):
+            if self._sorted and new[0] <= self._ids[self._sorted - 1]:
+                breaks = [0]
+            else:
+                breaks = np.flatnonzero(np.diff(new) <= 0) + 1
+            self._sorted += int(breaks[0]) if len(breaks) else len(new)
+        for offset in range(max(self._sorted, self._rows), rows):
+            self._unsorted[int(self._ids[offset])] = offset
+        self._rows = rows
+
+    def _state(self):
+        rows = min(
+            os.path.getsize(self._vectors_path) // (self.dim * VECTOR_DTYPE().itemsize),
+            os.path.getsize(self._ids_path) // ID_DTYPE().itemsize
+        )
+        return (os.stat(self._vectors_path).st_ino, os.stat(self._ids_path).st_ino), rows
+
+    def _map(self, rows):
+        if rows:
+            self._vectors = np.memmap(self._vectors_path, dtype=VECTOR_DTYPE, mode='r', shape=(rows, self.dim))
+            self._ids = np.memmap(self._ids_path, dtype=ID_DTYPE, mode='r', shape=(rows,))
+        else:
+            self._vectors = np.empty((0, self.dim), VECTOR_DTYPE)
+            self._ids = np.empty(0, ID_DTYPE)
+
+    def _file_lock(self, shared=False):
+        return FileLock(self._lock_path, shared)
+
+
+class _NoLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+ENCODING_DTYPE = np.float64
+ENCODING_SIZE = 128
+
+
+def serialize_encoding(encoding):
+    """ Convert a face encoding to bytes for the Image.face_encoding column """
+    return np.asarray(encoding, dtype=ENCODING_DTYPE).tobytes()
+
+
+def deserialize_encoding(blob):
+    """ Convert bytes from the Image.face_encoding column back to a vector """
+    if not blob:
+        return None
+    encoding = np.frombuffer(blob, dtype=ENCODING_DTYPE)
+    if encoding.shape[0] != ENCODING_SIZE:
+        return None
+    return encoding
+
+
+def stored_encoding(result):
+    """
+    Image.face_encoding value for an encode_face() result: the serialized
+    encoding, b'' if the image has no usable face, or None if detection
+    could not run (so the image is encoded again later).
+    """
+    if result['encoding'] is not None:
+        return serialize_encoding(result['encoding'])
+    return b'' if result['face_count'] is not None else None
+
+
+class EmbeddingStore:
+    """
+    Face embeddings of registered images, persisted on the Image row and
+    mirrored into a memory-mapped EmbeddingMatrix shared by every worker
+    process, so verification only has to encode the selfie and no process
+    keeps its own copy of the embeddings.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def get(self, image):
+        """
+        Return the stored encoding for an Image row, or None if it has not
+        been computed yet. Encodings only found on the row are copied into
+        the shared matrix the first time they are read.
+
+        Args:
+            image (Image): Registered image row
+
+        Returns:
+            numpy.ndarray or None: 128-d face encoding
+        """
+        if image.image_id is not None:
+            encoding = self.matrix.get(image.image_id)
+            if encoding is not None:
+                return encoding
+
+        encoding = deserialize_encoding(image.face_encoding)
+        if encoding is not None and image.image_id is not None:
+            self.matrix.append(image.image_id, encoding)
+        return encoding
+
+    def add_many(self, entries):
+        """ Mirror the encodings of newly committed images, as (image_id, encoding) tuples """
+        self.matrix.append_many(entries)
+
+    def is_computed(self, image):
+        """ True once an encoding (or the absence of a face) has been stored """
+        return image.face_encoding is not None
@@ -0,0 +1,345 @@
+import os
+import json
+import fcntl
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTOR_DTYPE = np.float32
+ID_DTYPE = np.int64
+LIST_DTYPE = np.int32
+
+
+class FaceIndex:
+    """
+    Approximate nearest-neighbour index (IVF) over the face embeddings of an
+    EmbeddingMatrix, used to flag people registering more than once. The
+    vectors are read from the matrix's own memory map, so every embedding is
+    stored once; the index only adds its inverted lists in directory:
+
+        lists.i32      inverted list of each matrix row
+        rows.i64       image_id of each listed row, checked against the matrix
+        centroids.npy  coarse quantizer, trained by k-means
+        index.json     dim, nlist and a version bumped on every retrain
+
+    Until train_min rows exist every row is scanned. After that a query only
+    scans the nprobe lists whose centroids are nearest, plus the matrix rows
+    update() hasn't assigned to a list yet. The quantizer is retrained in a
+    background thread whenever the matrix has grown retrain_factor times
+    since the last training. Lists are written under an exclusive lock on
+    the directory, so every worker process can update them. When the matrix
+    is compacted its rows move; lists from the first row whose image_id no
+    longer matches on are ignored until update() assigns them again.
+    """
+
+    def __init__(self, matrix, directory, nprobe=16, train_min=10000, retrain_factor=8):
+        self.matrix = matrix
+        self.directory = directory
+        self.dim = matrix.dim
+        self.nprobe = nprobe
+        self.train_min = train_min
+        self.retrain_factor = retrain_factor
+        os.makedirs(directory, exist_ok=True)
+        self._paths = {name: os.path.join(directory, name) for name in
+                       ('lists.i32', 'rows.i64', 'centroids.npy', 'index.json', '.lock')}
+
+        self._lock = threading.RLock()
+        self._training = False
+        self._version = None
+        self._generation = None
+        self._centroids = None
+        self._trained_rows = 0
+        self._rows = 0
+        self._vectors = None
+        self._ids = None
+        self._assigned = 0
+        self._lists = []
+        with self._file_lock():
+            # Earlier indexes kept their own copy of the vectors
+            if os.path.exists(os.path.join(directory, 'vectors.f32')):
+                for name in ('vectors.f32', 'ids.i64', 'lists.i32'):
+                    if os.path.exists(os.path.join(directory, name)):
+                        os.remove(os.path.join(directory, name))
+            for name in ('lists.i32', 'rows.i64'):
+                open(self._paths[name], 'ab').close()
+            self._refresh()
+
+    def __len__(self):
+        with self._lock, self._file_lock(shared=True):
+            self._refresh()
+            return self._rows
+
+    def update(self):
+        """
+        Assign the matrix rows appended since the last update to their
+        lists, and start a retrain if the matrix has outgrown the quantizer.
+        Call it after appending to the matrix.
+        """
+        with self._lock, self._file_lock():
+            self._refresh()
+            if self._centroids is not None and self._assigned < self._rows:
+                start, rows = self._assigned, self._rows
+                lists = assign(self._vectors[start:rows], self._centroids, rows - start)
+                self._write_lists(start, lists, self._ids[start:rows])
+                self._refresh()
+            train = self._needs_training()
+
+        if train:
+            self.train_in_background()
+
+    def search(self, encoding, k=5, max_distance=None):
+        """
+        Nearest stored faces to an embedding.
+
+        Args:
+            encoding (array-like): dim-d face embedding
+            k (int): how many neighbours to return at most
+            max_distance (float): drop neighbours further away than this
+
+        Returns:
+            list: {'image_id', 'distance'} dicts, nearest first
+        """
+        query = np.asarray(encoding, dtype=VECTOR_DTYPE).reshape(self.dim)
+        with self._lock, self._file_lock(shared=True):
+            self._refresh()
+            if self._rows == 0:
+                return []
+            rows = self._candidates(query)
+            vectors, ids = self._vectors, self._ids
+        if rows is not None and len(rows) == 0:
+            return []
+
+        candidates = vectors if rows is None else vectors[rows]
+        distances = np.linalg.norm(candidates - query, axis=1)
+        results, seen = [], set()
+        for i in np.argsort(distances):
+            if len(results) == k or (max_distance is not None and distances[i] > max_distance):
+                break
+            # A replaced encoding leaves an older row of the same image
+            image_id = int(ids[i if rows is None else rows[i]])
+            if image_id not in seen:
+                seen.add(image_id)
+                results.append({'image_id': image_id, 'distance': float(distances[i])})
+        return results
+
+    def train(self, nlist=None, sample=None, iterations=10):
+        """
+        Fit the coarse quantizer with k-means on (a sample of) the matrix
+        rows and reassign every row to its nearest centroid. The new lists
+        are swapped in at the end, so searches keep using the old ones
+        until then.
+        """
+        with self._lock, self._file_lock(shared=True):
+            self._refresh()
+            generation, rows, vectors = self._generation, self._rows, self._vectors
+        if rows == 0:
+            return
+        nlist = nlist or max(1, min(int(np.sqrt(rows)), 65536))
+        sample = sample or min(rows, nlist * 64)
+
+        rng = np.random.default_rng(0)
+        picked = np.sort(rng.choice(rows, size=sample, replace=False)) if sample < rows else np.arange(rows)
+        centroids = kmeans(np.asarray(vectors[picked]), nlist, iterations, rng)
+        lists = assign(vectors, centroids, rows)
+
+        with self._lock, self._file_lock():
+            self._refresh()
+            if self._generation != generation:
+                # Compacted meanwhile, so the rows moved
+                lists = assign(self._vectors, centroids, self._rows)
+            elif self._rows > rows:
+                lists = np.concatenate([lists, assign(self._vectors[rows:], centroids, self._rows - rows)])
+            np.save(self._paths['centroids.npy'] + '.tmp.npy', centroids)
+            os.replace(self._paths['centroids.npy'] + '.tmp.npy', self._paths['centroids.npy'])
+            self._write_lists(0, lists, self._ids[:len(lists)])
+            self._write_header({'dim': self.dim, 'nlist': nlist, 'trained_rows': rows,
+                                'version': (self._version or 0) + 1})
+            self._refresh()
+        logger.info(f"Face index trained: {nlist} lists over {rows} faces")
+
+    def reset(self):
+        """ Drop the quantizer and lists, e.g. before rebuilding from the database """
+        with self._lock, self._file_lock():
+            self._refresh()
+            for name in ('lists.i32', 'rows.i64'):
+                open(self._paths[name], 'wb').close()
+            if os.path.exists(self._paths['centroids.npy']):
+                os.remove(self._paths['centroids.npy'])
+            self._write_header({'dim': self.dim, 'nlist': 0, 'trained_rows': 0, 'version': (self._version or 0) + 1})
+            self._refresh()
+
+    def train_in_background(self):
+        with self._lock:
+            if self._training:
+                return
+            self._training = True
+
+        def run():
+            try:
+                self.train()
+            except Exception as e:
+                logger.error(f"Face index training failed: {e}")
+            finally:
+                with self._lock:
+                    self._training = False
+
+        threading.Thread(target=run, name='face-index-train', daemon=True).start()
+
+    def after_fork(self):
+        """ A training thread doesn't survive a fork; the next update restarts it if still needed """
+        self._lock = threading.RLock()
+        self._training = False
+
+    def stats(self):
+        with self._lock, self._file_lock(shared=True):
+            self._refresh()
+            return {
+                'faces': self._rows,
+                'assigned': self._assigned,
+                'nlist': 0 if self._centroids is None else len(self._centroids),
+                'nprobe': self.nprobe,
+                'trained_rows': self._trained_rows,
+                'training': self._training
+            }
+
+    def _candidates(self, query):
+        """ Rows in the nprobe nearest lists and the unassigned rows, or None to scan every row """
+        if self._centroids is None:
+            return None
+        nprobe = min(self.nprobe, len(self._centroids))
+        distances = np.linalg.norm(self._centroids - query, axis=1)
+        probes = np.argpartition(distances, nprobe - 1)[:nprobe]
+        groups = [self._lists[j] for j in probes] + [np.arange(self._assigned, self._rows)]
+        return np.sort(np.concatenate(groups))
+
+    def _needs_training(self):
+        if self._centroids is None:
+            return self._rows >= self.train_min
+        return self._rows >= self._trained_rows * self.retrain_factor
+
+    def _refresh(self):
+        """
+        Pick up rows appended to the matrix and lists written by this or
+        another process since the last call. Callers hold the file lock, so
+        a retrain is never seen half done.
+        """
+        header = self._read_header()
+        generation, rows, vectors, ids = self.matrix.snapshot()
+        if header.get('version') != self._version:
+            # Retrained: reload the quantizer and regroup every row
+            self._version = header.get('version')
+            self._trained_rows = header.get('trained_rows', 0)
+            path = self._paths['centroids.npy']
+            self._centroids = np.load(path).astype(VECTOR_DTYPE) if header.get('nlist') and os.path.exists(path) else None
+            self._assigned, self._lists = 0, []
+        if generation != self._generation or rows < self._assigned:
+            # Compacted or reset: check the lists against the new rows from the start
+            self._generation = generation
+            self._assigned, self._lists = 0, []
+        self._rows, self._vectors, self._ids = rows, vectors, ids
+        if self._centroids is None:
+            return
+
+        nlist = len(self._centroids)
+        if not self._lists:
+            self._lists = [np.empty(0, np.int64) for _ in range(nlist)]
+        listed = min(rows,
+                     os.path.getsize(self._paths['lists.i32']) // LIST_DTYPE().itemsize,
+                     os.path.getsize(self._paths['rows.i64']) // ID_DTYPE().itemsize)
+        if listed <= self._assigned:
+            return
+        offset, count = self._assigned, listed - self._assigned
+        new = np.fromfile(self._paths['lists.i32'], dtype=LIST_DTYPE, count=count, offset=offset * LIST_DTYPE().itemsize)
+        listed_ids = np.fromfile(self._paths['rows.i64'], dtype=ID_DTYPE, count=count, offset=offset * ID_DTYPE().itemsize)
+        # Only lists written for these same matrix rows are valid
+        moved = np.flatnonzero(listed_ids != ids[offset:listed])
+        if len(moved):
+            new = new[:moved[0]]
+
+        # Group the new rows by list
+        order = np.argsort(new, kind='stable')
+        keys = new[order]
+        starts = np.searchsorted(keys, np.arange(nlist), side='left')
+        ends = np.searchsorted(keys, np.arange(nlist), side='right')
+        for j, (start, end) in enumerate(zip(starts, ends)):
+            if end > start:
+                self._lists[j] = np.concatenate([self._lists[j], order[start:end] + offset])
+        self._assigned += len(new)
+
+    def _write_lists(self, start, lists, ids):
+        """ Store the lists of the rows from start on, replacing any written past it """
+        for name, dtype, array in (('lists.i32', LIST_DTYPE, lists), ('rows.i64', ID_DTYPE, ids)):
+            path = self._paths[name]
+            data = np.ascontiguousarray(array, dtype=dtype).tobytes()
+            if os.path.getsize(path) == start * dtype().itemsize:
+                with open(path, 'ab') as f:
+                    f.write(data)
+                continue
+            with open(path + '.tmp', 'wb') as f:
+                f.write(np.fromfile(path, dtype=dtype, count=start).tobytes())
+                f.write(data)
+            os.replace(path + '.tmp', path)
+
+    def _read_header(self):
+        try:
+            with open(self._paths['index.json']) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_header(self, header):
+        tmp = self._paths['index.json'] + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(header, f)
+        os.replace(tmp, self._paths['index.json'])
+
+    def _file_lock(self, shared=False):
+        return FileLock(self._paths['.lock'], shared)
+
+
+class FileLock:
+    """ flock() on a file, shared by every process using the index or matrix """
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        fcntl.flock(self._file, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+def assign(vectors, centroids, rows, chunk=65536):
+    """ Index of the nearest centroid for the first rows vectors, in chunks """
+    lists = np.empty(rows, LIST_DTYPE)
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for start in range(0, rows, chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=VECTOR_DTYPE)
+        # |x - c|^2 without the |x|^2 term, which doesn't change the argmin
+        lists[start:start + len(block)] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return lists
+
+
+def kmeans(vectors, k, iterations, rng):
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(vectors, centroids, len(vectors))
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Reseed empty clusters from random points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), size=len(empty), replace=False)]
+    return centroids
@@ -1,5 +1,8 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy as sql
+import hashlib
+
+from Database.dbConfig import engine_options
 
 
 from datetime import datetime
@@ -8,6 +11,7 @@ app = Flask(__name__)
 
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///uiv.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 
 db = sql(app)
 
@@ -82,6 +86,19 @@ class Profile(db.Model):
     token = db.Column(db.String(255), nullable=True)
     token_expiry = db.Column(db.DateTime, nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False, unique=True)
+    # SHA-256 of token, indexed so a presented token is found without comparing long strings
+    token_hash = db.Column(db.String(64), index=True, nullable=True)
+
+    def set_token(self, token, expiry):
+        self.token = token
+        self.token_hash = hash_token(token)
+        self.token_expiry = expiry
+
+    @classmethod
+    def find_by_token(cls, token):
+        """ Profile holding this exact token, via the token_hash index """
+        profile = cls.query.filter_by(token_hash=hash_token(token)).first()
+        return profile if profile and profile.token == token else None
    
 
 
@@ -90,7 +107,11 @@ class Image(db.Model):
     image_id = db.Column(db.Integer, primary_key=True)
     image_url = db.Column(db.String, nullable=False)
     upload_date = db.Column(db.DateTime, default=datetime.now)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), index=True)
+    # 128-d face embedding computed once at registration (float64 bytes)
+    face_encoding = db.Column(db.LargeBinary, nullable=True)
+    # SHA-256 of the stored file, see Blob
+    content_hash = db.Column(db.String(64), index=True, nullable=True)
 
 
 class Document(db.Model):
@@ -99,5 +120,32 @@ class Document(db.Model):
     document_url = db.Column(db.String, nullable=False)
     document_name = db.Column(db.String(15), unique=True, nullable=False)
     document_type = db.Column(db.String(15), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), index=True)
+    extracted_text = db.Column(db.Text, nullable=True)
+    content_hash = db.Column(db.String(64), index=True, nullable=True)
+
+class Blob(db.Model):
+    __tablename__ = 'blob'
+    # Content-addressed upload, shared by every Image/Document row with the same bytes
+    content_hash = db.Column(db.String(64), primary_key=True)
+    storage_path = db.Column(db.String, nullable=False)
+    size = db.Column(db.Integer, nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class Job(db.Model):
+    __tablename__ = 'job'
+    job_id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(15), nullable=False, default='queued')  # queued, done, failed
+    document_url = db.Column(db.String, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'))
-    extracted_text = db.Column(db.Text, nullable=True)
\ No newline at end of file
+    document_id = db.Column(db.Integer, db.ForeignKey('document.document_id'))
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest() if token else None
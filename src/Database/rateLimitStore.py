@@ -0,0 +1,194 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from math import floor
+from urllib.parse import urlsplit, parse_qsl
+
+from limits.storage import Storage
+from limits.storage.base import TimestampedSlidingWindow
+
+try:
+    from limits.storage.base import SlidingWindowCounterSupport
+except ImportError:  # limits < 4.1: fixed and moving window strategies only
+    SlidingWindowCounterSupport = object
+
+
+def storage_uri():
+    """
+    Limiter storage URI from RATELIMIT_STORAGE_URI, by default a SQLite file
+    shared by the workers on this host. Importing this module is what
+    registers the sqlite:// scheme, so use it to configure the limiter.
+    """
+    return os.getenv('RATELIMIT_STORAGE_URI', f"sqlite:///{os.path.join(tempfile.gettempdir(), 'uiv-ratelimit.db')}")
+
+
+class SQLiteStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+    """
+    Rate limit counters in a SQLite file shared by every worker process on
+    the host, so a limit holds for the whole deployment rather than per
+    worker. Registered with the limits library for storage URIs like
+    ``sqlite:////tmp/uiv-ratelimit.db?max_keys=100000``.
+
+    Each check is one short write transaction in WAL mode. Counters are
+    expendable, so the file is not fsynced. Expired counters are purged
+    every purge_every writes and the table is capped at max_keys rows by
+    dropping the counters that expire first, so memory and disk stay
+    bounded however many clients are seen.
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri, wrap_exceptions=False, max_keys=100000, purge_every=1000, **options):
+        parts = urlsplit(uri)
+        query = dict(parse_qsl(parts.query))
+        # sqlite:///relative.db or sqlite:////absolute.db, as for SQLAlchemy
+        self.path = parts.path[1:] or ':memory:'
+        self.max_keys = int(query.get('max_keys', max_keys))
+        self.purge_every = int(query.get('purge_every', purge_every))
+        self._local = threading.local()
+        self._writes = 0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self._connection()
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key, expiry, amount=1):
+        """ Increment a fixed-window counter, starting a new window once it expired """
+        now = time.time()
+        conn = self._connection()
+        count = conn.execute(
+            "INSERT INTO counters (key, count, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END, "
+            "expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END "
+            "RETURNING count",
+            (key, amount, now + expiry, now, now)
+        ).fetchone()[0]
+        self._wrote(conn)
+        return count
+
+    def decr(self, key, amount=1):
+        conn = self._connection()
+        row = conn.execute(
+            "UPDATE counters SET count = MAX(count - ?, 0) WHERE key = ? AND expires_at > ? RETURNING count",
+            (amount, key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT count FROM counters WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT expires_at FROM counters WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def check(self):
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self._connection().execute("DELETE FROM counters").rowcount
+
+    def clear(self, key):
+        self._connection().execute("DELETE FROM counters WHERE key = ?", (key,))
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        """
+        Take an entry if the previous window's count, weighted by how much
+        of it still overlaps the sliding window, plus the current count
+        stays within limit. Read and increment happen in one IMMEDIATE
+        transaction, so concurrent workers can't both take the last entry.
+        """
+        if amount > limit:
+            return False
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            previous_count, previous_ttl, current_count, _ = self._window(conn, previous_key, current_key, expiry, now)
+            if floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                conn.execute("ROLLBACK")
+                return False
+            # A window's counter is still needed as the previous window during the next one
+            conn.execute(
+                "INSERT INTO counters (key, count, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET count = count + excluded.count",
+                (current_key, amount, now + 2 * expiry)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._wrote(conn)
+        return True
+
+    def get_sliding_window(self, key, expiry):
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        return self._window(self._connection(), previous_key, current_key, expiry, now)
+
+    def clear_sliding_window(self, key, expiry):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self._connection().execute("DELETE FROM counters WHERE key IN (?, ?)", (previous_key, current_key))
+
+    def stats(self):
+        conn = self._connection()
+        return {
+            'path': self.path,
+            'keys': conn.execute("SELECT COUNT(*) FROM counters").fetchone()[0],
+            'max_keys': self.max_keys
+        }
+
+    def _window(self, conn, previous_key, current_key, expiry, now):
+        counts = dict(conn.execute(
+            "SELECT key, count FROM counters WHERE key IN (?, ?) AND expires_at > ?",
+            (previous_key, current_key, now)
+        ).fetchall())
+        previous_count = counts.get(previous_key, 0)
+        current_count = counts.get(current_key, 0)
+        previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry if previous_count else 0.0
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def _connection(self):
+        # One connection per thread, reopened in processes forked after it was made
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            "key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_counters_expires_at ON counters (expires_at)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _wrote(self, conn):
+        self._writes += 1
+        if self._writes % self.purge_every:
+            return
+        conn.execute("DELETE FROM counters WHERE expires_at <= ?", (time.time(),))
+        excess = conn.execute("SELECT COUNT(*) FROM counters").fetchone()[0] - self.max_keys
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM counters WHERE key IN (SELECT key FROM counters ORDER BY expires_at LIMIT ?)",
+                (excess,)
+            )
@@ -0,0 +1,127 @@
+import os
+import mmap
+import time
+import zlib
+import fcntl
+import threading
+from collections import OrderedDict
+
+
+class TokenEpochs:
+    """
+    Per-user change counters in a memory-mapped file shared by the worker
+    processes of a host. Issuing or revoking a token bumps the user's
+    counter, so a cached entry taken at an older count is known to be stale
+    by every process, without a DB read. Users share counters by hash; a
+    collision only costs an extra DB read.
+    """
+
+    def __init__(self, path, slots=65536):
+        """
+        Args:
+            path (str): counter file, created if missing
+            slots (int): number of counters
+        """
+        self.path = path
+        self.slots = slots
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'a+b') as f:
+            if os.fstat(f.fileno()).st_size < slots * 4:
+                f.truncate(slots * 4)
+            # Shared mapping, so it stays shared with processes forked later
+            self._map = mmap.mmap(f.fileno(), slots * 4)
+        self._counters = memoryview(self._map).cast('I')
+
+    def get(self, user_id):
+        return self._counters[self._slot(user_id)]
+
+    def bump(self, user_id):
+        """ Mark a user's cached tokens stale in every process; returns the new count """
+        slot = self._slot(user_id)
+        # Serialize increments across processes so none is lost
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._counters[slot] = (self._counters[slot] + 1) & 0xFFFFFFFF
+                return self._counters[slot]
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _slot(self, user_id):
+        # crc32 rather than hash(), which differs between processes
+        return zlib.crc32(str(user_id).encode()) % self.slots
+
+
+class TokenRegistry:
+    """
+    The current token id (JWT jti) of each user, cached in-process so a
+    signed token can be checked for revocation without a DB read. A user
+    holds at most one valid token: issuing one supersedes the previous and
+    revoking clears it.
+
+    With epochs, a token issued or revoked by another worker process of the
+    same host is picked up on the next check, because its TokenEpochs
+    counter moved. Without them, or for changes made on other hosts, entries
+    are trusted for ttl seconds. A presented jti that differs from the
+    cached one always reads the DB.
+    """
+
+    def __init__(self, load_current, maxsize=100000, ttl=30.0, epochs=None):
+        """
+        Args:
+            load_current (callable): user_id -> current jti from the DB, or None
+            maxsize (int): users kept in the cache
+            ttl (float): seconds an entry is trusted without re-reading the DB
+            epochs (TokenEpochs): counters shared with the other worker processes
+        """
+        self.load_current = load_current
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.epochs = epochs
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def issue(self, user_id, jti):
+        """ Record a newly issued token once it is committed """
+        self._changed(str(user_id), jti)
+
+    def revoke(self, user_id):
+        """ Record that a user holds no valid token once the DB says so """
+        self._changed(str(user_id), None)
+
+    def is_current(self, user_id, jti):
+        """
+        Whether jti is the user's current token. Only a cache miss, an
+        expired entry or a differing jti reads the DB.
+        """
+        user_id = str(user_id)
+        # Read before the DB, so a change committed meanwhile leaves the entry stale
+        epoch = self.epochs.get(user_id) if self.epochs else None
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if (entry is not None and entry[0] == jti and entry[2] == epoch
+                    and time.monotonic() - entry[1] < self.ttl):
+                self._cache.move_to_end(user_id)
+                self.hits += 1
+                return True
+            self.misses += 1
+
+        current = self.load_current(user_id)
+        self._remember(user_id, current, epoch)
+        return current is not None and current == jti
+
+    def stats(self):
+        return {'users': len(self._cache), 'hits': self.hits, 'misses': self.misses, 'ttl': self.ttl}
+
+    def _changed(self, user_id, jti):
+        epoch = self.epochs.bump(user_id) if self.epochs else None
+        self._remember(user_id, jti, epoch)
+
+    def _remember(self, user_id, jti, epoch):
+        with self._lock:
+            self._cache[user_id] = (jti, time.monotonic(), epoch)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
@@ -0,0 +1,279 @@
+import queue
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import Future, TimeoutError
+
+from sqlalchemy import insert
+from sqlalchemy.orm import contains_eager, joinedload
+
+from Database.flaskSQL import User, Profile, Image, Document, Job, db, hash_token
+from Database.blobRefs import acquire_blobs
+
+logger = logging.getLogger(__name__)
+
+# Document columns a caller can select, by response field name
+DOCUMENT_FIELDS = {
+    'id': Document.document_id,
+    'url': Document.document_url,
+    'name': Document.document_name,
+    'type': Document.document_type,
+    'extracted_text': Document.extracted_text
+}
+
+
+class UserRepository:
+    """
+    Creates user aggregates (User with its Image, Document, Profile and Job
+    rows) with one INSERT ... RETURNING per table instead of per-object ORM
+    unit-of-work bookkeeping, so many registrations cost the same number of
+    statements as one.
+
+    A registration is a dict:
+
+        {'name': ..., 'date_of_birth': ..., 'verification': True,
+         'images': [{'image_url', 'content_hash', 'face_encoding', 'size'}],
+         'documents': [{'document_url', 'document_name', 'document_type',
+                        'extracted_text', 'content_hash', 'size', 'job_id'}]}
+
+    size is the stored file size for the blob reference count and job_id,
+    if set, queues a Job for that document. An optional 'held_blobs'
+    (content_hash -> count) lists references the request already holds on
+    the blobs its rows use (see blobRefs.hold_blobs); they become the rows'
+    references instead of being counted again.
+    """
+
+    def __init__(self, session=None):
+        self.session = session or db.session
+
+    def create_users(self, registrations):
+        """
+        Insert the rows of many registrations in the current transaction.
+        The caller commits the session.
+
+        Returns:
+            list: {'user_id', 'image_ids', 'document_ids'} per registration
+        """
+        registrations = list(registrations)
+        if not registrations:
+            return []
+
+        user_ids = self._insert(User, User.user_id, [
+            {'name': r.get('name'), 'date_of_birth': r.get('date_of_birth')} for r in registrations
+        ])
+
+        images, documents, profiles, refs, blobs = [], [], [], Counter(), {}
+        for registration, user_id in zip(registrations, user_ids):
+            for image in registration.get('images', ()):
+                images.append({
+                    'image_url': image['image_url'],
+                    'content_hash': image.get('content_hash'),
+                    'face_encoding': image.get('face_encoding'),
+                    'user_id': user_id
+                })
+                self._count_ref(image, image['image_url'], refs, blobs)
+            for document in registration.get('documents', ()):
+                documents.append({
+                    'document_url': document['document_url'],
+                    'document_name': document['document_name'],
+                    'document_type': document['document_type'],
+                    'extracted_text': document.get('extracted_text'),
+                    'content_hash': document.get('content_hash'),
+                    'user_id': user_id
+                })
+                self._count_ref(document, document['document_url'], refs, blobs)
+            profiles.append({'user_id': user_id, 'verification': registration.get('verification', True)})
+            refs.subtract(registration.get('held_blobs', {}))
+
+        image_ids = self._insert(Image, Image.image_id, images)
+        document_ids = self._insert(Document, Document.document_id, documents)
+        self.session.execute(insert(Profile), profiles)
+
+        jobs = []
+        results = []
+        image_iter, document_iter = iter(image_ids), iter(document_ids)
+        for registration, user_id in zip(registrations, user_ids):
+            result = {
+                'user_id': user_id,
+                'image_ids': [next(image_iter) for _ in registration.get('images', ())],
+                'document_ids': []
+            }
+            for document in registration.get('documents', ()):
+                document_id = next(document_iter)
+                result['document_ids'].append(document_id)
+                if document.get('job_id'):
+                    jobs.append({
+                        'job_id': document['job_id'],
+                        'status': 'queued',
+                        'document_url': document['document_url'],
+                        'user_id': user_id,
+                        'document_id': document_id
+                    })
+            results.append(result)
+        if jobs:
+            self.session.execute(insert(Job), jobs)
+
+        acquire_blobs({content_hash: blobs[content_hash] + (count,) for content_hash, count in refs.items() if count})
+        return results
+
+    def create_user(self, registration):
+        """ create_users() for a single registration """
+        return self.create_users([registration])[0]
+
+    def find_user(self, user_id, token=None):
+        """
+        Load a user, its profile and its image URLs in one SELECT. With a
+        token, the profile is matched through the token_hash index as well.
+
+        Returns:
+            User: with profile and images loaded, or None if there is no
+            such user with a profile (holding token, if given)
+        """
+        query = (
+            self.session.query(User)
+            .join(User.profile)
+            .options(contains_eager(User.profile), joinedload(User.images).load_only(Image.image_url))
+            .filter(User.user_id == int(user_id))
+        )
+        if token is None:
+            return query.one_or_none()
+        user = query.filter(Profile.token_hash == hash_token(token)).one_or_none()
+        # Guard against a hash collision
+        return user if user and user.profile.token == token else None
+
+    def documents(self, user_id, fields=('url', 'type'), limit=None, offset=0):
+        """
+        Select only the requested DOCUMENT_FIELDS of a user's documents,
+        oldest first, so large OCR texts are read only when asked for.
+
+        Returns:
+            tuple: (list of dicts keyed by field, whether more documents follow)
+        """
+        query = (
+            self.session.query(*(DOCUMENT_FIELDS[field] for field in fields))
+            .filter(Document.user_id == int(user_id))
+            .order_by(Document.document_id)
+            .offset(offset)
+        )
+        if limit is not None:
+            # One extra row tells whether there is a next page
+            query = query.limit(limit + 1)
+        rows = query.all()
+        has_more = limit is not None and len(rows) > limit
+        return [dict(zip(fields, row)) for row in rows[:limit]], has_more
+
+    def _insert(self, model, key, rows):
+        # One executemany with RETURNING; ids come back in parameter order
+        if not rows:
+            return []
+        statement = insert(model).returning(key, sort_by_parameter_order=True)
+        return list(self.session.scalars(statement, rows))
+
+    @staticmethod
+    def _count_ref(row, storage_path, refs, blobs):
+        content_hash = row.get('content_hash')
+        if content_hash:
+            refs[content_hash] += 1
+            blobs.setdefault(content_hash, (storage_path, row.get('size')))
+
+
+class GroupCommitter:
+    """
+    Writes registrations submitted from many request threads in shared
+    transactions. A background thread takes everything queued while the
+    previous commit was running (up to max_batch, optionally waiting
+    max_delay seconds for more) and commits it at once, so under load the
+    cost of a commit is split between the registrations in it. A group that
+    fails is retried one registration at a time so one bad row only fails
+    its own request.
+    """
+
+    def __init__(self, app, max_batch=64, max_delay=0.0):
+        self.app = app
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.groups = 0
+        self.registrations = 0
+
+    def submit(self, registration):
+        """ Queue a registration; the future resolves to its create_users() result """
+        self._start()
+        future = Future()
+        self._queue.put((registration, future))
+        return future
+
+    def register(self, registration, timeout=None):
+        """
+        Blocking submit(). A registration still queued after timeout seconds
+        is withdrawn, so it is never committed after the caller gave up on
+        it; one whose group is already being written is waited for instead,
+        since that write may still succeed.
+
+        Raises:
+            TimeoutError: If the registration was withdrawn uncommitted
+        """
+        future = self.submit(registration)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise
+            return future.result()
+
+    def stats(self):
+        return {
+            'groups': self.groups,
+            'registrations': self.registrations,
+            'queued': self._queue.qsize(),
+            'mean_group_size': self.registrations / self.groups if self.groups else None
+        }
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+
+    def _next_group(self):
+        group = [self._queue.get()]
+        while len(group) < self.max_batch:
+            try:
+                group.append(self._queue.get(timeout=self.max_delay) if self.max_delay else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return group
+
+    def _run(self):
+        while True:
+            # Registrations withdrawn by register() are dropped, the rest can no longer be
+            group = [entry for entry in self._next_group() if entry[1].set_running_or_notify_cancel()]
+            if not group:
+                continue
+            with self.app.app_context():
+                try:
+                    self._write(group)
+                finally:
+                    db.session.remove()
+
+    def _write(self, group):
+        repository = UserRepository()
+        try:
+            results = repository.create_users(registration for registration, _ in group)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(group) == 1:
+                group[0][1].set_exception(e)
+                return
+            logger.warning(f"Group commit of {len(group)} registrations failed ({e}), retrying individually")
+            for entry in group:
+                self._write([entry])
+            return
+
+        self.groups += 1
+        self.registrations += len(group)
+        for (_, future), result in zip(group, results):
+            future.set_result(result)
@@ -0,0 +1,153 @@
+import os
+import atexit
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from Extraction.preprocess import as_source
+
+logger = logging.getLogger(__name__)
+
+# Comparator owned by each worker process, created by the pool initializer
+_worker_comparator = None
+# Embedding matrices mapped by each worker process, by directory
+_worker_matrices = {}
+
+
+def _picklable(image):
+    # Paths and bytes cross the process boundary as-is; buffers and streams are copied once
+    if isinstance(image, (str, bytes)):
+        return image
+    return bytes(as_source(image))
+
+
+class EngineSaturated(Exception):
+    """ Raised when the face engine queue is full and a job is rejected """
+
+
+def _init_worker():
+    """ Load the dlib detector, landmark and encoder models once per worker """
+    global _worker_comparator
+    # face_recognition loads its dlib models at import time
+    from Extraction.imageCompare import Image_compare
+    _worker_comparator = Image_compare()
+
+
+def preload_models():
+    """
+    Load the models in this process ahead of time, so worker processes
+    forked from it (directly or from a forked web worker) share the pages
+    copy-on-write instead of each loading their own.
+    """
+    _init_worker()
+
+
+def _encode_face(image, label):
+    return _worker_comparator.encode_face(image, label=label)
+
+
+def _compare_many(selfie_image_path, candidates, tolerance):
+    return _worker_comparator.compare_many(selfie_image_path, candidates, tolerance=tolerance)
+
+
+def _compare_stored(selfie_image_path, matrix_dir, image_ids, tolerance):
+    from Database.embeddingMatrix import EmbeddingMatrix
+
+    matrix = _worker_matrices.get(matrix_dir)
+    if matrix is None:
+        matrix = _worker_matrices[matrix_dir] = EmbeddingMatrix(matrix_dir)
+    return _worker_comparator.compare_stored(selfie_image_path, matrix, image_ids, tolerance=tolerance)
+
+
+class FaceEngine:
+    """
+    Face encode/compare service backed by a pool of worker processes with
+    the dlib models preloaded, so verification runs outside the request
+    thread and scales across cores. Submissions beyond max_queue pending
+    jobs are rejected with EngineSaturated instead of piling up.
+    """
+
+    def __init__(self, workers=None, max_queue=None, timeout=None):
+        self.workers = workers or int(os.getenv('FACE_ENGINE_WORKERS', os.cpu_count() or 1))
+        self.max_queue = max_queue or int(os.getenv('FACE_ENGINE_MAX_QUEUE', self.workers * 4))
+        self.timeout = timeout or float(os.getenv('FACE_ENGINE_TIMEOUT', 30))
+        self._pending = 0
+        self._rejected = 0
+        self._pool = None
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    @property
+    def queue_depth(self):
+        return self._pending
+
+    def stats(self):
+        """ Current load, for health checks and sizing """
+        return {
+            'workers': self.workers,
+            'queue_depth': self._pending,
+            'max_queue': self.max_queue,
+            'rejected': self._rejected
+        }
+
+    def start(self):
+        """ Start the worker processes now instead of on the first job """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+                logger.info(f"Started face engine with {self.workers} worker processes")
+            return self._pool
+
+    def after_fork(self):
+        """ Forget a pool inherited through fork(); its processes belong to the parent """
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = 0
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    def submit(self, fn, *args):
+        """
+        Queue a job on the worker pool.
+
+        Raises:
+            EngineSaturated: If max_queue jobs are already pending
+        """
+        pool = self.start()
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self._rejected += 1
+                raise EngineSaturated(f"Face engine saturated ({self._pending} jobs pending)")
+            self._pending += 1
+
+        try:
+            future = pool.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda f: self._release())
+        return future
+
+    def encode_face(self, image, label="image"):
+        """ Blocking encode_face() on a worker, see Image_compare.encode_face """
+        return self.encode_face_async(image, label).result(timeout=self.timeout)
+
+    def encode_face_async(self, image, label="image"):
+        """ encode_face() on a worker without waiting for it; returns the future """
+        return self.submit(_encode_face, _picklable(image), label)
+
+    def compare_many(self, selfie_image, candidates, tolerance=0.5):
+        """ Blocking compare_many() on a worker, see Image_compare.compare_many """
+        return self.submit(_compare_many, _picklable(selfie_image), list(candidates), tolerance).result(timeout=self.timeout)
+
+    def compare_stored(self, selfie_image, matrix_dir, image_ids, tolerance=0.5):
+        """ Blocking compare_stored() on a worker, which maps the embedding matrix in matrix_dir itself """
+        return self.submit(_compare_stored, _picklable(selfie_image), matrix_dir, list(image_ids), tolerance).result(timeout=self.timeout)
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
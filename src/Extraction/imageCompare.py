@@ -1,15 +1,383 @@
+import os
+import logging
+import threading
+
 import cv2
 import face_recognition
+import numpy as np
+
+from Extraction.preprocess import DETECT_MAX_SIDE, describe_source, downscale, read_image, scale_boxes
+
+try:
+    # The models face_recognition loaded, to run landmarks, alignment and
+    # encoding as separate steps on the face chip
+    import dlib
+    from face_recognition import api as _face_api
+    _pose_predictor = _face_api.pose_predictor_5_point
+    _face_encoder = _face_api.face_encoder
+except (ImportError, AttributeError):
+    dlib = None
+
+logger = logging.getLogger(__name__)
+
+# Detector chains per speed/accuracy mode: each detector is tried in turn
+# until one finds a face. FACE_DETECTOR and FACE_DETECTOR_SELFIE override them.
+DETECTION_MODES = {
+    'fast': {'id': 'hog', 'selfie': 'dnn,hog'},
+    'balanced': {'id': 'hog', 'selfie': 'hog'},
+    'accurate': {'id': 'hog,cnn', 'selfie': 'hog,cnn'}
+}
+DETECTION_MODE = os.getenv('FACE_DETECTION_MODE', 'balanced').lower()
+ID_DETECTOR = os.getenv('FACE_DETECTOR') or DETECTION_MODES.get(DETECTION_MODE, DETECTION_MODES['balanced'])['id']
+SELFIE_DETECTOR = os.getenv('FACE_DETECTOR_SELFIE') or DETECTION_MODES.get(DETECTION_MODE, DETECTION_MODES['balanced'])['selfie']
+# Times dlib upsamples the image to find small faces (HOG and CNN)
+DETECT_UPSAMPLE = int(os.getenv('FACE_DETECT_UPSAMPLE', 1))
+# Faces narrower than this on the full-resolution image are rejected before encoding
+MIN_FACE_SIZE = int(os.getenv('FACE_MIN_SIZE', 40))
+# Margin around the detected box kept in the face chip, as a fraction of the box size
+CHIP_PADDING = float(os.getenv('FACE_CHIP_PADDING', 0.5))
+# Side of the aligned chip the encoder runs on (dlib's face recognition model uses 150)
+ALIGNED_SIZE = 150
+
+
+class FaceDetector:
+    """
+    Face detection backend. detect() returns (top, right, bottom, left)
+    boxes on the RGB image it is given, as face_recognition does.
+    """
+    name = None
+
+    def detect(self, rgb, upsample=DETECT_UPSAMPLE, min_size=0):
+        raise NotImplementedError
+
+
+class HogDetector(FaceDetector):
+    """ dlib HOG + linear SVM: the face_recognition default, moderate speed and accuracy """
+    name = 'hog'
+    model = 'hog'
+
+    def detect(self, rgb, upsample=DETECT_UPSAMPLE, min_size=0):
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=upsample, model=self.model)
+
+
+class CnnDetector(HogDetector):
+    """ dlib CNN (MMOD): handles pose and lighting best, but is slow on a CPU """
+    name = 'cnn'
+    model = 'cnn'
+
+
+class HaarDetector(FaceDetector):
+    """ OpenCV Haar cascade: the fastest, for frontal faces such as selfies """
+    name = 'haar'
+
+    def __init__(self, cascade=None):
+        # OpenCV 5 moved the cascade classifier out of the main package
+        if not hasattr(cv2, 'CascadeClassifier'):
+            raise ValueError("This OpenCV build has no CascadeClassifier")
+        cascade = cascade or os.getenv('FACE_HAAR_CASCADE') or os.path.join(
+            cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        self.classifier = cv2.CascadeClassifier(cascade)
+        if self.classifier.empty():
+            raise ValueError(f"Could not load Haar cascade {cascade}")
+
+    def detect(self, rgb, upsample=DETECT_UPSAMPLE, min_size=0):
+        gray = cv2.equalizeHist(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY))
+        # Scales below min_size are not scanned at all
+        boxes = self.classifier.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5,
+                                                 minSize=(max(24, min_size), max(24, min_size)))
+        return [(int(y), int(x + w), int(y + h), int(x)) for x, y, w, h in boxes]
+
+
+class DnnDetector(FaceDetector):
+    """
+    OpenCV DNN SSD face detector (e.g. res10_300x300_ssd_iter_140000.caffemodel
+    with its deploy.prototxt, set by FACE_DNN_MODEL and FACE_DNN_CONFIG): fast
+    and more robust than the Haar cascade.
+    """
+    name = 'dnn'
+
+    def __init__(self, model=None, config=None, confidence=None):
+        model = model or os.getenv('FACE_DNN_MODEL')
+        config = config or os.getenv('FACE_DNN_CONFIG', '')
+        if not model or not os.path.exists(model):
+            raise ValueError("FACE_DNN_MODEL does not point at a face detection model")
+        self.net = cv2.dnn.readNet(model, config)
+        self.confidence = float(confidence or os.getenv('FACE_DNN_CONFIDENCE', 0.5))
+
+    def detect(self, rgb, upsample=DETECT_UPSAMPLE, min_size=0):
+        height, width = rgb.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(rgb, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0), swapRB=True)
+        self.net.setInput(blob)
+        detections = self.net.forward().reshape(-1, 7)
+        boxes = []
+        for confidence, left, top, right, bottom in detections[:, 2:7]:
+            if confidence < self.confidence:
+                continue
+            box = (max(0, int(top * height)), min(width, int(right * width)),
+                   min(height, int(bottom * height)), max(0, int(left * width)))
+            if box[1] - box[3] >= min_size:
+                boxes.append(box)
+        return boxes
+
+
+DETECTORS = {detector.name: detector for detector in (HogDetector, CnnDetector, HaarDetector, DnnDetector)}
+# Used instead of an OpenCV detector that can't be loaded
+FALLBACKS = {'dnn': 'haar', 'haar': 'hog'}
+# OpenCV detectors aren't thread-safe, so each thread builds its own
+_local_detectors = threading.local()
+
+
+def get_detector(name):
+    """
+    Detector instance for a backend name, built once per thread. dnn falls
+    back to haar when no model is configured, and haar to hog when OpenCV
+    has no cascade classifier.
+    """
+    cache = _local_detectors.__dict__.setdefault('detectors', {})
+    if name not in cache:
+        if name not in DETECTORS:
+            raise ValueError(f"Unknown face detector '{name}', expected one of {sorted(DETECTORS)}")
+        try:
+            cache[name] = DETECTORS[name]()
+        except ValueError as e:
+            if name not in FALLBACKS:
+                raise
+            logger.warning(f"{e}; using the {FALLBACKS[name]} face detector instead")
+            cache[name] = get_detector(FALLBACKS[name])
+    return cache[name]
+
+
+def detector_chain(detector):
+    """ Detectors for a name, a comma-separated fallback chain such as 'dnn,hog', or a FaceDetector """
+    if isinstance(detector, FaceDetector):
+        return [detector]
+    if isinstance(detector, (list, tuple)):
+        return [d for item in detector for d in detector_chain(item)]
+    return [get_detector(name.strip().lower()) for name in detector.split(',') if name.strip()]
+
 
 class Image_compare:
-    def compare(self, id_image_path, selfie_image_path, tolerance=0.5):
+    def __init__(self, detect_max_side=None, detector=None, selfie_detector=None, upsample=None, min_face_size=None):
+        # Faces are detected on a copy no larger than this, then encoded at full resolution
+        self.detect_max_side = DETECT_MAX_SIDE if detect_max_side is None else detect_max_side
+        # Detectors for ID/registered images and for selfies, see detector_chain()
+        self.detector = detector or ID_DETECTOR
+        self.selfie_detector = selfie_detector or SELFIE_DETECTOR
+        self.upsample = DETECT_UPSAMPLE if upsample is None else upsample
+        self.min_face_size = MIN_FACE_SIZE if min_face_size is None else min_face_size
+
+    def locate_faces(self, rgb, detector=None, upsample=None):
         """
-        Compare faces between an ID image and a selfie.
+        Detect faces on a downscaled copy and return full-resolution boxes.
+        Each detector of the chain is tried in turn until one finds a face.
+        """
+        small, scale = downscale(rgb, self.detect_max_side)
+        return self._detect(small, scale, rgb.shape, detector, upsample)
+
+    def too_small(self, box):
+        """ True if a full-resolution face box is narrower than min_face_size """
+        top, right, bottom, left = box
+        return min(right - left, bottom - top) < self.min_face_size
+
+    def crop_face(self, bgr, detector=None, upsample=None):
+        """
+        Detect faces once and cut a padded chip around the first one. Only
+        the downscaled detection copy and the chip are converted to RGB, and
+        the chip is a copy, so the full frame can be released afterwards.
+
+        Args:
+            bgr (numpy.ndarray): Full-resolution BGR image
+            detector (str or FaceDetector): Detector chain, the ID detector by default
+            upsample (int): dlib upsampling passes
+
+        Returns:
+            dict: face_count, the full-resolution box of the first face, the
+                RGB chip and the face's box within the chip (None without a face)
+        """
+        small, scale = downscale(bgr, self.detect_max_side)
+        boxes = self._detect(cv2.cvtColor(small, cv2.COLOR_BGR2RGB), scale, bgr.shape, detector, upsample)
+        crop = {"face_count": len(boxes), "box": None, "chip": None, "chip_box": None}
+        if not boxes:
+            return crop
+
+        top, right, bottom, left = boxes[0]
+        pad_y, pad_x = int((bottom - top) * CHIP_PADDING), int((right - left) * CHIP_PADDING)
+        y0, x0 = max(0, top - pad_y), max(0, left - pad_x)
+        y1, x1 = min(bgr.shape[0], bottom + pad_y), min(bgr.shape[1], right + pad_x)
+        crop["box"] = boxes[0]
+        crop["chip"] = cv2.cvtColor(bgr[y0:y1, x0:x1], cv2.COLOR_BGR2RGB)
+        crop["chip_box"] = (top - y0, right - x0, bottom - y0, left - x0)
+        return crop
+
+    def encode_chip(self, chip, box):
+        """
+        Run landmarks once on a face chip, align it and encode the aligned
+        face.
+
+        Args:
+            chip (numpy.ndarray): RGB face chip from crop_face()
+            box (tuple): (top, right, bottom, left) of the face within the chip
+
+        Returns:
+            tuple: (128-d encoding or None, aligned ALIGNED_SIZE RGB face or None)
+        """
+        top, right, bottom, left = box
+        if dlib is None:
+            encodings = face_recognition.face_encodings(chip, [box])
+            if not encodings:
+                return None, None
+            return encodings[0], cv2.resize(chip[top:bottom, left:right], (ALIGNED_SIZE, ALIGNED_SIZE))
+
+        landmarks = _pose_predictor(chip, dlib.rectangle(left, top, right, bottom))
+        # The same 0.25 padding the encoder applies when given the full frame
+        aligned = dlib.get_face_chip(chip, landmarks, size=ALIGNED_SIZE, padding=0.25)
+        return np.array(_face_encoder.compute_face_descriptor(aligned)), aligned
+
+    def encode_face(self, image, label="image", detector=None, keep_chip=False):
+        """
+        Detect and encode the first face found in an image. After detection
+        only the face chip is kept; landmarks and encoding run on the chip.
+
+        Args:
+            image (str, bytes or file-like): Path to the image or its encoded bytes
+            label (str): Name of the image used in error messages
+            detector (str or FaceDetector): Detector chain for this call, the
+                ID detector by default
+            keep_chip (bool): Also return the aligned face, e.g. for auditing
+
+        Returns:
+            dict: Results containing the 128-d encoding, the number of faces
+                detected (None if detection did not run), the aligned face
+                chip if requested and any error message
+        """
+        result = {
+            "encoding": None,
+            "face_count": None,
+            "error": None
+        }
+
+        try:
+            bgr = read_image(image)
+            if bgr is None:
+                result["error"] = f"Error loading {label} from {describe_source(image)}"
+                return result
+
+            crop = self.crop_face(bgr, detector=detector)
+            del bgr
+            result["face_count"] = crop["face_count"]
+            if not crop["face_count"]:
+                result["error"] = f"No face found in {label}"
+                return result
+            # Too few pixels for a reliable encoding: stop before landmarks and encoding
+            if self.too_small(crop["box"]):
+                result["error"] = f"Face in {label} is too small"
+                return result
+
+            encoding, aligned = self.encode_chip(crop["chip"], crop["chip_box"])
+            if encoding is None:
+                result["error"] = "Failed to encode face"
+                return result
+
+            result["encoding"] = encoding
+            if keep_chip:
+                result["chip"] = aligned
+            return result
+
+        except Exception as e:
+            result["error"] = f"Unexpected error: {str(e)}"
+            return result
+
+    def _detect(self, small_rgb, scale, shape, detector, upsample):
+        upsample = self.upsample if upsample is None else upsample
+        min_size = int(self.min_face_size / scale)
+        for backend in detector_chain(detector or self.detector):
+            boxes = backend.detect(small_rgb, upsample=upsample, min_size=min_size)
+            if boxes:
+                return scale_boxes(boxes, scale, shape)
+        return []
+
+    def compare_many(self, selfie_image_path, candidates, tolerance=0.5, detector=None):
+        """
+        Encode a selfie once and score it against several stored encodings
+        with a single vectorized distance computation.
+
+        Args:
+            selfie_image_path (str or bytes): Path to the selfie image or its encoded bytes
+            candidates (list): 128-d encodings of the registered images
+            tolerance (float): Threshold for face matching (lower is stricter)
+            detector (str or FaceDetector): Selfie detector chain for this call
+
+        Returns:
+            dict: Results containing match status, index and distance of the
+                best candidate, per-candidate distances, and any error messages
+        """
+        result = {
+            "match": False,
+            "best_index": None,
+            "distance": None,
+            "distances": [],
+            "error": None
+        }
+
+        if len(candidates) == 0:
+            result["error"] = "No candidate encodings to compare against"
+            return result
+
+        selfie = self.encode_face(selfie_image_path, label="selfie image", detector=detector or self.selfie_detector)
+        if selfie["error"]:
+            result["error"] = selfie["error"]
+            return result
+
+        try:
+            matrix = np.vstack([np.asarray(c, dtype=np.float64) for c in candidates])
+            distances = face_recognition.face_distance(matrix, selfie["encoding"])
+            best = int(np.argmin(distances))
+
+            result["best_index"] = best
+            result["distance"] = float(distances[best])
+            result["distances"] = [float(d) for d in distances]
+            result["match"] = bool(distances[best] <= tolerance)
+            return result
+        except Exception as e:
+            result["error"] = f"Unexpected error: {str(e)}"
+            return result
+
+    def compare_stored(self, selfie_image_path, matrix, image_ids, tolerance=0.5, detector=None):
+        """
+        compare_many() against encodings read from a shared embedding
+        matrix, so only image ids have to be passed around.
+
+        Args:
+            selfie_image_path (str or bytes): Path to the selfie image or its encoded bytes
+            matrix (EmbeddingMatrix): Stored encodings of the registered images
+            image_ids (list): Ids of the registered images to compare against
+            tolerance (float): Threshold for face matching (lower is stricter)
+            detector (str or FaceDetector): Selfie detector chain for this call
+
+        Returns:
+            dict: compare_many() results, plus the image_ids that had an
+                encoding (in the order of the distances) and the best one
+        """
+        candidates, found = matrix.get_many(image_ids)
+        result = self.compare_many(selfie_image_path, candidates, tolerance=tolerance, detector=detector)
+        result["image_ids"] = found
+        result["best_image_id"] = found[result["best_index"]] if result["best_index"] is not None else None
+        return result
+
+    def compare(self, id_image_path, selfie_image_path, tolerance=0.5, detector=None, selfie_detector=None,
+                keep_chips=False):
+        """
+        Compare faces between an ID image and a selfie. The ID image is
+        checked first, so the selfie isn't decoded at all when the ID photo
+        has no usable face.
         
         Args:
-            id_image_path (str): Path to the ID card image
-            selfie_image_path (str): Path to the selfie image
+            id_image_path (str or bytes): Path to the ID card image or its encoded bytes
+            selfie_image_path (str or bytes): Path to the selfie image or its encoded bytes
             tolerance (float): Threshold for face matching (lower is stricter)
+            detector (str or FaceDetector): ID image detector chain for this call
+            selfie_detector (str or FaceDetector): Selfie detector chain for this call
+            keep_chips (bool): Also return the aligned faces as id_chip and selfie_chip
             
         Returns:
             dict: Results containing match status, confidence score, and any error messages
@@ -19,52 +387,27 @@ class Image_compare:
             "distance": None,
             "error": None
         }
-        
-        # Load images
+
         try:
-            id_image = cv2.imread(id_image_path)
-            if id_image is None:
-                result["error"] = f"Error loading ID image from {id_image_path}"
-                return result
-                
-            selfie_image = cv2.imread(selfie_image_path)
-            if selfie_image is None:
-                result["error"] = f"Error loading selfie image from {selfie_image_path}"
+            id_face = self.encode_face(id_image_path, label="ID image", detector=detector, keep_chip=keep_chips)
+            if id_face["error"]:
+                result["error"] = id_face["error"]
                 return result
-                
-            # Convert to RGB (face_recognition uses RGB)
-            id_rgb = cv2.cvtColor(id_image, cv2.COLOR_BGR2RGB)
-            selfie_rgb = cv2.cvtColor(selfie_image, cv2.COLOR_BGR2RGB)
-            
-            # Detect faces
-            id_face_locations = face_recognition.face_locations(id_rgb)
-            selfie_face_locations = face_recognition.face_locations(selfie_rgb)
-            
-            if not id_face_locations:
-                result["error"] = "No face found in ID image"
-                return result
-                
-            if not selfie_face_locations:
-                result["error"] = "No face found in selfie image"
-                return result
-                
-            # Encode faces
-            try:
-                id_encoding = face_recognition.face_encodings(id_rgb, [id_face_locations[0]])[0]
-                selfie_encoding = face_recognition.face_encodings(selfie_rgb, [selfie_face_locations[0]])[0]
-                
-                # Compare faces
-                match = face_recognition.compare_faces([id_encoding], selfie_encoding, tolerance=tolerance)[0]
-                distance = face_recognition.face_distance([id_encoding], selfie_encoding)[0]
-                
-                result["match"] = bool(match)
-                result["distance"] = float(distance)
-                
-                return result
-                
-            except IndexError:
-                result["error"] = "Failed to encode faces"
+
+            selfie = self.encode_face(selfie_image_path, label="selfie image",
+                                      detector=selfie_detector or self.selfie_detector, keep_chip=keep_chips)
+            if selfie["error"]:
+                result["error"] = selfie["error"]
                 return result
+
+            # Compare faces
+            distance = face_recognition.face_distance([id_face["encoding"]], selfie["encoding"])[0]
+            result["match"] = bool(distance <= tolerance)
+            result["distance"] = float(distance)
+            if keep_chips:
+                result["id_chip"] = id_face["chip"]
+                result["selfie_chip"] = selfie["chip"]
+            return result
                 
         except Exception as e:
             result["error"] = f"Unexpected error: {str(e)}"
@@ -1,33 +1,337 @@
 import cv2
 import pytesseract
 import re
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from Extraction.preprocess import OCR_MAX_SIDE, describe_source, read_scaled
+from Extraction.ocrBackends import create_ocr_backend
 
 
 # Set Tesseract path if needed (Windows)
 pytesseract.pytesseract.tesseract_cmd = r'C:/Program Files/Tesseract-OCR/tesseract.exe'
 
+logger = logging.getLogger(__name__)
+
+DOB_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2})')
+
+# full: OCR the whole card; roi (opt-in): OCR only the name/date fields or detected
+# text lines, so extracted_text/ocr_text hold those lines instead of the full card
+OCR_MODE = os.getenv('OCR_MODE', 'full').lower()
+
+class OCRCache:
+    """
+    Two-tier cache of OCR output keyed by the hash of the binarized image and
+    the Tesseract config: an in-process LRU in front of a SQLite file shared
+    by all workers on the host, trimmed to max_bytes of text by last use.
+    Hit/miss counters are per process.
+    """
+
+    def __init__(self, path=None, memory_items=256, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._open()
+
+    def _open(self):
+        self._pid = os.getpid()
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS ocr_cache ('
+            'key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_ocr_cache_last_used ON ocr_cache (last_used)')
+        self._conn.commit()
+
+    def _connection(self):
+        # A connection must not be used across fork(): processes forked from
+        # the one that opened it (preloaded web or OCR workers) open their own
+        if self._conn is not None and self._pid != os.getpid():
+            self._open()
+        return self._conn
+
+    @staticmethod
+    def key(binary, config=''):
+        """ Cache key of a binarized image plus the OCR settings used on it """
+        hasher = hashlib.sha256()
+        hasher.update(str(binary.shape).encode())
+        hasher.update(config.encode())
+        hasher.update(binary.tobytes())
+        return hasher.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return text
+
+            conn = self._connection()
+            if conn is not None:
+                row = conn.execute('SELECT text FROM ocr_cache WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    conn.execute('UPDATE ocr_cache SET last_used = ? WHERE key = ?', (time.time(), key))
+                    conn.commit()
+                    self.disk_hits += 1
+                    self._remember(key, row[0])
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, text):
+        with self._lock:
+            self._remember(key, text)
+            conn = self._connection()
+            if conn is None:
+                return
+            conn.execute(
+                'INSERT OR REPLACE INTO ocr_cache (key, text, size, last_used) VALUES (?, ?, ?, ?)',
+                (key, text, len(text.encode()), time.time())
+            )
+            self._writes += 1
+            # Check the size bound every few writes rather than on each one
+            if self._writes % 32 == 0:
+                self._evict(conn)
+            conn.commit()
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        stats = {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else None,
+            'memory_items': len(self._memory)
+        }
+        if self._conn is not None:
+            with self._lock:
+                count, size = self._connection().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache').fetchone()
+            stats.update({'disk_items': count, 'disk_bytes': size, 'disk_max_bytes': self.max_bytes})
+        return stats
+
+    def _remember(self, key, text):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM ocr_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until 90% of the bound is free again
+        excess = total - int(self.max_bytes * 0.9)
+        rows = conn.execute('SELECT key, size FROM ocr_cache ORDER BY last_used').fetchall()
+        victims = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+        conn.executemany('DELETE FROM ocr_cache WHERE key = ?', victims)
+
+
+def default_ocr_cache():
+    """ OCRCache configured from OCR_CACHE_PATH, OCR_CACHE_MEMORY_ITEMS and OCR_CACHE_MAX_MB """
+    return OCRCache(
+        path=os.getenv('OCR_CACHE_PATH', 'cache/ocr_cache.sqlite') or None,
+        memory_items=int(os.getenv('OCR_CACHE_MEMORY_ITEMS', 256)),
+        max_bytes=int(os.getenv('OCR_CACHE_MAX_MB', 64)) * 1024 * 1024
+    )
+
+
+def load_field_templates(path=None):
+    """
+    Per-document_type field layouts from a JSON file (OCR_TEMPLATES_PATH):
+
+        {"ID": {"name": [x, y, w, h], "date_of_birth": [x, y, w, h]}}
+
+    Boxes are fractions of the card width/height, so templates only suit
+    images cropped to the card edges.
+    """
+    path = path or os.getenv('OCR_TEMPLATES_PATH')
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def crop_fraction(image, box, pad=0.01):
+    """ Crop a (x, y, w, h) box given as fractions of the image size, with a small margin """
+    height, width = image.shape[:2]
+    x, y, w, h = box
+    x0 = max(0, int((x - pad) * width))
+    y0 = max(0, int((y - pad) * height))
+    x1 = min(width, int((x + w + pad) * width))
+    y1 = min(height, int((y + h + pad) * height))
+    return image[y0:y1, x0:x1]
+
+
+def detect_text_lines(binary, max_lines=12):
+    """
+    Find text lines on a binarized card (dark text on a light background).
+
+    Characters are merged into line blobs with a wide dilation; blobs that
+    are too small, taller than wide or very tall (photos, borders) are
+    dropped.
+
+    Returns:
+        list: (x0, y0, x1, y1) boxes in reading order
+    """
+    height, width = binary.shape[:2]
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, width // 50), max(3, height // 300)))
+    merged = cv2.dilate(255 - binary, kernel)
+    contours = cv2.findContours(merged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+
+    words = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < height * 0.015 or h > height * 0.25 or w < h:
+            continue
+        words.append([x, y, x + w, y + h])
+
+    # Join blobs on the same line separated by less than about a character height
+    lines = []
+    for box in sorted(words):
+        for line in lines:
+            overlap = min(line[3], box[3]) - max(line[1], box[1])
+            gap = box[0] - line[2]
+            if overlap > 0.5 * min(line[3] - line[1], box[3] - box[1]) and gap < 1.5 * (box[3] - box[1]):
+                line[:] = [line[0], min(line[1], box[1]), max(line[2], box[2]), max(line[3], box[3])]
+                break
+        else:
+            lines.append(box)
+
+    pad = max(2, height // 200)
+    boxes = [(max(0, x0 - pad), max(0, y0 - pad), min(width, x1 + pad), min(height, y1 + pad))
+             for x0, y0, x1, y1 in lines if x1 - x0 >= 1.5 * (y1 - y0)]
+    # Top to bottom, then left to right
+    boxes.sort(key=lambda box: (box[1], box[0]))
+    return boxes[:max_lines]
+
+
 class ImageExtractor:
     """ Extract text from images using OCR """
     
-    def __init__(self):
+    def __init__(self, max_side=None, cache=None, tesseract_config='', ocr_backend=None,
+                 mode=None, templates=None, roi_workers=None):
         self.last_processed_image = None
+        # Longest edge the card is decoded at before thresholding and OCR
+        self.max_side = OCR_MAX_SIDE if max_side is None else max_side
+        self.tesseract_config = tesseract_config
+        # OCR output cache keyed by the binarized image and tesseract_config
+        self.cache = cache if cache is not None else default_ocr_cache()
+        # pytesseract (one tesseract process per image) or pooled in-process tesserocr handles
+        self.ocr_backend = ocr_backend if ocr_backend is not None else create_ocr_backend(config=tesseract_config)
+        self.mode = (mode or OCR_MODE).lower()
+        self.templates = templates if templates is not None else load_field_templates()
+        # Field/line crops are OCRed on this many threads; 1 reads lines in order and stops at the date
+        self.roi_workers = roi_workers or int(os.getenv('OCR_ROI_WORKERS', 1))
+        self._roi_pool = None
+        self._roi_lock = threading.Lock()
         
-    def process_and_extract(self, image_path):
-        """ Process image and extract text in one step """
+    def process_and_extract(self, image, document_type=None):
+        """
+        Process image (a path or encoded bytes) and extract text in one step.
+        In roi mode only the name and date of birth regions are recognised:
+        from the document_type template if there is one, otherwise from the
+        detected text lines. The text keeps the name on the first line so
+        parse_ocr_data reads both modes alike.
+        """
         try:
-            # Load and preprocess
-            image = cv2.imread(image_path)
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            # Load at reduced size straight to grayscale and preprocess
+            gray, _ = read_scaled(image, self.max_side, grayscale=True)
+            if gray is None:
+                raise ValueError(f"Could not read image {describe_source(image)}")
             _, binary = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
             
             # Store processed image
             self.last_processed_image = binary
             
+            if self.mode == 'roi':
+                text = self._extract_regions(binary, document_type)
+                if text is not None:
+                    return text
+
             # Perform OCR
-            text = pytesseract.image_to_string(binary)
-            return text
+            return self._recognize(binary, self.tesseract_config)
         except Exception as e:
             return f"Error processing image: {str(e)}"
+
+    def _recognize(self, binary, config):
+        # Reuse the text of an identical binarized image, e.g. a client retry
+        cache_key = OCRCache.key(binary, f"{self.ocr_backend.name} {config}")
+        text = self.cache.get(cache_key)
+        if text is not None:
+            return text
+
+        text = self.ocr_backend.image_to_string(binary, config=config)
+        self.cache.put(cache_key, text)
+        return text
+
+    def _extract_regions(self, binary, document_type):
+        # Each crop holds a single line of text
+        config = self.tesseract_config if '--psm' in self.tesseract_config else f"{self.tesseract_config} --psm 7".strip()
+
+        template = self.templates.get(document_type) if document_type else None
+        if template:
+            crops = [crop_fraction(binary, template[field]) for field in ('name', 'date_of_birth') if field in template]
+            texts = self._recognize_all(crops, config)
+            logger.debug(f"OCRed {len(crops)} template fields for {document_type}")
+            return '\n'.join(texts) + '\n'
+
+        boxes = detect_text_lines(binary)
+        if not boxes:
+            logger.debug("No text lines detected, falling back to full-card OCR")
+            return None
+
+        crops = [binary[y0:y1, x0:x1] for x0, y0, x1, y1 in boxes]
+        texts = self._recognize_all(crops, config, stop=lambda text: DOB_PATTERN.search(text))
+        logger.debug(f"OCRed {len(texts)} of {len(boxes)} detected text lines")
+        return '\n'.join(texts) + '\n'
+
+    def _recognize_all(self, crops, config, stop=None):
+        """ Non-empty texts of crops in order; sequentially this stops after the first crop matching stop """
+        if self.roi_workers > 1 and len(crops) > 1:
+            texts = [text.strip() for text in self._pool().map(lambda crop: self._recognize(crop, config), crops)]
+            return [text for text in texts if text]
+
+        texts = []
+        for crop in crops:
+            text = self._recognize(crop, config).strip()
+            if text:
+                texts.append(text)
+                if stop is not None and stop(text):
+                    break
+        return texts
+
+    def _pool(self):
+        with self._roi_lock:
+            if self._roi_pool is None:
+                self._roi_pool = ThreadPoolExecutor(max_workers=self.roi_workers)
+            return self._roi_pool
         
 
     def parse_ocr_data(self, ocr_text):
@@ -36,7 +340,7 @@ class ImageExtractor:
         Here we assume the first non-empty line is the name and look for a date pattern.
         """
         # Look for a date in the format YYYY-MM-DD
-        dob_match = re.search(r'(\d{4}-\d{2}-\d{2})', ocr_text)
+        dob_match = DOB_PATTERN.search(ocr_text)
         dob = dob_match.group(1) if dob_match else None
         # Assume the first non-empty line is the name
         lines = [line.strip() for line in ocr_text.splitlines() if line.strip()]
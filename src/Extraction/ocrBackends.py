@@ -0,0 +1,172 @@
+import os
+import queue
+import shlex
+import logging
+import threading
+
+import pytesseract
+from PIL import Image as PILImage
+
+logger = logging.getLogger(__name__)
+
+
+class PytesseractBackend:
+    """ Runs the tesseract CLI once per image through pytesseract """
+
+    name = 'pytesseract'
+
+    def image_to_string(self, image, config=''):
+        return pytesseract.image_to_string(image, config=config)
+
+    def stats(self):
+        return {'backend': self.name}
+
+    def close(self):
+        pass
+
+
+def parse_tesseract_config(config):
+    """
+    Split a pytesseract-style config string ("--psm 6 --oem 1 -c name=value")
+    into (psm, oem, variables) for the tesserocr API.
+    """
+    psm, oem, variables = None, None, {}
+    args = shlex.split(config or '')
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in ('--psm', '--oem', '-c') and i + 1 < len(args):
+            value = args[i + 1]
+            if arg == '--psm':
+                psm = int(value)
+            elif arg == '--oem':
+                oem = int(value)
+            else:
+                name, _, var_value = value.partition('=')
+                variables[name] = var_value
+            i += 2
+        else:
+            logger.warning(f"Ignoring unsupported tesseract option: {arg}")
+            i += 1
+    return psm, oem, variables
+
+
+class TesserocrBackend:
+    """
+    Runs Tesseract in-process through tesserocr. Each API handle loads the
+    language model once and is reused for every image; handles are kept in
+    a pool of up to pool_size so concurrent request threads don't share one.
+    Handles are per process, so every OCR worker owns its own pool.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, lang='eng', tessdata=None, pool_size=2):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.lang = lang
+        self.tessdata = tessdata
+        self.pool_size = pool_size
+        self._idle = {}
+        self._created = {}
+        self._lock = threading.Lock()
+
+    def _create(self, psm, oem, variables):
+        kwargs = {'lang': self.lang}
+        if self.tessdata:
+            kwargs['path'] = self.tessdata
+        if psm is not None:
+            kwargs['psm'] = psm
+        if oem is not None:
+            kwargs['oem'] = oem
+        api = self._tesserocr.PyTessBaseAPI(**kwargs)
+        for name, value in variables.items():
+            if not api.SetVariable(name, value):
+                logger.warning(f"Unknown tesseract variable: {name}")
+        logger.info(f"Loaded tesserocr handle ({self.lang}, config={(psm, oem, variables)})")
+        return api
+
+    def _acquire(self, config):
+        # Handles are bound to the settings they were initialised with, so pool them per config
+        with self._lock:
+            idle = self._idle.setdefault(config, queue.LifoQueue())
+            try:
+                return idle.get_nowait()
+            except queue.Empty:
+                pass
+            create = self._created.get(config, 0) < self.pool_size
+            if create:
+                self._created[config] = self._created.get(config, 0) + 1
+
+        if not create:
+            return idle.get()
+        try:
+            return self._create(*parse_tesseract_config(config))
+        except Exception:
+            with self._lock:
+                self._created[config] -= 1
+            raise
+
+    def warm_up(self, config=''):
+        """ Load a handle for config now rather than on the first image """
+        self._release(config, self._acquire(config))
+
+    def image_to_string(self, image, config=''):
+        api = self._acquire(config)
+        try:
+            api.SetImage(PILImage.fromarray(image))
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+            self._release(config, api)
+
+    def _release(self, config, api):
+        with self._lock:
+            idle = self._idle[config]
+        idle.put(api)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.name,
+                'pool_size': self.pool_size,
+                'handles': sum(self._created.values()),
+                'idle': sum(idle.qsize() for idle in self._idle.values())
+            }
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                while not idle.empty():
+                    idle.get_nowait().End()
+            self._idle.clear()
+            self._created.clear()
+
+
+def create_ocr_backend(name=None, config=''):
+    """
+    Build the OCR backend selected by OCR_BACKEND (pytesseract or tesserocr).
+    tesserocr reads TESSEROCR_POOL_SIZE, OCR_LANG and TESSDATA_PREFIX and
+    loads its first handle for config up front; if it is not installed or
+    the model can't be loaded the pytesseract backend is used instead.
+    """
+    name = (name or os.getenv('OCR_BACKEND', 'pytesseract')).lower()
+    if name == 'pytesseract':
+        return PytesseractBackend()
+
+    if name == 'tesserocr':
+        try:
+            backend = TesserocrBackend(
+                lang=os.getenv('OCR_LANG', 'eng'),
+                tessdata=os.getenv('TESSDATA_PREFIX'),
+                pool_size=int(os.getenv('TESSEROCR_POOL_SIZE', 2))
+            )
+            backend.warm_up(config)
+            return backend
+        except ImportError:
+            logger.warning("tesserocr is not installed, falling back to pytesseract")
+        except RuntimeError as e:
+            logger.warning(f"Could not initialise tesserocr ({e}), falling back to pytesseract")
+        return PytesseractBackend()
+
+    raise ValueError(f"Unknown OCR_BACKEND: {name}")
@@ -0,0 +1,168 @@
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image as PILImage
+
+from Storage.contentStore import ContentStore, default_store
+
+
+# Longest edge used for face detection and for OCR, configurable per deployment
+DETECT_MAX_SIDE = int(os.getenv('DETECT_MAX_SIDE', 800))
+OCR_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', 2000))
+
+_REDUCED_FLAGS = {
+    False: {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8},
+    True: {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8},
+}
+
+
+def as_source(source):
+    """
+    Normalise an image source to either a path or a bytes-like buffer.
+    File-like objects (e.g. a Werkzeug upload stream) are read once, and
+    canonical storage keys are read from the configured blob storage.
+    """
+    if isinstance(source, str) and ContentStore.is_key(source):
+        return default_store().read(source)
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    if hasattr(source, 'read'):
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return source.read()
+    return source
+
+
+def describe_source(source):
+    """ Short description of an image source for error messages """
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    try:
+        return f"<in-memory image, {len(source)} bytes>"
+    except TypeError:
+        return "<in-memory image>"
+
+
+def read_image(source, flag=cv2.IMREAD_COLOR):
+    """
+    Decode an image from a path or from memory with cv2.imdecode.
+
+    Args:
+        source (str, bytes, memoryview or file-like): Image to decode
+        flag (int): cv2.IMREAD_* flag
+
+    Returns:
+        numpy.ndarray or None: Decoded image, None if it cannot be decoded
+    """
+    source = as_source(source)
+    if isinstance(source, str):
+        return cv2.imread(source, flag)
+
+    buffer = np.frombuffer(source, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, flag)
+
+
+def image_size(source):
+    """ Read (width, height) from the image header without decoding pixels """
+    try:
+        if not isinstance(source, str):
+            source = io.BytesIO(source)
+        with PILImage.open(source) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def downscale(image, max_side):
+    """
+    Shrink an image so its longest edge is at most max_side.
+
+    Args:
+        image (numpy.ndarray): Image to shrink
+        max_side (int): Target longest edge in pixels (0 or None disables)
+
+    Returns:
+        tuple: (resized image, scale) where scale maps resized coordinates
+            back to the input (full = resized * scale)
+    """
+    height, width = image.shape[:2]
+    longest = max(height, width)
+    if not max_side or longest <= max_side:
+        return image, 1.0
+
+    scale = longest / float(max_side)
+    size = (max(1, int(round(width / scale))), max(1, int(round(height / scale))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+
+def read_scaled(source, max_side, grayscale=False):
+    """
+    Decode an image at reduced size. The largest IMREAD_REDUCED_* factor that
+    keeps the longest edge at or above max_side is applied by the decoder,
+    so the full-resolution bitmap is never materialised, and the remainder is
+    done with an area resize.
+
+    Args:
+        source (str, bytes, memoryview or file-like): Image to decode
+        max_side (int): Target longest edge in pixels (0 or None disables)
+        grayscale (bool): Decode straight to a single channel
+
+    Returns:
+        tuple: (image or None, scale) where full = loaded * scale
+    """
+    source = as_source(source)
+    flag = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    factor = 1
+
+    size = image_size(source) if max_side else None
+    if size:
+        longest = max(size)
+        for candidate in (8, 4, 2):
+            if longest / candidate >= max_side:
+                factor = candidate
+                flag = _REDUCED_FLAGS[grayscale][candidate]
+                break
+
+    image = read_image(source, flag)
+    if image is None:
+        return None, 1.0
+
+    image, scale = downscale(image, max_side)
+    if size and factor > 1:
+        # Use the true ratio, the decoder rounds reduced sizes up
+        scale = max(size) / float(max(image.shape[:2]))
+    return image, scale
+
+
+def scale_boxes(boxes, scale, shape):
+    """
+    Map (top, right, bottom, left) face boxes found on a downscaled image back
+    to the full-resolution image, clamped to its bounds.
+
+    Args:
+        boxes (list): Face locations on the small image
+        scale (float): Factor returned by downscale()
+        shape (tuple): Shape of the full-resolution image
+
+    Returns:
+        list: Face locations in full-resolution coordinates
+    """
+    if scale == 1.0:
+        return list(boxes)
+
+    height, width = shape[:2]
+    return [
+        (
+            max(0, int(top * scale)),
+            min(width, int(round(right * scale))),
+            min(height, int(round(bottom * scale))),
+            max(0, int(left * scale))
+        )
+        for top, right, bottom, left in boxes
+    ]
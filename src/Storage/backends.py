@@ -0,0 +1,302 @@
+import os
+import uuid
+import shutil
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _atomic_write(path, chunks):
+    """ Write chunks to a temp file next to path and rename it into place """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _iter_stream(stream, chunk_size=CHUNK_SIZE):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+class FileSystemBackend:
+    """ Blobs stored as files under a local (or shared) directory """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def put_bytes(self, key, data):
+        _atomic_write(self.path(key), [data])
+
+    def put_stream(self, key, stream):
+        _atomic_write(self.path(key), _iter_stream(stream))
+
+    def put_file(self, key, file_path):
+        """ Move a finished local file into the store """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(file_path, path)
+
+    def get_bytes(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def get_range(self, key, start, length):
+        with open(self.path(key), 'rb') as f:
+            f.seek(start)
+            return f.read(length)
+
+    def local_path(self, key):
+        return self.path(key)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class ReadThroughCache:
+    """
+    Bounded local disk cache for blobs fetched from remote storage. Keys are
+    content-addressed and never change, so entries never go stale; the
+    least recently used files are evicted once max_bytes is exceeded.
+    """
+
+    def __init__(self, root, max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def fetch_path(self, key, fetch):
+        """ Local path of a cached blob, downloading it with fetch(path) on a miss """
+        path = self.path(key)
+        if os.path.exists(path):
+            os.utime(path)  # mark as recently used
+            return path
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            fetch(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._size += os.path.getsize(path)
+        self._evict()
+        return path
+
+    def adopt(self, key, file_path):
+        """ Move a local file just uploaded under key into the cache """
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(file_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(file_path, path)
+        with self._lock:
+            self._size += os.path.getsize(path)
+        self._evict()
+
+    def evict(self, key):
+        path = self.path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._size -= size
+
+    def _evict(self):
+        with self._lock:
+            if self._size <= self.max_bytes:
+                return
+            entries = []
+            for directory, _, files in os.walk(self.root):
+                for name in files:
+                    if name.endswith('.part'):
+                        continue
+                    path = os.path.join(directory, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_atime, stat.st_mtime, stat.st_size, path))
+            for _, _, size, path in sorted(entries):
+                if self._size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    self._size -= size
+                except FileNotFoundError:
+                    pass
+
+
+class S3Backend:
+    """
+    Blobs stored in an S3-compatible bucket (AWS S3, MinIO, moto). Large
+    writes use streaming multipart upload, reads can be ranged, and full
+    reads go through an optional local ReadThroughCache so repeat
+    verifications on the same node don't refetch.
+    """
+
+    def __init__(self, bucket, prefix='', client=None, part_size=8 * 1024 * 1024, cache=None, **client_kwargs):
+        if client is None:
+            import boto3
+            client = boto3.client('s3', **client_kwargs)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        # S3 requires every part but the last to be at least 5 MiB
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.cache = cache
+
+    def object_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def put_bytes(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=data)
+
+    def put_stream(self, key, stream):
+        """ Upload a stream part by part without holding more than one part in memory """
+        object_key = self.object_key(key)
+        first = stream.read(self.part_size)
+        if len(first) < self.part_size:
+            self.put_bytes(key, first)
+            return
+
+        upload = self.client.create_multipart_upload(Bucket=self.bucket, Key=object_key)
+        upload_id = upload['UploadId']
+        parts = []
+        try:
+            chunk, number = first, 1
+            while chunk:
+                response = self.client.upload_part(
+                    Bucket=self.bucket, Key=object_key, UploadId=upload_id,
+                    PartNumber=number, Body=chunk
+                )
+                parts.append({'ETag': response['ETag'], 'PartNumber': number})
+                chunk, number = stream.read(self.part_size), number + 1
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=object_key, UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id)
+            raise
+
+    def put_file(self, key, file_path):
+        """ Upload a finished local file, then keep it in the cache (the uploader reads it next) or remove it """
+        with open(file_path, 'rb') as f:
+            self.put_stream(key, f)
+        if self.cache is not None:
+            self.cache.adopt(key, file_path)
+        else:
+            os.remove(file_path)
+
+    def get_bytes(self, key):
+        if self.cache is not None:
+            with open(self.local_path(key), 'rb') as f:
+                return f.read()
+        response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))
+        return response['Body'].read()
+
+    def get_range(self, key, start, length):
+        if self.cache is not None and os.path.exists(self.cache.path(key)):
+            with open(self.cache.path(key), 'rb') as f:
+                f.seek(start)
+                return f.read(length)
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self.object_key(key),
+            Range=f"bytes={start}-{start + length - 1}"
+        )
+        return response['Body'].read()
+
+    def local_path(self, key):
+        """ Path of a local copy, downloaded into the read-through cache """
+        if self.cache is None:
+            raise RuntimeError("S3Backend.local_path requires a read-through cache")
+
+        def fetch(path):
+            response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(response['Body'], f, CHUNK_SIZE)
+
+        return self.cache.fetch_path(key, fetch)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+        if self.cache is not None:
+            self.cache.evict(key)
+
+
+def create_backend():
+    """
+    Build the storage backend from the environment:
+
+        STORAGE_BACKEND       filesystem (default) or s3
+        UPLOAD_FOLDER_BLOBS   root directory for the filesystem backend
+        S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION
+                              bucket settings; S3_ENDPOINT_URL points at MinIO/moto
+        STORAGE_CACHE_DIR, STORAGE_CACHE_MB
+                              local read-through cache for the s3 backend
+    """
+    kind = os.getenv('STORAGE_BACKEND', 'filesystem').lower()
+    if kind in ('filesystem', 'fs', 'local'):
+        return FileSystemBackend(os.getenv('UPLOAD_FOLDER_BLOBS', 'uploads/blobs'))
+
+    if kind == 's3':
+        cache = ReadThroughCache(
+            os.getenv('STORAGE_CACHE_DIR', 'uploads/cache'),
+            max_bytes=int(os.getenv('STORAGE_CACHE_MB', 512)) * 1024 * 1024
+        )
+        client_kwargs = {}
+        if os.getenv('S3_ENDPOINT_URL'):
+            client_kwargs['endpoint_url'] = os.getenv('S3_ENDPOINT_URL')
+        if os.getenv('S3_REGION'):
+            client_kwargs['region_name'] = os.getenv('S3_REGION')
+        return S3Backend(
+            os.environ['S3_BUCKET'],
+            prefix=os.getenv('S3_PREFIX', ''),
+            cache=cache,
+            **client_kwargs
+        )
+
+    raise ValueError(f"Unknown STORAGE_BACKEND: {kind}")
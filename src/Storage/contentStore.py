@@ -0,0 +1,165 @@
+import os
+import re
+import uuid
+import hashlib
+import logging
+import tempfile
+import threading
+
+from Storage.backends import create_backend
+
+logger = logging.getLogger(__name__)
+
+# Canonical storage key: ab/cd/<sha256><ext>, relative to the store root
+KEY_PATTERN = re.compile(r'^([0-9a-f]{2})/([0-9a-f]{2})/(\1\2[0-9a-f]{60})(\.[a-z0-9]+)?$')
+
+
+class ContentStore:
+    """
+    Content-addressed file store. Files are named by the SHA-256 of their
+    bytes and sharded two levels deep (ab/cd/abcd...<ext>), so identical
+    uploads are stored once no matter how often they are retried. Where the
+    bytes live is up to the backend (see Storage.backends).
+    """
+
+    def __init__(self, backend, tmp_dir=None, chunk_size=64 * 1024):
+        self.backend = backend
+        self.chunk_size = chunk_size
+        # Spool next to a filesystem store so finished files can be renamed into place
+        if tmp_dir is None:
+            root = getattr(backend, 'root', None)
+            tmp_dir = os.path.join(root, '.tmp') if root else tempfile.gettempdir()
+        self.tmp_dir = tmp_dir
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    @staticmethod
+    def digest(data):
+        """ SHA-256 hex digest of in-memory bytes """
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def normalize_ext(filename):
+        """ Lower-case extension of a filename with its dot, '' if there is none """
+        ext = os.path.splitext(filename)[1].lower()
+        return ext if ext[1:].isalnum() else ''
+
+    @staticmethod
+    def key_for(digest, ext=''):
+        """ Canonical storage key stored in image_url/document_url """
+        return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+    @staticmethod
+    def is_key(value):
+        return isinstance(value, str) and KEY_PATTERN.match(value) is not None
+
+    @staticmethod
+    def split_key(key):
+        """ (digest, ext) of a canonical storage key """
+        match = KEY_PATTERN.match(key)
+        return match.group(3), match.group(4) or ''
+
+    def exists(self, digest, ext=''):
+        return self.backend.exists(self.key_for(digest, ext))
+
+    def read(self, key):
+        """ Full content of a stored blob """
+        return self.backend.get_bytes(key)
+
+    def read_range(self, key, start, length):
+        """ length bytes of a stored blob starting at offset start """
+        return self.backend.get_range(key, start, length)
+
+    def local_path(self, key):
+        """ Path of a local copy of a blob, for tools that need a real file """
+        return self.backend.local_path(key)
+
+    def put_bytes(self, data, ext='', digest=None):
+        """
+        Store in-memory bytes, skipping the write if the content is already
+        present.
+
+        Returns:
+            tuple: (digest, key, created)
+        """
+        digest = digest or self.digest(data)
+        key = self.key_for(digest, ext)
+        if self.backend.exists(key):
+            return digest, key, False
+
+        self.backend.put_bytes(key, data)
+        logger.debug(f"Stored blob {key}")
+        return digest, key, True
+
+    def put_stream(self, stream, ext=''):
+        """
+        Store a stream chunk by chunk, hashing while it is spooled, so the
+        file never has to be held in memory or read back to be named.
+
+        Returns:
+            tuple: (digest, key, size, created)
+        """
+        digest, size, tmp_path = self.spool(stream)
+        key, created = self.put_spooled(tmp_path, digest, ext)
+        return digest, key, size, created
+
+    def spool(self, stream):
+        """
+        Copy a stream to a temporary file in one pass, hashing it on the
+        way. The file is removed if reading the stream fails.
+
+        Returns:
+            tuple: (digest, size, path of the spooled file)
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return hasher.hexdigest(), size, tmp_path
+
+    def put_spooled(self, tmp_path, digest, ext=''):
+        """
+        Store a file written by spool() under its content key. The spooled
+        file is consumed either way.
+
+        Returns:
+            tuple: (key, created)
+        """
+        key = self.key_for(digest, ext)
+        try:
+            if self.backend.exists(key):
+                return key, False
+
+            # The backend takes ownership of the spooled file
+            self.backend.put_file(key, tmp_path)
+            logger.debug(f"Stored blob {key}")
+            return key, True
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, digest, ext=''):
+        self.backend.delete(self.key_for(digest, ext))
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def default_store():
+    """ Process-wide ContentStore for the backend configured in the environment """
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = ContentStore(create_backend())
+        return _default_store
@@ -0,0 +1,290 @@
+import os
+import logging
+import threading
+from collections import namedtuple
+
+import magic
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename
+
+from Storage.contentStore import ContentStore
+
+logger = logging.getLogger(__name__)
+
+# libmagic only needs the start of a file to recognise its type
+SNIFF_BYTES = 2048
+
+ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'pdf'}
+ALLOWED_MIME_TYPES = {'image/jpeg', 'image/png', 'application/pdf'}
+
+# An accepted upload, its durable copy written by `write`; once that is done it can be
+# processed from ContentStore.local_path(key) without holding it in memory
+Upload = namedtuple('Upload', 'filename key digest size write')
+
+_magic = None
+_magic_lock = threading.Lock()
+
+
+class UploadRejected(ValueError):
+    """
+    An upload refused while it was being read; status is the HTTP status to
+    answer with. Nothing of the request has been stored by then.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff_mime(head):
+    """
+    MIME type of a file from its first bytes. The libmagic handle is opened
+    once per process (loading the magic database is the expensive part) and
+    python-magic serializes calls on it.
+    """
+    global _magic
+    if _magic is None:
+        with _magic_lock:
+            if _magic is None:
+                _magic = magic.Magic(mime=True)
+    return _magic.from_buffer(head)
+
+
+class ValidatedUpload:
+    """
+    File-like wrapper that validates an upload while it is read: the MIME
+    type is sniffed from the first SNIFF_BYTES and the size is counted chunk
+    by chunk, so a wrong type is refused after the first chunk and an
+    oversized file as soon as it crosses the limit, not after the whole body
+    has been received. Pass it to ContentStore.spool() to hash and store it
+    in the same pass.
+
+    Args:
+        stream: Object with read(size), e.g. a MultipartStream file part
+        max_size (int): Largest accepted file in bytes
+        allowed_mime_types (set): Accepted sniffed MIME types
+    """
+
+    def __init__(self, stream, max_size, allowed_mime_types):
+        self._stream = stream
+        self.max_size = max_size
+        self.allowed_mime_types = allowed_mime_types
+        self.mime_type = None
+        self.size = 0
+        self._head = b''
+
+    def read(self, size=-1):
+        if self.mime_type is None:
+            self._sniff()
+
+        if self._head:
+            if size is None or size < 0:
+                chunk, self._head = self._head + self._stream.read(), b''
+            else:
+                chunk, self._head = self._head[:size], self._head[size:]
+        else:
+            chunk = self._stream.read(size)
+
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise UploadRejected('File too large', 413)
+        return chunk
+
+    def _sniff(self):
+        head = b''
+        while len(head) < SNIFF_BYTES:
+            chunk = self._stream.read(SNIFF_BYTES - len(head))
+            if not chunk:
+                break
+            head += chunk
+        self.mime_type = sniff_mime(head)
+        if self.mime_type not in self.allowed_mime_types:
+            raise UploadRejected('Invalid file type or size')
+        self._head = head
+
+
+class MultipartStream:
+    """
+    Incremental multipart/form-data parser over a request body stream,
+    reading chunk_size bytes at a time instead of spooling the whole body
+    the way request.form/request.files do. Iterating yields the parts in
+    the order they were sent:
+
+        (name, None, value)       a form field, decoded as UTF-8
+        (name, filename, part)    a file, read with part.read(size)
+
+    A file part is only valid until the next part is requested; whatever
+    the caller did not read of it is skipped. Reading stops with
+    UploadRejected once the body exceeds max_size bytes.
+
+    Args:
+        stream: Request body, e.g. request.stream
+        boundary (str): Boundary from the Content-Type header
+        max_size (int): Largest accepted body in bytes
+        chunk_size (int): Bytes read from the stream per call
+        max_form_memory_size (int): Largest accepted form field in bytes
+    """
+
+    def __init__(self, stream, boundary, max_size, chunk_size=64 * 1024, max_form_memory_size=500 * 1024):
+        if not boundary:
+            raise UploadRejected('Missing multipart boundary')
+        self._stream = stream
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.max_form_memory_size = max_form_memory_size
+        self.bytes_read = 0
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'), max_form_memory_size=chunk_size + max_form_memory_size)
+
+    def __iter__(self):
+        event = self._next_event()
+        while not isinstance(event, Epilogue):
+            if isinstance(event, Field):
+                value = b''
+                more = True
+                while more:
+                    data = self._next_event()
+                    value += data.data
+                    more = data.more_data
+                    if len(value) > self.max_form_memory_size:
+                        raise UploadRejected('Form field too large', 413)
+                yield event.name, None, value.decode('utf-8', 'replace')
+            elif isinstance(event, File):
+                part = _FilePart(self)
+                yield event.name, event.filename, part
+                while part.read(self.chunk_size):
+                    pass
+            event = self._next_event()
+
+    def _next_event(self):
+        """ Next parser event other than a preamble, reading more of the body as needed """
+        while True:
+            try:
+                event = self._decoder.next_event()
+            except ValueError as e:
+                raise UploadRejected(f'Malformed multipart body: {e}') from e
+            if not isinstance(event, NeedData):
+                if isinstance(event, (Field, File, Data, Epilogue)):
+                    return event
+                continue
+
+            try:
+                chunk = self._stream.read(self.chunk_size)
+            except RequestEntityTooLarge as e:
+                # Werkzeug's own limit on a body without Content-Length
+                raise UploadRejected('Request too large', 413) from e
+            self.bytes_read += len(chunk)
+            if self.bytes_read > self.max_size:
+                raise UploadRejected('Request too large', 413)
+            try:
+                self._decoder.receive_data(chunk or None)
+            except RequestEntityTooLarge as e:
+                raise UploadRejected('Form field too large', 413) from e
+
+
+class _FilePart:
+    """ Data of the current file part of a MultipartStream, pulled on read """
+
+    def __init__(self, parser):
+        self._parser = parser
+        self._buffer = b''
+        self._done = False
+
+    def read(self, size=-1):
+        while not self._done and (size is None or size < 0 or len(self._buffer) < size):
+            event = self._parser._next_event()
+            self._buffer += event.data
+            self._done = not event.more_data
+        if size is None or size < 0:
+            chunk, self._buffer = self._buffer, b''
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+class UploadReader:
+    """
+    Reads the form fields and file uploads of a multipart request straight
+    from its body. Each file is checked by extension before any of its data
+    is read, then by sniffed MIME type and size while it is spooled (and
+    hashed) to the content store, so a bad upload is refused after its
+    first chunk. Once the whole body has been read and accepted, the spooled
+    files are moved into place on `writer`; the request processes them from
+    there, so an upload is never held in memory whole.
+
+    Args:
+        content_store (ContentStore): Store the uploads are written to
+        writer (Executor): Runs the background ContentStore.put_spooled calls
+        max_file_size (int): Largest accepted file in bytes
+        max_request_size (int): Largest accepted request body in bytes
+    """
+
+    def __init__(self, content_store, writer, max_file_size, max_request_size,
+                 allowed_extensions=ALLOWED_EXTENSIONS, allowed_mime_types=ALLOWED_MIME_TYPES):
+        self.content_store = content_store
+        self.writer = writer
+        self.max_file_size = max_file_size
+        self.max_request_size = max_request_size
+        self.allowed_extensions = allowed_extensions
+        self.allowed_mime_types = allowed_mime_types
+
+    def read(self, request, file_fields, reserve=None):
+        """
+        Parse a request's multipart body. Parts that aren't in file_fields,
+        repeated fields and files sent without a filename are skipped.
+
+        Args:
+            request: Flask request, its body not read yet
+            file_fields (set): Names of the file fields to accept
+            reserve (callable): Called with the accepted Uploads before their
+                durable copies are written, e.g. to reference their blobs
+
+        Returns:
+            tuple: (dict of form fields, dict of field name to Upload)
+
+        Raises:
+            UploadRejected: the body isn't multipart, is too large, or holds
+                a file of the wrong type or size
+        """
+        if request.mimetype != 'multipart/form-data':
+            raise UploadRejected('Expected a multipart/form-data upload')
+        if request.content_length is not None and request.content_length > self.max_request_size:
+            raise UploadRejected('Request too large', 413)
+
+        form, spooled = {}, {}
+        try:
+            parts = MultipartStream(request.stream, request.mimetype_params.get('boundary'), self.max_request_size)
+            for name, filename, value in parts:
+                if filename is None:
+                    form.setdefault(name, value)
+                elif filename and name in file_fields and name not in spooled:
+                    spooled[name] = self._spool(filename, value)
+
+            # Nothing is stored until every file of the request has been accepted
+            uploads = {name: Upload(filename, ContentStore.key_for(digest, ext), digest, size, None)
+                       for name, (filename, ext, digest, size, _) in spooled.items()}
+            if reserve is not None and uploads:
+                reserve(list(uploads.values()))
+        except BaseException as e:
+            if isinstance(e, UploadRejected):
+                logger.warning(f"Rejected upload: {e}")
+            for *_, tmp_path in spooled.values():
+                os.remove(tmp_path)
+            raise
+
+        return form, {
+            name: upload._replace(write=self.writer.submit(
+                self.content_store.put_spooled, spooled[name][-1], upload.digest, spooled[name][1]
+            ))
+            for name, upload in uploads.items()
+        }
+
+    def _spool(self, filename, part):
+        # Named by content hash, so the client's filename only supplies the extension
+        ext = ContentStore.normalize_ext(secure_filename(filename))
+        if ext[1:] not in self.allowed_extensions:
+            raise UploadRejected('Invalid file type or size')
+
+        upload = ValidatedUpload(part, self.max_file_size, self.allowed_mime_types)
+        digest, size, tmp_path = self.content_store.spool(upload)
+        return filename, ext, digest, size, tmp_path
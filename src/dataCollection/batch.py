@@ -0,0 +1,393 @@
+import io
+import os
+import re
+import csv
+import json
+import uuid
+import logging
+import zipfile
+import posixpath
+from collections import Counter, deque, namedtuple
+from concurrent.futures import wait
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+from Database.flaskSQL import db
+from Database.blobRefs import cached_face_encoding, cached_ocr_text, hold_blobs, release_blobs
+from Database.embeddingStore import stored_encoding
+from Database.userRepository import UserRepository
+from Extraction.faceEngine import EngineSaturated
+from Storage.contentStore import ContentStore
+from Storage.uploadStream import ALLOWED_EXTENSIONS, ALLOWED_MIME_TYPES, SNIFF_BYTES, UploadRejected, sniff_mime
+from dataCollection.jobs import run_ocr
+
+logger = logging.getLogger(__name__)
+
+# One front/back pair; open(name) returns a binary file object for either side
+BatchItem = namedtuple('BatchItem', 'item_id front_name back_name document_type open')
+
+MANIFEST_NAMES = ('manifest.jsonl', 'manifest.json', 'manifest.csv')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# <id>_front.jpg / <id>-back.png / <id>/front.jpg
+PAIR_PATTERN = re.compile(r'^(?P<id>.+?)[_\-./](?P<side>front|back)\.[a-z0-9]+$', re.IGNORECASE)
+
+
+def parse_manifest(data, name):
+    """
+    Rows of a manifest listing front/back pairs, as JSON lines, a JSON list
+    or CSV with a header. Each row has front, back and optionally id and
+    document_type.
+    """
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    if name.lower().endswith('.csv'):
+        rows = list(csv.DictReader(io.StringIO(text)))
+    elif name.lower().endswith('.jsonl'):
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        rows = json.loads(text)
+
+    for index, row in enumerate(rows, start=1):
+        if not row.get('front') or not row.get('back'):
+            raise ValueError(f"Manifest row {index} needs front and back")
+        row.setdefault('id', str(index))
+    return rows
+
+
+def pair_by_name(names):
+    """ Manifest rows for archive members named <id>_front.<ext> and <id>_back.<ext> """
+    pairs = {}
+    for name in sorted(names):
+        match = PAIR_PATTERN.match(name)
+        if match:
+            pairs.setdefault(match.group('id'), {})[match.group('side').lower()] = name
+    return [{'id': item_id, 'front': sides.get('front'), 'back': sides.get('back')}
+            for item_id, sides in pairs.items()]
+
+
+def open_zip_items(fileobj, document_type='ID'):
+    """
+    Items of a zip archive, read member by member as they are consumed so
+    the archive is never extracted. fileobj is closed after the last item. The pairs come from a manifest inside
+    the archive if there is one, otherwise from the member names.
+
+    Raises:
+        zipfile.BadZipFile: If fileobj is not a zip archive
+        ValueError: If the manifest is malformed
+    """
+    archive = zipfile.ZipFile(fileobj)
+    names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    manifest = next((name for name in names if posixpath.basename(name).lower() in MANIFEST_NAMES), None)
+
+    if manifest:
+        base = posixpath.dirname(manifest)
+        rows = parse_manifest(archive.read(manifest), manifest)
+        for row in rows:
+            row['front'] = posixpath.join(base, row['front'])
+            row['back'] = posixpath.join(base, row['back'])
+    else:
+        rows = pair_by_name(names)
+    logger.info(f"Batch archive with {len(rows)} items ({'manifest ' + manifest if manifest else 'paired by name'})")
+
+    def items():
+        # Reading is done once the items are consumed; the archive and its file are closed here
+        with fileobj, archive:
+            for row in rows:
+                yield BatchItem(str(row['id']), row['front'], row['back'],
+                                row.get('document_type') or document_type, archive.open)
+    return items()
+
+
+def open_manifest_items(path, document_type='ID'):
+    """ Items of a manifest file whose front/back paths are relative to the manifest """
+    with open(path, 'rb') as f:
+        rows = parse_manifest(f.read(), path)
+    base = os.path.dirname(os.path.abspath(path))
+
+    def open_member(name):
+        return open(os.path.join(base, name), 'rb')
+
+    return (BatchItem(str(row['id']), row['front'], row['back'], row.get('document_type') or document_type, open_member)
+            for row in rows)
+
+
+def open_batch_items(path, document_type='ID'):
+    """ Items of a zip archive or manifest file on disk """
+    if zipfile.is_zipfile(path):
+        return open_zip_items(open(path, 'rb'), document_type)
+    return open_manifest_items(path, document_type)
+
+
+class BatchIngestor:
+    """
+    Registers many front/back document pairs at once. Uploads are stored and
+    OCRed on the worker pool while later items are still being read, with at
+    most window items in flight, and the User/Image/Document/Profile rows of
+    commit_size items are inserted in one transaction.
+
+    With encode_face, front images are also encoded on the face engine,
+    with at most face_window encodings in flight. Each registration is
+    checked with find_duplicates before it is committed and handed to
+    index_faces after, like a single /get-documents registration. Faces
+    that can't be encoded now are backfilled on the first /generate-token.
+
+    Every file is checked like a single upload (see Storage.uploadStream):
+    by extension before it is read, then by size and sniffed MIME type, and
+    an item with a file that fails is reported as an error.
+
+    Each item references its blobs before their files are written, and its
+    registration takes those references over. The references of items that
+    fail are released once the run is over, deleting files that no other
+    row or request uses.
+    """
+
+    def __init__(self, ocr_pool, store, writer, parse, commit_size=100, window=None,
+                 encode_face=None, face_window=4, find_duplicates=None, index_faces=None,
+                 max_file_size=16 * 1024 * 1024, allowed_extensions=ALLOWED_EXTENSIONS,
+                 allowed_mime_types=ALLOWED_MIME_TYPES):
+        self.ocr_pool = ocr_pool
+        self.parse = parse
+        self.store = store
+        self.writer = writer
+        self.commit_size = commit_size
+        self.window = window or commit_size
+        self.encode_face = encode_face
+        self.face_window = face_window
+        self.find_duplicates = find_duplicates
+        self.index_faces = index_faces
+        self.max_file_size = max_file_size
+        self.allowed_extensions = allowed_extensions
+        self.allowed_mime_types = allowed_mime_types
+        self._faces = deque()
+        self._orphans = []
+
+    def run(self, items):
+        """ Yield one result dict per item, in input order, once its rows are committed """
+        pending = deque()
+        ready = []
+        try:
+            for item in items:
+                pending.append(self._start(item))
+                if len(pending) >= self.window:
+                    ready.append(self._collect(pending.popleft()))
+                if len(ready) >= self.commit_size:
+                    yield from self._commit(ready)
+                    ready = []
+
+            while pending:
+                ready.append(self._collect(pending.popleft()))
+                if len(ready) >= self.commit_size:
+                    yield from self._commit(ready)
+                    ready = []
+            if ready:
+                yield from self._commit(ready)
+                ready = []
+        finally:
+            # Also reached when the client stops reading the results
+            self._discard(list(pending) + ready)
+
+    def _start(self, item):
+        entry = {'item': item, 'error': None}
+        try:
+            if not item.front_name or not item.back_name:
+                raise ValueError('Missing front or back image')
+            sides = {}
+            for side, name in (('front', item.front_name), ('back', item.back_name)):
+                ext, data = self._read(item, side, name)
+                digest = ContentStore.digest(data)
+                sides[side] = (name, data, ext)
+                entry[side] = {
+                    'name': posixpath.basename(name),
+                    'size': len(data),
+                    'hash': digest,
+                    'key': ContentStore.key_for(digest, ext)
+                }
+
+            # Referenced before they are stored, so a failing request can't delete them meanwhile
+            held = Counter(entry[side]['hash'] for side in sides)
+            hold_blobs({entry[side]['hash']: (entry[side]['key'], entry[side]['size'], held[entry[side]['hash']])
+                        for side in sides})
+            entry['held'] = dict(held)
+
+            for side, (name, data, ext) in sides.items():
+                digest = entry[side]['hash']
+                entry[side]['write'] = self.writer.submit(self.store.put_bytes, data, ext, digest)
+                if side == 'front':
+                    # Same document registered before: reuse its OCR text
+                    cached_text = cached_ocr_text(digest)
+                    entry['cached_text'] = cached_text
+                    if cached_text is None:
+                        entry['ocr'] = self.ocr_pool.submit(run_ocr, data, item.document_type)
+                    if self.encode_face and name.lower().endswith(IMAGE_EXTENSIONS):
+                        entry['face_encoding'] = cached_face_encoding(digest)
+                        if entry['face_encoding'] is None:
+                            entry['face'] = self._submit_face(data, item)
+        except Exception as e:
+            entry['error'] = str(e)
+        return entry
+
+    def _read(self, item, side, name):
+        """ (extension, bytes) of one side of an item, validated like an upload """
+        ext = ContentStore.normalize_ext(secure_filename(posixpath.basename(name)))
+        if ext[1:] not in self.allowed_extensions:
+            raise UploadRejected(f"Invalid file type or size: {side} {name}")
+        with item.open(name) as f:
+            # Read at most one byte past the limit, whatever the archive claims the size is
+            data = f.read(self.max_file_size + 1)
+        if len(data) > self.max_file_size:
+            raise UploadRejected(f"File too large: {side} {name}", 413)
+        if sniff_mime(data[:SNIFF_BYTES]) not in self.allowed_mime_types:
+            raise UploadRejected(f"Invalid file type or size: {side} {name}")
+        return ext, data
+
+    def _collect(self, entry):
+        if entry['error']:
+            return entry
+        try:
+            if entry.get('ocr') is not None:
+                result = entry.pop('ocr').result()
+                if result['text'].startswith('Error processing image'):
+                    raise ValueError(result['text'])
+            else:
+                text = entry['cached_text']
+                name, dob = self.parse(text)
+                result = {'text': text, 'name': name, 'date_of_birth': dob}
+            entry['result'] = result
+            if entry.get('face') is not None:
+                entry['face_encoding'] = self._face_result(entry.pop('face'), entry['item'])
+            # Rows may only point at durably stored files
+            entry['front']['write'].result()
+            entry['back']['write'].result()
+        except Exception as e:
+            entry['error'] = str(e)
+        return entry
+
+    def _submit_face(self, data, item):
+        # Wait for the oldest encoding rather than fill the face engine queue
+        while self._faces and (self._faces[0].done() or len(self._faces) >= self.face_window):
+            wait([self._faces.popleft()])
+        try:
+            future = self.encode_face(data, f"batch item {item.item_id}")
+        except EngineSaturated as e:
+            logger.warning(f"Face of batch item {item.item_id} left for later: {e}")
+            return None
+        self._faces.append(future)
+        return future
+
+    def _face_result(self, future, item):
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.warning(f"Could not encode face of batch item {item.item_id}: {e}")
+            return None
+        if result['error']:
+            logger.info(f"No face encoding stored for batch item {item.item_id}: {result['error']}")
+        return stored_encoding(result)
+
+    def _commit(self, entries):
+        ok = [entry for entry in entries if not entry['error']]
+        try:
+            registrations = []
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            for entry in ok:
+                item, front, back = entry['item'], entry['front'], entry['back']
+                dob = entry['result']['date_of_birth']
+                try:
+                    dob_obj = datetime.strptime(dob, '%Y-%m-%d').date() if dob else None
+                except ValueError:
+                    logger.warning(f"Could not parse date of birth of batch item {item.item_id}")
+                    dob_obj = None
+
+                suffix = f"{timestamp}_{uuid.uuid4().hex[:8]}"
+                registration = {'name': entry['result']['name'], 'date_of_birth': dob_obj, 'images': [], 'documents': [],
+                                'held_blobs': entry['held']}
+                if front['name'].lower().endswith(IMAGE_EXTENSIONS):
+                    registration['images'].append({
+                        'image_url': front['key'],
+                        'content_hash': front['hash'],
+                        'face_encoding': entry.get('face_encoding'),
+                        'size': front['size']
+                    })
+                registration['documents'].append({
+                    'document_url': front['key'],
+                    'document_name': f"front_{suffix}_{secure_filename(front['name'])}",
+                    'document_type': item.document_type,
+                    'extracted_text': entry['result']['text'],
+                    'content_hash': front['hash'],
+                    'size': front['size']
+                })
+                if back['name'].lower().endswith(IMAGE_EXTENSIONS):
+                    registration['images'].append({'image_url': back['key'], 'content_hash': back['hash'], 'size': back['size']})
+                else:
+                    registration['documents'].append({
+                        'document_url': back['key'],
+                        'document_name': f"back_{suffix}_{secure_filename(back['name'])}",
+                        'document_type': item.document_type,
+                        'content_hash': back['hash'],
+                        'size': back['size']
+                    })
+                # Flag, but don't block, a face registered to an earlier user
+                entry['possible_duplicates'] = self.find_duplicates(registration['images']) if self.find_duplicates else []
+                registrations.append(registration)
+
+            created = UserRepository().create_users(registrations)
+            db.session.commit()
+            for entry, registration, result in zip(ok, registrations, created):
+                entry['user_id'] = result['user_id']
+                # Taken over by the committed rows
+                entry['held'] = {}
+                if self.index_faces:
+                    self.index_faces(registration, result)
+            logger.info(f"Committed {len(ok)} batch items ({len(entries) - len(ok)} failed)")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to commit batch of {len(ok)} items: {e}")
+            for entry in ok:
+                entry['error'] = f"Failed to save: {e}"
+
+        self._orphans.extend(entry for entry in entries if entry['error'])
+        for entry in entries:
+            yield _result(entry)
+
+    def _discard(self, unfinished):
+        """ Release the blobs held by failed or unfinished items, deleting files nothing else uses """
+        held = Counter()
+        for entry in self._orphans + unfinished:
+            for side in ('front', 'back'):
+                write = entry.get(side, {}).get('write')
+                if write is None:
+                    continue
+                # Let the durable copy land first so it is deleted with the reference
+                try:
+                    write.result()
+                except Exception:
+                    pass
+            held.update(entry.pop('held', {}))
+        self._orphans = []
+        try:
+            db.session.rollback()
+            release_blobs(held, self.store)
+        except Exception as e:
+            logger.error(f"Could not release the blobs of failed batch items: {e}")
+
+
+def _result(entry):
+    item = entry['item']
+    if entry['error']:
+        return {'item': item.item_id, 'status': 'error', 'error': entry['error']}
+    return {
+        'item': item.item_id,
+        'status': 'ok',
+        'userId': entry['user_id'],
+        'name': entry['result']['name'],
+        'date_of_birth': entry['result']['date_of_birth'],
+        'document_type': item.document_type,
+        'possible_duplicates': entry['possible_duplicates']
+    }
+
+
+def to_ndjson(results):
+    """ Serialise result dicts as newline-delimited JSON """
+    for result in results:
+        yield json.dumps(result) + '\n'
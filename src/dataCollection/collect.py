@@ -1,13 +1,22 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+import io
 import sys
 import os
+import hmac
+import uuid
+import click
+import zipfile
+import functools
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from sqlalchemy.exc import IntegrityError
 
 from flask_bcrypt import Bcrypt
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 from flask_jwt_extended import (
-    JWTManager, create_access_token, jwt_required, get_jwt_identity
+    JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt, get_jti, decode_token
 )
 
 # Add project root to path
@@ -16,9 +25,20 @@ sys.path.append(project_root)
 
 # Try importing required modules with error handling
 try:
-    from Database.flaskSQL import (User, Profile, Image, Document, db)
-    from Extraction.imageCompare import Image_compare
+    from Database.flaskSQL import (User, Profile, Image, Document, Job, db)
+    from Database.dbConfig import engine_options, tune_engine
+    from Database.embeddingStore import EmbeddingStore, deserialize_encoding, stored_encoding
+    from Database.faceIndex import FaceIndex
+    from Database.embeddingMatrix import EmbeddingMatrix
+    from Database.userRepository import GroupCommitter, UserRepository, DOCUMENT_FIELDS
+    from Database.tokenRegistry import TokenEpochs, TokenRegistry
+    from Database.blobRefs import acquire_blob, cached_face_encoding, cached_ocr_text, held_blobs, hold_uploads, release_uploads
+    from Extraction.faceEngine import FaceEngine, EngineSaturated
     from Extraction.imageO import ImageExtractor
+    from dataCollection.jobs import JobRunner
+    from dataCollection.batch import BatchIngestor, open_batch_items, open_zip_items, to_ndjson
+    from Storage.contentStore import ContentStore, default_store
+    from Storage.uploadStream import UploadReader, UploadRejected
 except ImportError as e:
     print(f"Import Error: {e}")
     traceback.print_exc()
@@ -52,6 +72,21 @@ except Exception as e:
     logger.error(f"Failed to initialize ImageExtractor: {e}")
     traceback.print_exc()
 
+# Face encoding runs on a pool of worker processes with the dlib models loaded;
+# embeddings of registered images are mirrored from the DB into a matrix file
+# that the web and face engine workers all memory-map
+try:
+    face_engine = FaceEngine()
+    EMBEDDING_MATRIX_DIR = os.path.abspath(os.getenv('EMBEDDING_MATRIX_DIR', 'cache/embeddings'))
+    embedding_store = EmbeddingStore(EmbeddingMatrix(
+        EMBEDDING_MATRIX_DIR,
+        compact_after=int(os.getenv('EMBEDDING_MATRIX_COMPACT_AFTER', 10000))
+    ))
+    logger.info("Face embedding store initialized successfully")
+except Exception as e:
+    logger.error(f"Failed to initialize face embedding store: {e}")
+    traceback.print_exc()
+
 app = Flask(__name__)
 bcrypt = Bcrypt(app)
 
@@ -64,6 +99,8 @@ if not KEY:
 
 # Configure Flask app
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///uiv.db')
+# WAL/busy timeout for SQLite, a sized connection pool for other databases
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = KEY
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
@@ -92,60 +129,199 @@ except Exception as e:
 try:
     db.init_app(app)
     with app.app_context():
+        tune_engine(db.engine)
+        # New tables only; existing databases are upgraded with `alembic upgrade head` at deploy time
         db.create_all()
         logger.info("Database initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize database: {e}")
     traceback.print_exc()
 
+# Image ids in the embedding matrix must belong to this database, not e.g. one restored from a backup
+try:
+    with app.app_context():
+        if embedding_store.matrix.last_image_id() > (db.session.query(db.func.max(Image.image_id)).scalar() or 0):
+            logger.warning("Embedding matrix is ahead of the database, clearing it")
+            embedding_store.matrix.reset()
+    logger.info(f"Embedding matrix mapped: {embedding_store.matrix.stats()}")
+except Exception as e:
+    logger.error(f"Failed to check embedding matrix: {e}")
+    traceback.print_exc()
+
+# Token checks: 'stateless' trusts the signed exp claim and checks the jti
+# against an in-process registry of each user's current token, reading the
+# DB only on a miss or after another worker issued or revoked the user's
+# token; 'db' compares the stored token on every request
+TOKEN_VERIFICATION = os.getenv('TOKEN_VERIFICATION', 'stateless').lower()
+
+
+def current_token_id(user_id):
+    """ jti of the token held in the user's profile, or None """
+    token = db.session.query(Profile.token).filter(Profile.user_id == int(user_id)).scalar()
+    return decode_token(token, allow_expired=True).get('jti') if token else None
+
+
+try:
+    token_registry = TokenRegistry(
+        current_token_id,
+        maxsize=int(os.getenv('TOKEN_CACHE_SIZE', 100000)),
+        ttl=float(os.getenv('TOKEN_CACHE_TTL', 30)),
+        epochs=TokenEpochs(os.getenv('TOKEN_EPOCH_FILE', 'cache/token_epochs'))
+    )
+
+    @jwt.token_in_blocklist_loader
+    def is_token_revoked(jwt_header, jwt_payload):
+        if TOKEN_VERIFICATION != 'stateless':
+            return False
+        return not token_registry.is_current(jwt_payload['sub'], jwt_payload['jti'])
+
+    logger.info(f"Token verification mode: {TOKEN_VERIFICATION}")
+except Exception as e:
+    logger.error(f"Failed to initialize token registry: {e}")
+    traceback.print_exc()
+
+# Process pool for document OCR jobs (job mode of /get-documents)
+try:
+    workers = os.getenv('OCR_WORKERS')
+    job_runner = JobRunner(app, max_workers=int(workers) if workers else None)
+    logger.info("OCR job runner initialized successfully")
+except Exception as e:
+    logger.error(f"Failed to initialize OCR job runner: {e}")
+    traceback.print_exc()
+
+# Registrations from concurrent requests are written in shared transactions
+try:
+    group_committer = GroupCommitter(
+        app,
+        max_batch=int(os.getenv('GROUP_COMMIT_MAX_BATCH', 64)),
+        max_delay=float(os.getenv('GROUP_COMMIT_MAX_DELAY_MS', 0)) / 1000
+    )
+    logger.info("Group committer initialized successfully")
+except Exception as e:
+    logger.error(f"Failed to initialize group committer: {e}")
+    traceback.print_exc()
+
+# The embedding matrix is searched through an approximate nearest-neighbour index,
+# so a new registration can be checked against every earlier one for the same face
+FACE_DUPLICATE_DISTANCE = float(os.getenv('FACE_DUPLICATE_DISTANCE', 0.5))
+
+
+def sync_embeddings():
+    """Copy the registered face encodings the embedding matrix is missing, e.g. on first start or after a crash"""
+    stored = db.session.query(Image.image_id).filter(db.func.length(Image.face_encoding) > 0)
+    missing = embedding_store.matrix.missing([image_id for (image_id,) in stored]).tolist()
+    added = 0
+    for start in range(0, len(missing), 1000):
+        rows = (db.session.query(Image.image_id, Image.face_encoding)
+                .filter(Image.image_id.in_(missing[start:start + 1000])).order_by(Image.image_id))
+        batch = [(image_id, deserialize_encoding(blob)) for image_id, blob in rows]
+        batch = [(image_id, encoding) for image_id, encoding in batch if encoding is not None]
+        embedding_store.add_many(batch)
+        added += len(batch)
+    return added
+
+
+try:
+    face_index = FaceIndex(
+        embedding_store.matrix,
+        os.getenv('FACE_INDEX_DIR', 'cache/face_index'),
+        nprobe=int(os.getenv('FACE_INDEX_NPROBE', 16)),
+        train_min=int(os.getenv('FACE_INDEX_TRAIN_MIN', 10000))
+    )
+    with app.app_context():
+        added = sync_embeddings()
+    face_index.update()
+    logger.info(f"Face index initialized with {len(face_index)} faces ({added} added from the database)")
+except Exception as e:
+    logger.error(f"Failed to initialize face index: {e}")
+    traceback.print_exc()
+
+
+def find_duplicate_faces(images):
+    """Earlier users whose registered face is within FACE_DUPLICATE_DISTANCE of one of these image records, nearest first"""
+    hits = {}
+    for image in images:
+        encoding = deserialize_encoding(image.get('face_encoding'))
+        if encoding is None:
+            continue
+        for hit in face_index.search(encoding, k=10, max_distance=FACE_DUPLICATE_DISTANCE):
+            hits[hit['image_id']] = min(hit['distance'], hits.get(hit['image_id'], hit['distance']))
+    if not hits:
+        return []
+
+    matches = {}
+    for image_id, user_id in db.session.query(Image.image_id, Image.user_id).filter(Image.image_id.in_(list(hits))):
+        matches[user_id] = min(hits[image_id], matches.get(user_id, hits[image_id]))
+    return [{'userId': user_id, 'distance': round(distance, 4)}
+            for user_id, distance in sorted(matches.items(), key=lambda match: match[1])]
+
+# Requests doing CPU-bound vision work may hold at most CPU_REQUEST_SLOTS of a
+# web worker's threads, so I/O-bound ones like /verify-user always find a free thread
+cpu_request_slots = threading.BoundedSemaphore(int(os.getenv('CPU_REQUEST_SLOTS', 4)))
+CPU_SLOT_WAIT = float(os.getenv('CPU_SLOT_WAIT', 10))
+
+
+def cpu_bound(view):
+    """ Run a view in a CPU request slot; 503 if none frees up within CPU_SLOT_WAIT seconds """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not cpu_request_slots.acquire(timeout=CPU_SLOT_WAIT):
+            logger.warning(f"Rejected {request.path}: no CPU request slot free")
+            return jsonify({'error': 'Server busy, please retry shortly'}), 503, {'Retry-After': '5'}
+        try:
+            return view(*args, **kwargs)
+        finally:
+            cpu_request_slots.release()
+    return wrapper
+
 # Only log detailed request info in development
 if os.getenv('FLASK_ENV') == 'development':
     @app.before_request
     def log_request_info():
         logger.debug('Headers: %s', request.headers)
-        logger.debug('Body: %s', request.get_data())
-        logger.debug('Form: %s', request.form)
         logger.debug('Args: %s', request.args)
-        logger.debug('Files: %s', list(request.files.keys()) if request.files else "No files")
-        
-        # Debug multipart forms specifically
-        if request.content_type and 'multipart/form-data' in request.content_type:
+
+        # Multipart bodies are left unread: the views stream them through upload_reader
+        if request.mimetype == 'multipart/form-data':
             logger.debug('Processing multipart form data')
-            for key in request.form:
-                logger.debug(f'Form field: {key} = {request.form[key]}')
-            for file_key in request.files:
-                file = request.files[file_key]
-                logger.debug(f'File field: {file_key}, filename={file.filename}, content_type={file.content_type}')
-
-# Modified file-saving function with better error handling
-def save_file_to_storage(file, path=None):
-    try:
-        # Use a default upload folder if none provided.
-        upload_folder = path if path is not None else 'uploads/'
-        if not os.path.exists(upload_folder):
-            os.makedirs(upload_folder)
-        
-        # Get a secure filename and construct the path
-        secure_name = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        unique_filename = f"{timestamp}_{secure_name}"
-        file_path = os.path.join(upload_folder, unique_filename)
-        
-        # Save the file and log the result
-        file.save(file_path)
-        logger.debug(f"File saved successfully to {file_path}")
-        
-        return file_path
-    except Exception as e:
-        logger.error(f"Error saving file: {e}")
-        traceback.print_exc()
-        raise
+        else:
+            logger.debug('Body: %s', request.get_data())
+
+# Background writer for durable copies of uploads that are processed from memory
+storage_writer = ThreadPoolExecutor(max_workers=int(os.getenv('STORAGE_WRITER_THREADS', 2)))
+
+# Uploads are stored once per unique content, sharded by their SHA-256, on the
+# blob storage backend selected by STORAGE_BACKEND (local filesystem or S3)
+content_store = default_store()
+
+# Multipart uploads are read straight from the request body: each file is checked by
+# extension, sniffed MIME type and size while it is hashed into storage, so a bad upload
+# is refused after its first chunk rather than after the whole body has been buffered.
+# A file may use the whole 16 MB request, as before; the types are the JPEG/PNG images
+# OCR and face matching decode and PDF document backs (Storage.uploadStream.ALLOWED_*)
+upload_reader = UploadReader(
+    content_store, storage_writer,
+    max_file_size=int(os.getenv('UPLOAD_MAX_FILE_MB', 16)) * 1024 * 1024,
+    max_request_size=app.config['MAX_CONTENT_LENGTH']
+)
 
 def resolve_file_path(file_path):
-    """Helper function to resolve file paths"""
+    """Helper function to resolve a stored image/document URL to a local path"""
     if not file_path:
         return None
-    
+
+    # Canonical storage keys are read straight from blob storage, no filesystem probing
+    if ContentStore.is_key(file_path):
+        return file_path
+
+    logger.warning(f"Resolving legacy path {file_path}, run 'flask migrate-storage' to convert it")
+    return probe_legacy_path(file_path)
+
+def probe_legacy_path(file_path):
+    """Find a file stored before canonical storage keys by probing the old upload folders"""
+    # Paths recorded on Windows use backslashes
+    file_path = file_path.replace('\\', '/')
+
     if os.path.exists(file_path):
         return file_path
         
@@ -173,36 +349,180 @@ def resolve_file_path(file_path):
     logger.warning(f"Could not find file in any of the possible locations: {filename}")
     return None
 
+def encode_registered_face(content_hash, source, label):
+    """Image.face_encoding value for a registered image (path or bytes): the encoding, b'' if it has no face, None if it could not be checked"""
+    # Same content registered before: reuse its encoding
+    cached = cached_face_encoding(content_hash)
+    if cached is not None:
+        logger.debug(f"Reused face encoding for content {content_hash}")
+        return cached
+
+    result = face_engine.encode_face(source, label=label)
+    if result['error']:
+        logger.info(f"No face encoding stored for {label}: {result['error']}")
+    # Only remember "no face" when detection actually ran, so load errors are retried
+    return stored_encoding(result)
+
+def index_registered_faces(registration, created):
+    """Mirror the face encodings of a committed registration into the embedding matrix and duplicate-face index"""
+    encodings = [(image_id, deserialize_encoding(image.get('face_encoding')))
+                 for image_id, image in zip(created['image_ids'], registration['images'])]
+    encodings = [(image_id, encoding) for image_id, encoding in encodings if encoding is not None]
+    embedding_store.add_many(encodings)
+    face_index.update()
+
+def stored_path(upload):
+    """Local path of an upload once its durable copy is written, to process it without holding it in memory"""
+    upload.write.result()
+    return content_store.local_path(upload.key)
+
+def store_face_encoding(image, source):
+    """Encode the face in a registered image (path or bytes) once and keep it on the Image row"""
+    image.face_encoding = encode_registered_face(image.content_hash, source, image.image_url)
+    return embedding_store.get(image)
+
+def requeue_interrupted_jobs():
+    """
+    Resubmit OCR jobs interrupted by a restart. Called by the process that
+    serves requests, once per start: never at import, since under gunicorn
+    that is the master, whose process pool the workers don't inherit.
+    """
+    try:
+        job_runner.requeue_pending(resolve=resolve_file_path)
+    except Exception as e:
+        logger.error(f"Failed to requeue pending OCR jobs: {e}")
+        traceback.print_exc()
+
+# One-off migration of rows written before canonical storage keys
+@app.cli.command('migrate-storage')
+@click.option('--dry-run', is_flag=True, help='Report what would change without writing anything.')
+def migrate_storage(dry_run):
+    """Copy legacy uploads into content-addressed storage and rewrite image_url/document_url to storage keys"""
+    migrated, missing = 0, 0
+    rows = [(image, 'image_url') for image in Image.query.all()]
+    rows += [(document, 'document_url') for document in Document.query.all()]
+    rows += [(job, 'document_url') for job in Job.query.all()]
+
+    for row, column in rows:
+        value = getattr(row, column)
+        if ContentStore.is_key(value):
+            continue
+
+        path = probe_legacy_path(value)
+        if not path:
+            missing += 1
+            click.echo(f"missing: {value}")
+            continue
+
+        if dry_run:
+            migrated += 1
+            click.echo(f"{value} -> {path}")
+            continue
+
+        with open(path, 'rb') as f:
+            digest, file_key, size, _ = content_store.put_stream(f, ContentStore.normalize_ext(path))
+        setattr(row, column, file_key)
+
+        # Rows that already carry a hash were counted when they were created
+        if hasattr(row, 'content_hash') and row.content_hash is None:
+            row.content_hash = digest
+            acquire_blob(digest, file_key, size)
+        migrated += 1
+
+    if not dry_run:
+        db.session.commit()
+    click.echo(f"{'Would migrate' if dry_run else 'Migrated'} {migrated} rows, {missing} files not found")
+
+def batch_ingestor():
+    """Bulk registration sharing the OCR worker pool and storage writer of the single-document path"""
+    return BatchIngestor(
+        job_runner.pool, content_store, storage_writer, extractor.parse_ocr_data,
+        commit_size=int(os.getenv('BATCH_COMMIT_SIZE', 100)),
+        encode_face=face_engine.encode_face_async,
+        # Leave most of the face engine queue to interactive requests
+        face_window=face_engine.workers,
+        find_duplicates=find_duplicate_faces,
+        index_faces=index_registered_faces,
+        # Members are validated against the same limits as single uploads
+        max_file_size=upload_reader.max_file_size,
+        allowed_extensions=upload_reader.allowed_extensions,
+        allowed_mime_types=upload_reader.allowed_mime_types
+    )
+
+# Bulk onboarding from a zip archive or manifest on disk, results as NDJSON on stdout
+@app.cli.command('ingest-batch')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--document-type', default='ID', help='Document type of items the manifest does not specify.')
+def ingest_batch_command(source, document_type):
+    """Register the front/back pairs of a zip archive or manifest (JSON lines, JSON or CSV)"""
+    counts = {'ok': 0, 'error': 0}
+    for result in batch_ingestor().run(open_batch_items(source, document_type)):
+        counts[result['status']] += 1
+        click.echo(next(to_ndjson([result])), nl=False)
+    click.echo(f"Registered {counts['ok']} items, {counts['error']} failed", err=True)
+
+# Rebuild the duplicate-face index from Image.face_encoding, e.g. after restoring a backup
+@app.cli.command('rebuild-face-index')
+@click.option('--train/--no-train', default=True, help='Train the quantizer once all faces are indexed.')
+def rebuild_face_index(train):
+    """Reload every registered face into the embedding matrix and retrain the index"""
+    embedding_store.matrix.reset()
+    face_index.reset()
+    indexed = sync_embeddings()
+    if train and indexed:
+        face_index.train()
+    else:
+        face_index.update()
+    click.echo(f"Indexed {indexed} faces: {face_index.stats()}")
+
+# Drop superseded rows from the embedding matrix and sort it by image id again
+@app.cli.command('compact-embeddings')
+def compact_embeddings():
+    """Rewrite the shared embedding matrix with one row per image"""
+    embedding_store.matrix.compact()
+    # The rows moved, so reassign them to the index lists now rather than on the next registration
+    face_index.update()
+    click.echo(f"Compacted embedding matrix: {embedding_store.matrix.stats()}")
+
 # Diagnostic endpoint to test basic functionality
 @app.route('/test', methods=['GET'])
 def test_endpoint():
-    return jsonify({'status': 'OK', 'message': 'API is running'}), 200
+    return jsonify({
+        'status': 'OK',
+        'message': 'API is running',
+        'face_engine': face_engine.stats(),
+        'ocr_cache': extractor.cache.stats(),
+        'ocr_backend': extractor.ocr_backend.stats(),
+        'group_commit': group_committer.stats(),
+        'token_registry': token_registry.stats(),
+        'face_index': face_index.stats(),
+        'embedding_matrix': embedding_store.matrix.stats()
+    }), 200
 
 # Diagnostic endpoint for file upload only
 @app.route('/test-upload', methods=['POST'])
 def test_upload():
     try:
         logger.debug("Received test-upload request")
-        
-        if 'file' not in request.files:
+
+        _, uploads = upload_reader.read(request, {'file'})
+        if 'file' not in uploads:
             logger.debug("No file part in request")
             return jsonify({'error': 'No file part'}), 400
-            
-        file = request.files['file']
-        
-        if file.filename == '':
-            logger.debug("No selected file")
-            return jsonify({'error': 'No selected file'}), 400
-            
+
         # Try to save the file
-        file_path = save_file_to_storage(file, UPLOAD_FOLDERS['test'])
-        
+        file = uploads['file']
+        file.write.result()
+        logger.debug(f"File saved successfully as {file.key}")
+
         return jsonify({
             'success': True,
             'message': 'File uploaded successfully',
-            'path': file_path
+            'path': file.key
         }), 200
-        
+
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
         logger.error(f"Error in test-upload: {e}")
         traceback.print_exc()
@@ -210,29 +530,50 @@ def test_upload():
 
 # Endpoint to process documents.
 @app.route('/get-documents', methods=['POST'])
+@cpu_bound
 def get_document():
+    uploads = {}
     try:
         logger.debug("Processing /get-documents request")
         
-        # Retrieve the two files.
-        documentBack = request.files.get('documentBack')
-        documentFront = request.files.get('documentFront')
+        # Retrieve the two files, validated and hashed into storage as they are read, and
+        # referenced before they are stored so a concurrent failing request can't delete them
+        form, uploads = upload_reader.read(request, {'documentBack', 'documentFront'}, reserve=hold_uploads)
+        documentBack = uploads.get('documentBack')
+        documentFront = uploads.get('documentFront')
 
         if not documentBack or not documentFront:
             missing = []
             if not documentBack: missing.append('documentBack')
             if not documentFront: missing.append('documentFront')
             logger.debug(f"Missing files: {missing}")
+            release_uploads(uploads.values(), content_store)
             return jsonify({'error': f'Missing required files: {", ".join(missing)}'}), 400
 
-        # Save the files to their respective folders
-        doc_back_path = save_file_to_storage(documentBack, path=UPLOAD_FOLDERS['back'])
-        doc_front_path = save_file_to_storage(documentFront, path=UPLOAD_FOLDERS['front'])
+        # Process the uploads from content-addressed storage, where they were spooled as they were read
+        back_path, doc_back_path, back_hash, back_size = stored_path(documentBack), documentBack.key, documentBack.digest, documentBack.size
+        front_path, doc_front_path, front_hash, front_size = stored_path(documentFront), documentFront.key, documentFront.digest, documentFront.size
+
+        doc_type = form.get('document_type', 'ID')  # Default to 'ID' if not specified
 
-        # Process OCR on the front document.
-        extracted_data = extractor.process_and_extract(doc_front_path)
-        parsed_data = extractor.parse_ocr_data(extracted_data)
-        name, dob = parsed_data
+        # In job mode OCR runs in the worker pool and fills in the records later
+        async_flag = request.args.get('async', form.get('async', ''))
+        async_mode = async_flag.lower() in ('true', '1', 't')
+
+        # The same document was processed before: reuse its OCR text
+        cached_text = cached_ocr_text(front_hash)
+        if cached_text is not None:
+            logger.info(f"Reusing OCR result for content {front_hash}")
+            async_mode = False
+            extracted_data = cached_text
+            name, dob = extractor.parse_ocr_data(extracted_data)
+        elif async_mode:
+            extracted_data, name, dob = None, None, None
+        else:
+            # Process OCR on the front document.
+            extracted_data = extractor.process_and_extract(front_path, document_type=doc_type)
+            parsed_data = extractor.parse_ocr_data(extracted_data)
+            name, dob = parsed_data
 
         try:
             dob_obj = datetime.strptime(dob, '%Y-%m-%d').date() if dob else None
@@ -240,77 +581,187 @@ def get_document():
             logger.warning(f"Could not parse date of birth: {e}")
             dob_obj = None
 
-        # Create the new user and flush to obtain the user_id.
-        new_user = User(name=name, date_of_birth=dob_obj)
-        db.session.add(new_user)
-        db.session.flush()  # Get new_user.user_id before commit
-        logger.debug(f"Created new user with ID: {new_user.user_id}")
-
-        # Generate timestamp for unique document names
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        # Timestamp plus a random suffix: a second-resolution timestamp alone collides
+        # when the same filename is registered twice within a second
+        suffix = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
 
         # Handle front document first since it needs OCR text
         front_filename = secure_filename(documentFront.filename)
-        doc_type = request.form.get('document_type', 'ID')  # Default to 'ID' if not specified
-        
-        # Create unique document names with timestamp
-        front_doc_name = f"front_{timestamp}_{front_filename}"
-        back_doc_name = f"back_{timestamp}_{secure_filename(documentBack.filename)}"
-        
+        back_filename = secure_filename(documentBack.filename)
+
+        # Create unique document names
+        front_doc_name = f"front_{suffix}_{front_filename}"
+        back_doc_name = f"back_{suffix}_{back_filename}"
+
+        # The user aggregate is written in one group-committed transaction
+        registration = {'name': name, 'date_of_birth': dob_obj, 'images': [], 'documents': [], 'verification': True,
+                        'held_blobs': held_blobs(uploads.values())}
+
         # Create an Image record if it's an image file
         if front_filename.lower().endswith(('.jpg', '.png', '.jpeg')):
-            new_image = Image(image_url=doc_front_path, user_id=new_user.user_id)
-            db.session.add(new_image)
-            logger.debug(f"Added front image for user {new_user.user_id}")
-        
+            registration['images'].append({
+                'image_url': doc_front_path,
+                'content_hash': front_hash,
+                'face_encoding': encode_registered_face(front_hash, front_path, doc_front_path),
+                'size': front_size
+            })
+
         # Create a Document record for the front document with OCR text
-        front_document = Document(
-            document_url=doc_front_path,
-            document_name=front_doc_name,
-            document_type=doc_type,
-            extracted_text=extracted_data,
-            user_id=new_user.user_id
-        )
-        db.session.add(front_document)
-        logger.debug(f"Added front document for user {new_user.user_id}")
+        registration['documents'].append({
+            'document_url': doc_front_path,
+            'document_name': front_doc_name,
+            'document_type': doc_type,
+            'extracted_text': extracted_data,
+            'content_hash': front_hash,
+            'size': front_size,
+            'job_id': uuid.uuid4().hex if async_mode else None
+        })
 
         # Process back document
-        back_filename = secure_filename(documentBack.filename)
         if back_filename.lower().endswith(('.jpg', '.png', '.jpeg')):
-            new_image = Image(image_url=doc_back_path, user_id=new_user.user_id)
-            db.session.add(new_image)
-            logger.debug(f"Added back image for user {new_user.user_id}")
+            registration['images'].append({
+                'image_url': doc_back_path,
+                'content_hash': back_hash,
+                'face_encoding': encode_registered_face(back_hash, back_path, doc_back_path),
+                'size': back_size
+            })
         else:
-            back_document = Document(
-                document_url=doc_back_path,
-                document_name=back_doc_name,
-                document_type=doc_type,
-                user_id=new_user.user_id
-            )
-            db.session.add(back_document)
-            logger.debug(f"Added back document for user {new_user.user_id}")
-
-        new_profile = Profile(user_id=new_user.user_id, verification=True)
-        db.session.add(new_profile)
-        db.session.commit()
-        logger.debug(f"Added profile and committed changes for user {new_user.user_id}")
+            registration['documents'].append({
+                'document_url': doc_back_path,
+                'document_name': back_doc_name,
+                'document_type': doc_type,
+                'content_hash': back_hash,
+                'size': back_size
+            })
+
+        # Flag, but don't block, a face that is already registered to another user
+        possible_duplicates = find_duplicate_faces(registration['images'])
+
+        # End this request's read transaction so it holds no locks while the group is written
+        db.session.rollback()
+        try:
+            created = group_committer.register(registration, timeout=float(os.getenv('GROUP_COMMIT_TIMEOUT', 30)))
+        except TimeoutError:
+            # Withdrawn before it was written, so a retry can't create a second user
+            logger.warning("Registration still queued after GROUP_COMMIT_TIMEOUT, withdrawn")
+            release_uploads(uploads.values(), content_store)
+            return jsonify({'error': 'Server busy, please retry shortly'}), 503, {'Retry-After': '5'}
+        except IntegrityError as e:
+            logger.warning(f"Registration conflicts with an existing record: {e.orig}")
+            release_uploads(uploads.values(), content_store)
+            return jsonify({'error': 'Registration conflicts with an existing record, please retry'}), 409
+        # The committed rows now own the references held on the uploads
+        uploads = {}
+        user_id = created['user_id']
+        logger.debug(f"Created user {user_id} with {len(registration['images'])} images")
+
+        if possible_duplicates:
+            logger.warning(f"User {user_id} may duplicate users {[match['userId'] for match in possible_duplicates]}")
+        index_registered_faces(registration, created)
+
+        if async_mode:
+            job_id = registration['documents'][0]['job_id']
+            job_runner.submit(job_id, front_path, document_type=doc_type)
+            logger.info(f"Queued OCR job {job_id} for user {user_id}")
+            return jsonify({
+                'jobId': job_id,
+                'status': 'queued',
+                'userId': user_id,
+                'document_type': doc_type,
+                'possible_duplicates': possible_duplicates
+            }), 202
 
         response_data = {
             'name': name,
             'date_of_birth': dob,
             'ocr_text': extracted_data,
-            'userId': new_user.user_id,
-            'document_type': doc_type
+            'userId': user_id,
+            'document_type': doc_type,
+            'possible_duplicates': possible_duplicates
         }
 
         return jsonify(response_data), 200
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
+    except EngineSaturated as e:
+        logger.warning(f"Rejected /get-documents request: {e}")
+        release_uploads(uploads.values(), content_store)
+        return jsonify({'error': 'Server busy, please retry shortly'}), 503, {'Retry-After': '5'}
     except Exception as e:
         logger.error(f"Error in get_document: {e}")
         traceback.print_exc()
+        release_uploads(uploads.values(), content_store)
+        return jsonify({'error': str(e)}), 500
+
+# Endpoint to register many document pairs from one zip archive, streaming per-item results as NDJSON.
+@app.route('/batch-documents', methods=['POST'])
+def batch_documents():
+    try:
+        # Back-office only: disabled unless a shared token is configured, checked before the body is read
+        batch_token = os.getenv('BATCH_API_TOKEN')
+        if not batch_token:
+            return jsonify({'error': 'Batch ingestion is disabled'}), 403
+        if not hmac.compare_digest(request.headers.get('X-Batch-Token', ''), batch_token):
+            return jsonify({'error': 'Invalid batch token'}), 401
+
+        # Archives are far larger than single uploads; Werkzeug spools them to disk while parsing
+        request.max_content_length = int(os.getenv('BATCH_MAX_MB', 1024)) * 1024 * 1024
+        archive = request.files.get('archive')
+        if not archive:
+            return jsonify({'error': 'Missing required file: archive'}), 400
+
+        doc_type = request.form.get('document_type', 'ID')
+        # Take over Werkzeug's spooled file instead of copying it: closing the request,
+        # which happens before the results are streamed, would otherwise close it
+        spool, archive.stream = archive.stream, io.BytesIO()
+        try:
+            items = open_zip_items(spool, doc_type)
+        except (zipfile.BadZipFile, ValueError) as e:
+            spool.close()
+            return jsonify({'error': f'Invalid batch archive: {e}'}), 400
+
+        results = to_ndjson(batch_ingestor().run(items))
+        return Response(stream_with_context(results), mimetype='application/x-ndjson')
+    except Exception as e:
+        logger.error(f"Error in batch_documents: {e}")
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+# Endpoint to poll an OCR job started by /get-documents in job mode.
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = Job.query.get(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+
+        response_data = {
+            'jobId': job.job_id,
+            'status': job.status,
+            'userId': job.user_id
+        }
+
+        if job.status == 'done':
+            user = User.query.get(job.user_id)
+            document = Document.query.get(job.document_id)
+            response_data.update({
+                'name': user.name if user else None,
+                'date_of_birth': user.date_of_birth.strftime('%Y-%m-%d') if user and user.date_of_birth else None,
+                'ocr_text': document.extracted_text if document else None,
+                'document_type': document.document_type if document else None
+            })
+        elif job.status == 'failed':
+            response_data['error'] = job.error
+
+        return jsonify(response_data), 200
+    except Exception as e:
+        logger.error(f"Error in get_job: {e}")
+        traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
 # ROUTE TO LOGIN AND GENERATE AN ACCESS TOKEN WHEN USER FACE IS VERIFIED
 @app.route('/generate-token', methods=['POST'])
+@cpu_bound
 def generate_token():
     try:
         logger.info("Processing token generation request")
@@ -321,18 +772,15 @@ def generate_token():
             logger.error("No users found in database")
             return jsonify({'error': 'No users found. Please complete document registration first.'}), 404
 
-        # Extract selfie image from request files
-        if 'selfie' not in request.files:
+        # Extract the selfie from the request body; a part without a filename is skipped
+        _, uploads = upload_reader.read(request, {'selfie'})
+        if 'selfie' not in uploads:
             logger.error("Selfie image is required")
             return jsonify({'error': 'Selfie image is required'}), 400
-        
-        selfie = request.files['selfie']
-        if not selfie.filename:
-            logger.error("Selfie filename is empty")
-            return jsonify({'error': 'Selfie file must have a filename'}), 400
 
-        # Save the selfie image
-        selfie_image_path = save_file_to_storage(selfie, path=UPLOAD_FOLDERS['selfies'])
+        # Match the selfie from where it was stored
+        selfie = uploads['selfie']
+        selfie_path, selfie_image_path = stored_path(selfie), selfie.key
         logger.info(f"Saved selfie image to: {selfie_image_path}")
 
         # Ensure the user has at least one registered image
@@ -340,42 +788,70 @@ def generate_token():
             logger.error(f"No registered image found for user {latest_user.user_id}")
             return jsonify({'error': 'No registered image found for verification'}), 400
 
-        # Compare the selfie against registered images
-        comparator = Image_compare()
-        match_found = False
+        # Collect the registered images with a stored encoding
         attempted_paths = []
+        candidate_images = []
 
         for image in latest_user.images:
             registered_image_path = image.image_url
             logger.info(f"Checking registered image: {registered_image_path}")
-            
-            # Try to resolve the correct path
-            resolved_path = resolve_file_path(registered_image_path)
-            if not resolved_path:
-                logger.warning(f"Could not resolve path for: {registered_image_path}")
-                attempted_paths.append({
-                    'original': registered_image_path,
-                    'attempted': [
-                        os.path.join(UPLOAD_FOLDERS['front'], os.path.basename(registered_image_path)),
-                        os.path.join(UPLOAD_FOLDERS['back'], os.path.basename(registered_image_path))
-                    ]
-                })
+
+            id_encoding = embedding_store.get(image)
+            if id_encoding is None and not embedding_store.is_computed(image):
+                # Registered before embeddings were stored: encode once and persist
+                resolved_path = resolve_file_path(registered_image_path)
+                if not resolved_path:
+                    logger.warning(f"Could not resolve path for: {registered_image_path}")
+                    attempted_paths.append({
+                        'original': registered_image_path,
+                        'attempted': [
+                            os.path.join(UPLOAD_FOLDERS['front'], os.path.basename(registered_image_path)),
+                            os.path.join(UPLOAD_FOLDERS['back'], os.path.basename(registered_image_path))
+                        ]
+                    })
+                    continue
+
+                logger.info(f"Found registered image at: {resolved_path}")
+                id_encoding = store_face_encoding(image, resolved_path)
+                db.session.commit()
+                if id_encoding is not None:
+                    face_index.update()
+
+            if id_encoding is None:
+                logger.info(f"No face stored for registered image: {registered_image_path}")
                 continue
 
-            logger.info(f"Found registered image at: {resolved_path}")
-            
+            candidate_images.append(image)
+
+        # Encode the selfie once and score it against all candidates together,
+        # the worker reading their encodings from the shared embedding matrix
+        match_found = False
+        if candidate_images:
             try:
-                if comparator.compare(selfie_image_path, resolved_path):
+                result = face_engine.compare_stored(
+                    selfie_path, EMBEDDING_MATRIX_DIR, [image.image_id for image in candidate_images]
+                )
+                if result['error']:
+                    logger.warning(f"Comparison error: {result['error']}")
+                    attempted_paths.append({
+                        'path': selfie_image_path,
+                        'error': result['error']
+                    })
+                elif result['match']:
                     match_found = True
-                    logger.info(f"Face match found with image: {resolved_path}")
-                    break
+                    best_image = next(image for image in candidate_images if image.image_id == result['best_image_id'])
+                    logger.info(f"Face match found with image: {best_image.image_url} (distance={result['distance']:.3f})")
+                else:
+                    logger.info(f"No registered image within tolerance, distances: {result['distances']}")
+            except EngineSaturated:
+                raise
             except Exception as e:
                 logger.error(f"Error comparing images: {e}")
                 attempted_paths.append({
-                    'path': resolved_path,
+                    'path': selfie_image_path,
                     'error': str(e)
                 })
-                continue
+
 
         if not match_found:
             logger.error("Face verification failed")
@@ -398,13 +874,18 @@ def generate_token():
         # Update or create user profile with token details (also set to 1 hour)
         if not latest_user.profile:
             latest_user.profile = Profile(user_id=latest_user.user_id, verification=True)
-        latest_user.profile.token = access_token
-        latest_user.profile.token_expiry = datetime.utcnow() + one_hour  # UPDATED FROM 3 HOURS TO 1 HOUR
+        latest_user.profile.set_token(access_token, datetime.utcnow() + one_hour)  # UPDATED FROM 3 HOURS TO 1 HOUR
         db.session.commit()
+        token_registry.issue(latest_user.user_id, get_jti(access_token))
 
         logger.info(f"Token generated successfully for user {latest_user.user_id}")
         return jsonify({'access_token': access_token}), 200
 
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
+    except EngineSaturated as e:
+        logger.warning(f"Rejected /generate-token request: {e}")
+        return jsonify({'error': 'Server busy, please retry shortly'}), 503, {'Retry-After': '5'}
     except Exception as e:
         logger.error(f"Error in generate_token endpoint: {e}")
         traceback.print_exc()
@@ -424,46 +905,65 @@ def verify_user():
         user_id = get_jwt_identity()
         logger.info(f"JWT identity: {user_id}")
         
-        user = User.query.get(user_id)
-        if not user:
-            logger.error(f"User not found: {user_id}")
-            return jsonify({'error': 'User not found!'}), 404
-
-        profile = Profile.query.filter_by(user_id=user_id).first()
-        if not profile:
-            logger.error(f"Profile not found for user: {user_id}")
-            return jsonify({'error': 'User profile not found'}), 404
-            
         auth_header = request.headers.get('Authorization')
         if not auth_header or not auth_header.startswith('Bearer '):
             logger.error(f"Invalid authorization header: {auth_header}")
             return jsonify({'error': 'Invalid authorization header'}), 401
-            
-        token = auth_header.split(' ')[1]
-        if profile.token != token:
-            logger.error("Token mismatch")
-            return jsonify({'error': 'The token is invalid'}), 401
 
-        # Check if token is expired
-        if profile.token_expiry and profile.token_expiry < datetime.utcnow():
-            logger.error("Token expired")
-            return jsonify({'error': 'The token is expired'}), 401
+        # Documents: ?fields=url,type,extracted_text&limit=20&offset=40
+        fields = [f.strip() for f in request.args.get('fields', 'url,type').split(',') if f.strip()]
+        unknown = [f for f in fields if f not in DOCUMENT_FIELDS]
+        if unknown or not fields:
+            return jsonify({
+                'error': f"Unknown document fields: {', '.join(unknown)}" if unknown else 'No document fields requested',
+                'allowed_fields': list(DOCUMENT_FIELDS)
+            }), 400
+        max_page = int(os.getenv('DOCUMENTS_MAX_PAGE', 100))
+        try:
+            limit = int(request.args['limit']) if 'limit' in request.args else None
+            offset = int(request.args.get('offset', 0))
+            if (limit is not None and not 1 <= limit <= max_page) or offset < 0:
+                raise ValueError
+        except ValueError:
+            return jsonify({'error': f'limit must be 1-{max_page} and offset non-negative'}), 400
+
+        # User, profile and image URLs in one query. In stateless mode the
+        # token was already checked against the registry by is_token_revoked
+        repository = UserRepository()
+        if TOKEN_VERIFICATION == 'stateless':
+            user = repository.find_user(user_id)
+            if not user:
+                logger.error(f"User not found: {user_id}")
+                return jsonify({'error': 'User not found!'}), 404
+        else:
+            # Matched on the token hash index
+            user = repository.find_user(user_id, auth_header.split(' ')[1])
+            if not user:
+                if db.session.get(User, int(user_id)) is None:
+                    logger.error(f"User not found: {user_id}")
+                    return jsonify({'error': 'User not found!'}), 404
+                logger.error("Token mismatch")
+                return jsonify({'error': 'The token is invalid'}), 401
+
+            # Check if token is expired
+            if user.profile.token_expiry and user.profile.token_expiry < datetime.utcnow():
+                logger.error("Token expired")
+                return jsonify({'error': 'The token is expired'}), 401
+        profile = user.profile
+
+        documents, has_more = repository.documents(user.user_id, fields, limit, offset)
 
         # Only include fields that exist in the User model
         response = {
             'userId': user.user_id,
             'name': user.name,
             'date_of_birth': user.date_of_birth.strftime('%Y-%m-%d') if user.date_of_birth else None,
-            'verification_status': profile.verification if profile else False,
-            'images': [img.image_url for img in user.images] if user.images else [],
-            'documents': [
-                {
-                    'url': doc.document_url,
-                    'type': doc.document_type,
-                    'extracted_text': doc.extracted_text
-                } for doc in user.documents
-            ] if user.documents else []
+            'verification_status': profile.verification,
+            'images': [img.image_url for img in user.images],
+            'documents': documents
         }
+        if limit is not None:
+            response['documents_page'] = {'limit': limit, 'offset': offset, 'has_more': has_more}
         
         logger.info(f"Returning user data for user {user_id}")
         return jsonify(response), 200
@@ -473,6 +973,24 @@ def verify_user():
         traceback.print_exc()
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
+# ROUTE TO REVOKE THE CALLER'S TOKEN
+@app.route('/revoke-token', methods=['POST'])
+@jwt_required()
+def revoke_token():
+    try:
+        user_id = get_jwt_identity()
+        # Only the token currently held can be revoked; superseded ones are already invalid
+        if get_jwt()['jti'] == current_token_id(user_id):
+            Profile.query.filter_by(user_id=int(user_id)).first().set_token(None, None)
+            db.session.commit()
+            token_registry.revoke(user_id)
+            logger.info(f"Token revoked for user {user_id}")
+        return jsonify({'message': 'Token revoked'}), 200
+    except Exception as e:
+        logger.error(f"Error in revoke_token: {e}")
+        traceback.print_exc()
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
 # Error handlers
 @app.errorhandler(400)
 def bad_request(error):
@@ -502,10 +1020,14 @@ def server_error(error):
         'status_code': 500
     }), 500
 
+# Development server; production runs gunicorn -c gunicorn.conf.py (see dataCollection/wsgi.py)
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
-    host = os.getenv('HOST', '192.168.1.43')
+    host = os.getenv('HOST', '127.0.0.1')
     debug = os.getenv('FLASK_DEBUG', 'False').lower() in ('true', '1', 't')
     
     logger.info(f"Starting Flask server on {host}:{port} (debug={debug})")
+    # With the reloader only its child process serves requests
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        requeue_interrupted_jobs()
     app.run(host=host, port=port, debug=debug)
\ No newline at end of file
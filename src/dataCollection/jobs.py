@@ -0,0 +1,137 @@
+import os
+import atexit
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from Database.flaskSQL import User, Document, Job, db
+from Extraction.imageO import ImageExtractor
+
+logger = logging.getLogger(__name__)
+
+# One extractor per worker process, created on first use
+_worker_extractor = None
+
+
+def worker_extractor():
+    """
+    The extractor OCR workers use. Calling it before the pool starts loads
+    the OCR model handles once for all workers forked afterwards.
+    """
+    global _worker_extractor
+    if _worker_extractor is None:
+        _worker_extractor = ImageExtractor()
+    return _worker_extractor
+
+
+def run_ocr(image, document_type=None):
+    """ OCR and parse a document image (path or encoded bytes) inside a worker process """
+    extractor = worker_extractor()
+    text = extractor.process_and_extract(image, document_type=document_type)
+    name, dob = extractor.parse_ocr_data(text)
+    return {'text': text, 'name': name, 'date_of_birth': dob}
+
+
+class JobRunner:
+    """
+    Runs document OCR in a local process pool so request threads only
+    persist the upload and a Job row. Results are written back to the
+    User/Document rows when the worker finishes.
+    """
+
+    def __init__(self, app, max_workers=None):
+        self.app = app
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._pool = None
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    @property
+    def pool(self):
+        # Created lazily so the workers fork from a fully initialised app
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+                logger.info(f"Started OCR worker pool with {self.max_workers} processes")
+            return self._pool
+
+    def submit(self, job_id, image, document_type=None):
+        """ Queue OCR for a committed Job row, from the stored path or the upload bytes """
+        future = self.pool.submit(run_ocr, image, document_type)
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        logger.debug(f"Queued OCR job {job_id}")
+        return future
+
+    def requeue_pending(self, resolve=None):
+        """ Resubmit jobs left queued by a previous process """
+        with self.app.app_context():
+            pending = Job.query.filter_by(status='queued').all()
+            for job in pending:
+                path = resolve(job.document_url) if resolve else job.document_url
+                document = Document.query.get(job.document_id) if job.document_id else None
+                self.submit(job.job_id, path, document.document_type if document else None)
+            if pending:
+                logger.info(f"Requeued {len(pending)} pending OCR jobs")
+
+    def after_fork(self):
+        """ Forget a pool inherited through fork(); its processes belong to the parent """
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    def _finish(self, job_id, future):
+        with self.app.app_context():
+            try:
+                job = Job.query.get(job_id)
+                if not job:
+                    logger.error(f"OCR job {job_id} no longer exists")
+                    return
+
+                try:
+                    result = future.result()
+                except Exception as e:
+                    job.status = 'failed'
+                    job.error = str(e)
+                    job.finished_at = datetime.now()
+                    db.session.commit()
+                    logger.error(f"OCR job {job_id} failed: {e}")
+                    return
+
+                text = result['text']
+                if text.startswith('Error processing image'):
+                    job.status = 'failed'
+                    job.error = text
+                    job.finished_at = datetime.now()
+                    db.session.commit()
+                    logger.error(f"OCR job {job_id} failed: {text}")
+                    return
+
+                dob = result['date_of_birth']
+                try:
+                    dob_obj = datetime.strptime(dob, '%Y-%m-%d').date() if dob else None
+                except Exception as e:
+                    logger.warning(f"Could not parse date of birth: {e}")
+                    dob_obj = None
+
+                user = User.query.get(job.user_id)
+                if user:
+                    user.name = result['name']
+                    user.date_of_birth = dob_obj
+
+                document = Document.query.get(job.document_id)
+                if document:
+                    document.extracted_text = text
+
+                job.status = 'done'
+                job.finished_at = datetime.now()
+                db.session.commit()
+                logger.info(f"OCR job {job_id} finished for user {job.user_id}")
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error recording OCR job {job_id}: {e}")
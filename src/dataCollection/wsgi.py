@@ -0,0 +1,64 @@
+"""
+Production entry point. gunicorn imports create_app() once in the master
+process (preload_app in gunicorn.conf.py), so the dlib and Tesseract models
+are loaded before the web workers fork and their pages are shared
+copy-on-write by every worker and the process pools they start:
+
+    gunicorn -c gunicorn.conf.py
+
+after_fork() is called by gunicorn's post_fork hook in each web worker;
+the first worker started also resubmits the OCR jobs a previous run left
+queued, so they run in its process pool rather than the master's.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+_collect = None
+
+
+def preload_models(collect):
+    """ Load the face and OCR models in this process ahead of the fork """
+    from Extraction.faceEngine import preload_models as preload_face_models
+    from dataCollection.jobs import worker_extractor
+
+    preload_face_models()
+    # Handles for the full-card and single-line configs used in ROI mode
+    for extractor in (collect.extractor, worker_extractor()):
+        if hasattr(extractor.ocr_backend, 'warm_up'):
+            extractor.ocr_backend.warm_up(extractor.tesseract_config)
+            extractor.ocr_backend.warm_up(f"{extractor.tesseract_config} --psm 7".strip())
+    logger.info("Face and OCR models preloaded")
+
+
+def create_app():
+    """ Import the application with its models loaded and return the Flask app """
+    global _collect
+    from dataCollection import collect
+
+    preload_models(collect)
+    _collect = collect
+    return collect.app
+
+
+def after_fork(requeue_jobs=False):
+    """
+    Reset per-process state a web worker inherited from the master: pooled
+    DB connections and any process pools started before the fork, which
+    stay with the master. The OCR cache reopens its SQLite file by itself.
+
+    Args:
+        requeue_jobs (bool): Resubmit interrupted OCR jobs from this worker;
+            set for exactly one worker per start
+    """
+    collect = _collect
+    if collect is None:
+        return
+    with collect.app.app_context():
+        collect.db.engine.dispose(close=False)
+    collect.face_engine.after_fork()
+    collect.job_runner.after_fork()
+    collect.face_index.after_fork()
+    collect.embedding_store.matrix.after_fork()
+    if requeue_jobs:
+        collect.requeue_interrupted_jobs()
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# The application imports its packages relative to src/, as in the Docker image (PYTHONPATH=/app/src)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+@pytest.fixture
+def app(tmp_path):
+    """ Flask app on a fresh SQLite database, with an application context pushed """
+    from flask import Flask
+    from Database.dbConfig import engine_options, tune_engine
+    from Database.flaskSQL import db
+
+    uri = f"sqlite:///{tmp_path / 'uiv.db'}"
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        tune_engine(db.engine)
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def store(tmp_path):
+    from Storage.backends import FileSystemBackend
+    from Storage.contentStore import ContentStore
+    return ContentStore(FileSystemBackend(str(tmp_path / 'blobs')))
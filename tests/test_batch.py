@@ -0,0 +1,85 @@
+import io
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+from PIL import Image as PILImage
+
+from Database.flaskSQL import Blob, Document, User, db
+from dataCollection.batch import BatchIngestor, open_zip_items, parse_manifest, pair_by_name
+from Storage.contentStore import ContentStore
+
+
+class CannedOCR:
+    """ OCR pool returning a fixed result, tesseract isn't needed to test ingestion """
+
+    def submit(self, fn, data, document_type):
+        future = Future()
+        future.set_result({'text': 'Name: JOHN DOE', 'name': 'JOHN DOE', 'date_of_birth': '1990-01-02'})
+        return future
+
+
+def jpeg(shade):
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (32, 32), (shade, shade, shade)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def archive(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as z:
+        for name, data in members.items():
+            z.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.fixture
+def ingestor(app, store):
+    writer = ThreadPoolExecutor(max_workers=2)
+    yield BatchIngestor(CannedOCR(), store, writer, parse=lambda text: (None, None), max_file_size=4096)
+    writer.shutdown()
+
+
+def test_parse_manifest_formats():
+    assert parse_manifest(b'id,front,back\n7,a.jpg,b.jpg\n', 'manifest.csv') == [{'id': '7', 'front': 'a.jpg', 'back': 'b.jpg'}]
+    assert parse_manifest('{"front": "a.jpg", "back": "b.jpg"}\n', 'manifest.jsonl')[0]['id'] == '1'
+    with pytest.raises(ValueError):
+        parse_manifest('[{"front": "a.jpg"}]', 'manifest.json')
+
+
+def test_pair_by_name():
+    assert pair_by_name(['x/1_front.jpg', 'x/1_back.png', '2-front.jpg']) == [
+        {'id': '2', 'front': '2-front.jpg', 'back': None},
+        {'id': 'x/1', 'front': 'x/1_front.jpg', 'back': 'x/1_back.png'}
+    ]
+
+
+def test_zip_ingest_registers_valid_items_and_rejects_others(ingestor, store):
+    members = {
+        'ok_front.jpg': jpeg(10), 'ok_back.jpg': jpeg(20),
+        'exe_front.jpg': jpeg(30), 'exe_back.exe': b'MZ' + bytes(100),
+        'fake_front.jpg': b'just some text, not an image' * 10, 'fake_back.jpg': jpeg(40),
+        'big_front.pdf': b'%PDF-1.4\n' + bytes(8192), 'big_back.jpg': jpeg(50),
+        'lonely_front.jpg': jpeg(60)
+    }
+    results = {result['item']: result for result in ingestor.run(open_zip_items(archive(members)))}
+
+    assert results['ok']['status'] == 'ok'
+    assert results['ok']['name'] == 'JOHN DOE'
+    assert 'Invalid file type' in results['exe']['error']
+    assert 'Invalid file type' in results['fake']['error']
+    assert 'File too large' in results['big']['error']
+    assert 'Missing front or back' in results['lonely']['error']
+
+    user = db.session.get(User, results['ok']['userId'])
+    assert user.name == 'JOHN DOE'
+    assert len(user.images) == 2
+    assert Document.query.count() == 1
+
+    # Only the files of the registered item are kept
+    for name, data in members.items():
+        digest = ContentStore.digest(data)
+        kept = name.startswith('ok_')
+        assert store.exists(digest, ContentStore.normalize_ext(name)) == kept
+        assert (db.session.get(Blob, digest) is not None) == kept
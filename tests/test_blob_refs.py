@@ -0,0 +1,106 @@
+import multiprocessing
+import random
+
+from Database.blobRefs import hold_blobs, release_blobs
+from Database.flaskSQL import Blob, Document, db
+from Database.userRepository import UserRepository
+from Storage.contentStore import ContentStore
+
+DATA = b'%PDF-1.4 identity document'
+
+
+def _ref(data=DATA, ext='.pdf', count=1):
+    digest = ContentStore.digest(data)
+    return digest, {digest: (ContentStore.key_for(digest, ext), len(data), count)}
+
+
+def _register(digest, key, size, held=None):
+    registration = {
+        'name': 'Test', 'images': [],
+        'documents': [{'document_url': key, 'document_name': f"front_{random.getrandbits(64):x}.pdf",
+                       'document_type': 'ID', 'content_hash': digest, 'size': size}]
+    }
+    if held:
+        registration['held_blobs'] = held
+    created = UserRepository().create_user(registration)
+    db.session.commit()
+    return created
+
+
+def test_release_deletes_file_at_zero(app, store):
+    digest, refs = _ref()
+    hold_blobs(refs)
+    _, key, created = store.put_bytes(DATA, '.pdf')
+    assert created
+
+    release_blobs({digest: 1}, store)
+    assert db.session.get(Blob, digest) is None
+    assert not store.exists(digest, '.pdf')
+
+
+def test_registration_takes_over_held_reference(app, store):
+    digest, refs = _ref()
+    hold_blobs(refs)
+    _, key, _ = store.put_bytes(DATA, '.pdf')
+
+    _register(digest, key, len(DATA), held={digest: 1})
+    assert db.session.get(Blob, digest).ref_count == 1
+    assert store.exists(digest, '.pdf')
+
+
+def test_failed_request_keeps_file_another_request_holds(app, store):
+    digest, refs = _ref()
+    # A stores the file, B uploads the same content and finds it already stored
+    hold_blobs(refs)
+    assert store.put_bytes(DATA, '.pdf')[2]
+    hold_blobs(refs)
+    assert not store.put_bytes(DATA, '.pdf')[2]
+
+    # A fails while B is still being written
+    release_blobs({digest: 1}, store)
+    assert store.exists(digest, '.pdf')
+
+    _register(digest, ContentStore.key_for(digest, '.pdf'), len(DATA), held={digest: 1})
+    assert db.session.get(Blob, digest).ref_count == 1
+    assert store.exists(digest, '.pdf')
+
+
+def test_file_deleted_before_hold_is_stored_again(app, store):
+    digest, refs = _ref()
+    hold_blobs(refs)
+    store.put_bytes(DATA, '.pdf')
+    release_blobs({digest: 1}, store)
+
+    hold_blobs(refs)
+    assert store.put_bytes(DATA, '.pdf')[2]
+    assert db.session.get(Blob, digest).ref_count == 1
+
+
+def _request(app, store, seed, rounds):
+    random.seed(seed)
+    with app.app_context():
+        db.engine.dispose(close=False)
+        digest, refs = _ref()
+        for _ in range(rounds):
+            hold_blobs(refs)
+            _, key, _ = store.put_bytes(DATA, '.pdf')
+            if random.random() < 0.5:
+                release_blobs({digest: 1}, store)
+            else:
+                _register(digest, key, len(DATA), held={digest: 1})
+
+
+def test_concurrent_requests_never_lose_a_referenced_file(app, store):
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_request, args=(app, store, seed, 30)) for seed in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(120)
+    assert all(worker.exitcode == 0 for worker in workers)
+
+    digest, _ = _ref()
+    rows = Document.query.filter_by(content_hash=digest).count()
+    blob = db.session.get(Blob, digest)
+    assert (blob.ref_count if blob else 0) == rows
+    assert store.exists(digest, '.pdf') == (rows > 0)
@@ -0,0 +1,68 @@
+import io
+import os
+
+import pytest
+
+from Storage.backends import FileSystemBackend
+from Storage.contentStore import ContentStore
+
+
+def test_identical_content_is_stored_once(store):
+    digest, key, created = store.put_bytes(b'front', '.jpg')
+    assert created
+    assert key == f"{digest[:2]}/{digest[2:4]}/{digest}.jpg"
+    assert store.put_bytes(b'front', '.jpg') == (digest, key, False)
+    assert store.read(key) == b'front'
+
+    # Streams are hashed while they are spooled, under the same key
+    assert store.put_stream(io.BytesIO(b'front'), '.jpg') == (digest, key, 5, False)
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_streamed_content_is_read_back(store):
+    data = bytes(range(256)) * 1000
+    digest, key, size, created = store.put_stream(io.BytesIO(data), '.pdf')
+
+    assert (digest, size, created) == (ContentStore.digest(data), len(data), True)
+    assert store.exists(digest, '.pdf')
+    assert store.read_range(key, 256, 4) == bytes([0, 1, 2, 3])
+    with open(store.local_path(key), 'rb') as f:
+        assert f.read() == data
+
+    store.delete(digest, '.pdf')
+    assert not store.exists(digest, '.pdf')
+    store.delete(digest, '.pdf')
+
+
+def test_failed_stream_leaves_no_spooled_file(store):
+    class Broken(io.BytesIO):
+        def read(self, size=-1):
+            raise OSError('connection reset')
+
+    with pytest.raises(OSError):
+        store.put_stream(Broken(), '.jpg')
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_filesystem_backend_spools_next_to_its_root(tmp_path):
+    store = ContentStore(FileSystemBackend(str(tmp_path / 'blobs')))
+    assert store.tmp_dir == str(tmp_path / 'blobs' / '.tmp')
+
+
+def test_normalize_ext():
+    assert ContentStore.normalize_ext('Front.JPG') == '.jpg'
+    assert ContentStore.normalize_ext('scan') == ''
+    assert ContentStore.normalize_ext('x.tar/gz') == ''
+
+
+def test_stored_urls_are_recognized_as_keys_without_probing():
+    digest = ContentStore.digest(b'front')
+    key = ContentStore.key_for(digest, '.jpg')
+
+    assert ContentStore.is_key(key)
+    assert ContentStore.split_key(key) == (digest, '.jpg')
+    assert ContentStore.split_key(ContentStore.key_for(digest)) == (digest, '')
+    # Legacy paths still need to be resolved on disk
+    for legacy in ('uploads/front_20240101_120000_id.jpg', f'{digest}.jpg',
+                   f'{digest[2:4]}/{digest[:2]}/{digest}.jpg', key.upper(), None):
+        assert not ContentStore.is_key(legacy)
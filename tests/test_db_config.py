@@ -0,0 +1,45 @@
+import types
+import threading
+
+import sqlalchemy as sa
+
+from Database.dbConfig import engine_options, is_sqlite, sqlite_pragmas, tune_engine
+
+
+def test_pragmas_are_set_on_every_connection(tmp_path, monkeypatch):
+    monkeypatch.setenv('DB_SQLITE_CACHE_MB', '8')
+    url = f"sqlite:///{tmp_path / 'uiv.db'}"
+    engine = sa.create_engine(url, **engine_options(url))
+    tune_engine(engine)
+
+    def read_pragmas(results):
+        with engine.connect() as conn:
+            results.append(tuple(conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+                                 for name in ('journal_mode', 'synchronous', 'cache_size', 'busy_timeout')))
+
+    results = []
+    threads = [threading.Thread(target=read_pragmas, args=(results,)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # synchronous NORMAL is 1
+    assert results == [('wal', 1, -8 * 1024, 5000)] * 3
+    engine.dispose()
+
+
+def test_engine_options_per_database(monkeypatch):
+    assert is_sqlite('sqlite:///uiv.db')
+    assert engine_options('sqlite:///uiv.db')['connect_args'] == {'check_same_thread': False, 'timeout': 5.0}
+
+    monkeypatch.setenv('DB_POOL_SIZE', '4')
+    options = engine_options('postgresql://uiv@db/uiv')
+    assert not is_sqlite('postgresql://uiv@db/uiv')
+    assert options['pool_size'] == 4
+    assert options['pool_pre_ping']
+
+
+def test_other_databases_are_left_alone():
+    # Neither listened to nor disposed, either would fail on this engine
+    tune_engine(types.SimpleNamespace(dialect=types.SimpleNamespace(name='postgresql')))
+    assert sqlite_pragmas()['journal_mode'] == 'WAL'
@@ -0,0 +1,105 @@
+import os
+import time
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from Database.embeddingMatrix import EmbeddingMatrix
+
+
+def encoding(image_id, dim=8):
+    return np.full(dim, image_id, dtype=np.float32)
+
+
+@pytest.fixture
+def matrix(tmp_path):
+    return EmbeddingMatrix(str(tmp_path), dim=8)
+
+
+def test_get_and_get_many(matrix):
+    matrix.append_many((image_id, encoding(image_id)) for image_id in (1, 2, 5))
+    assert np.array_equal(matrix.get(2), encoding(2))
+    assert matrix.get(3) is None
+    vectors, found = matrix.get_many([5, 3, 1])
+    assert found == [5, 1]
+    assert np.array_equal(vectors, np.stack([encoding(5), encoding(1)]))
+
+
+def test_out_of_order_rows_and_compaction(matrix):
+    matrix.append_many((image_id, encoding(image_id)) for image_id in (10, 11, 12))
+    matrix.append(4, encoding(4))
+    matrix.append(11, encoding(99))
+    assert matrix.stats()['unsorted_rows'] == 2
+    assert np.array_equal(matrix.get(11), encoding(99))
+
+    matrix.compact()
+    assert matrix.stats() == {'rows': 4, 'unsorted_rows': 0, 'bytes': 4 * 8 * 4}
+    assert np.array_equal(matrix.get(4), encoding(4))
+    assert np.array_equal(matrix.get(11), encoding(99))
+
+
+def test_compacts_in_background_after_compact_after_unsorted_rows(tmp_path):
+    matrix = EmbeddingMatrix(str(tmp_path), dim=8, compact_after=2)
+    matrix.append_many([(10, encoding(10)), (3, encoding(3)), (2, encoding(2))])
+    deadline = time.monotonic() + 5
+    while matrix.stats()['unsorted_rows'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert matrix.stats()['unsorted_rows'] == 0
+    assert np.array_equal(matrix.get(3), encoding(3))
+
+
+def test_other_instance_sees_appends_and_compaction(matrix, tmp_path):
+    other = EmbeddingMatrix(str(tmp_path), dim=8)
+    matrix.append_many([(3, encoding(3)), (1, encoding(1))])
+    assert np.array_equal(other.get(1), encoding(1))
+    matrix.compact()
+    assert np.array_equal(other.get(3), encoding(3))
+    assert other.missing([1, 2, 3]).tolist() == [2]
+
+
+def test_reset(matrix):
+    matrix.append(1, encoding(1))
+    matrix.reset()
+    assert len(matrix) == 0
+    assert matrix.last_image_id() == 0
+
+
+def _read_until_stopped(directory, stop, wrong):
+    # Maps the files itself, like another worker process
+    reader = EmbeddingMatrix(directory, dim=8)
+    while not stop.is_set():
+        for image_id in range(1000, 1200, 7):
+            vector = reader.get(image_id)
+            if vector is not None and vector[0] != image_id:
+                with wrong.get_lock():
+                    wrong.value += 1
+
+
+def test_readers_never_see_another_images_vector_during_compaction(tmp_path, monkeypatch):
+    context = multiprocessing.get_context('fork')
+    writer = EmbeddingMatrix(str(tmp_path), dim=8, compact_after=10 ** 9)
+    writer.append_many((image_id, encoding(image_id)) for image_id in range(1000, 1200))
+    stop, wrong = context.Event(), context.Value('i', 0)
+    readers = [context.Process(target=_read_until_stopped, args=(str(tmp_path), stop, wrong)) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+
+    # Widen the window between the files being replaced, in the writer only
+    replace = os.replace
+
+    def slow_replace(src, dst):
+        replace(src, dst)
+        time.sleep(0.002)
+    monkeypatch.setattr(os, 'replace', slow_replace)
+    try:
+        for image_id in range(999, 799, -1):
+            # An older image encoded late sorts first, so every compaction moves all rows,
+            # and a superseded row is dropped, so the row count changes too
+            writer.append_many([(image_id, encoding(image_id)), (1100, encoding(1100))])
+            writer.compact()
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+    assert wrong.value == 0
@@ -0,0 +1,44 @@
+import types
+
+import numpy as np
+
+from Database.embeddingMatrix import EmbeddingMatrix
+from Database.embeddingStore import EmbeddingStore, deserialize_encoding, serialize_encoding, stored_encoding
+
+
+def image(image_id, face_encoding):
+    return types.SimpleNamespace(image_id=image_id, face_encoding=face_encoding)
+
+
+def test_encoding_round_trip():
+    encoding = np.random.default_rng(0).normal(size=128)
+    assert np.array_equal(deserialize_encoding(serialize_encoding(encoding)), encoding)
+    assert deserialize_encoding(b'') is None
+    assert deserialize_encoding(serialize_encoding(np.zeros(64))) is None
+
+
+def test_stored_encoding_tells_no_face_from_not_computed():
+    encoding = np.ones(128)
+    assert stored_encoding({'encoding': encoding, 'face_count': 1}) == serialize_encoding(encoding)
+    assert stored_encoding({'encoding': None, 'face_count': 0}) == b''
+    assert stored_encoding({'encoding': None, 'face_count': None}) is None
+
+
+def test_row_encodings_are_mirrored_into_the_shared_matrix(tmp_path):
+    store = EmbeddingStore(EmbeddingMatrix(str(tmp_path)))
+    encoding = np.random.default_rng(0).normal(size=128)
+
+    assert np.array_equal(store.get(image(3, serialize_encoding(encoding))), encoding)
+    # Found in the matrix afterwards, also by another worker process
+    assert np.allclose(store.get(image(3, None)), encoding, atol=1e-6)
+    assert np.allclose(EmbeddingMatrix(str(tmp_path)).get(3), encoding, atol=1e-6)
+
+    assert store.get(image(4, b'')) is None
+    assert store.is_computed(image(4, b''))
+    assert not store.is_computed(image(5, None))
+
+
+def test_add_many(tmp_path):
+    store = EmbeddingStore(EmbeddingMatrix(str(tmp_path)))
+    store.add_many((image_id, np.full(128, image_id, dtype=np.float32)) for image_id in (1, 2))
+    assert store.get(image(2, None))[0] == 2
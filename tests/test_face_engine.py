@@ -0,0 +1,58 @@
+import io
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from Extraction.faceEngine import EngineSaturated, FaceEngine, _picklable
+
+
+@pytest.fixture
+def engine():
+    engine = FaceEngine(workers=2, max_queue=3, timeout=5)
+    # Threads instead of worker processes, the dlib models aren't needed to test queueing
+    engine._pool = ThreadPoolExecutor(max_workers=2)
+    yield engine
+    engine.shutdown()
+
+
+def test_jobs_beyond_max_queue_are_rejected(engine):
+    release = threading.Event()
+    futures = [engine.submit(release.wait, 5) for _ in range(3)]
+    assert engine.queue_depth == 3
+
+    with pytest.raises(EngineSaturated):
+        engine.submit(release.wait, 5)
+    assert engine.stats() == {'workers': 2, 'queue_depth': 3, 'max_queue': 3, 'rejected': 1}
+
+    release.set()
+    assert all(future.result(5) for future in futures)
+    # Slots are freed by done callbacks, just after the results are set
+    deadline = time.monotonic() + 5
+    while engine.queue_depth and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert engine.queue_depth == 0
+    assert engine.submit(lambda: 'ok').result(5) == 'ok'
+
+
+def test_failed_submission_frees_its_slot(engine):
+    engine._pool.shutdown()
+    with pytest.raises(RuntimeError):
+        engine.submit(lambda: None)
+    assert engine.queue_depth == 0
+
+
+def test_after_fork_forgets_the_parent_pool(engine):
+    engine.submit(threading.Event().wait, 0.1)
+    pool = engine._pool
+    engine.after_fork()
+    assert engine._pool is None and engine.queue_depth == 0
+    pool.shutdown()
+
+
+def test_images_are_sent_to_workers_as_paths_or_bytes():
+    assert _picklable('ab/cd/abcd.jpg') == 'ab/cd/abcd.jpg'
+    assert _picklable(b'jpeg') == b'jpeg'
+    assert _picklable(memoryview(b'jpeg')) == b'jpeg'
+    assert _picklable(io.BytesIO(b'jpeg')) == b'jpeg'
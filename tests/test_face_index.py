@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from Database.embeddingMatrix import EmbeddingMatrix
+from Database.faceIndex import FaceIndex
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(1).normal(size=(600, 16)).astype(np.float32)
+
+
+@pytest.fixture
+def matrix(tmp_path):
+    return EmbeddingMatrix(str(tmp_path / 'matrix'), dim=16)
+
+
+def index(matrix, tmp_path, **kwargs):
+    kwargs.setdefault('train_min', 10 ** 6)
+    return FaceIndex(matrix, str(tmp_path / 'index'), **kwargs)
+
+
+def test_untrained_index_scans_every_row(matrix, tmp_path, vectors):
+    face_index = index(matrix, tmp_path)
+    assert face_index.search(vectors[0]) == []
+
+    matrix.append_many((i + 1, vectors[i]) for i in range(100))
+    face_index.update()
+    results = face_index.search(vectors[41], k=3)
+    assert results[0] == {'image_id': 42, 'distance': 0.0}
+    assert len(results) == 3
+    assert face_index.search(vectors[41], k=3, max_distance=0.5) == results[:1]
+    assert face_index.stats()['nlist'] == 0
+
+
+def test_trained_index_finds_assigned_and_unassigned_rows(matrix, tmp_path, vectors):
+    face_index = index(matrix, tmp_path, nprobe=4)
+    matrix.append_many((i + 1, vectors[i]) for i in range(400))
+    face_index.train(nlist=8)
+    assert face_index.stats()['assigned'] == 400
+
+    # Appended rows are searched before update() assigns them to a list
+    matrix.append_many((i + 1, vectors[i]) for i in range(400, 600))
+    assert face_index.search(vectors[500], k=1)[0]['image_id'] == 501
+    face_index.update()
+    assert face_index.stats()['assigned'] == 600
+    for i in range(0, 600, 37):
+        assert face_index.search(vectors[i], k=1)[0]['image_id'] == i + 1
+
+
+def test_replaced_encoding_is_returned_once(matrix, tmp_path, vectors):
+    face_index = index(matrix, tmp_path)
+    matrix.append_many((i + 1, vectors[i]) for i in range(10))
+    matrix.append(5, vectors[4])
+    face_index.update()
+
+    image_ids = [result['image_id'] for result in face_index.search(vectors[4], k=4)]
+    assert image_ids[0] == 5
+    assert len(image_ids) == len(set(image_ids)) == 4
+
+
+def test_lists_are_shared_and_survive_compaction(matrix, tmp_path, vectors):
+    face_index = index(matrix, tmp_path)
+    matrix.append_many((i + 1, vectors[i]) for i in range(300, 400))
+    matrix.append_many((i + 1, vectors[i]) for i in range(300))
+    face_index.train(nlist=4)
+
+    # Another worker process sees the lists written by this one
+    other = index(EmbeddingMatrix(str(tmp_path / 'matrix'), dim=16), tmp_path)
+    assert other.stats()['nlist'] == 4
+
+    matrix.compact()
+    assert face_index.search(vectors[7], k=1)[0]['image_id'] == 8
+    face_index.update()
+    assert face_index.stats()['assigned'] == 400
+    assert other.search(vectors[350], k=1)[0]['image_id'] == 351
+
+
+def test_update_starts_training_past_train_min(matrix, tmp_path, vectors):
+    face_index = index(matrix, tmp_path, train_min=200)
+    started = []
+    face_index.train_in_background = lambda: started.append(True)
+
+    matrix.append_many((i + 1, vectors[i]) for i in range(100))
+    face_index.update()
+    assert started == []
+    matrix.append_many((i + 1, vectors[i]) for i in range(100, 200))
+    face_index.update()
+    assert started == [True]
+
+
+def test_reset_drops_the_quantizer(matrix, tmp_path, vectors):
+    face_index = index(matrix, tmp_path)
+    matrix.append_many((i + 1, vectors[i]) for i in range(100))
+    face_index.train(nlist=4)
+    face_index.reset()
+
+    assert face_index.stats()['nlist'] == 0
+    assert face_index.search(vectors[3], k=1)[0]['image_id'] == 4
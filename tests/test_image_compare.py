@@ -0,0 +1,137 @@
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('face_recognition')
+
+from Database.embeddingMatrix import EmbeddingMatrix
+from Extraction.imageCompare import ALIGNED_SIZE, FaceDetector, Image_compare, detector_chain, get_detector
+
+
+def encoding(value):
+    return np.full(128, value, dtype=np.float64)
+
+
+@pytest.fixture
+def comparator(monkeypatch):
+    """ Image_compare whose selfie always encodes to encoding(0.1) """
+    comparator = Image_compare()
+    encoded = []
+
+    def encode_face(image, label='image', detector=None, keep_chip=False):
+        encoded.append(image)
+        if image == b'no face':
+            return {'encoding': None, 'face_count': 0, 'error': f'No face found in {label}'}
+        return {'encoding': encoding(0.1), 'face_count': 1, 'error': None}
+
+    monkeypatch.setattr(comparator, 'encode_face', encode_face)
+    comparator.encoded = encoded
+    return comparator
+
+
+def test_compare_many_scores_every_candidate_at_once(comparator):
+    result = comparator.compare_many(b'selfie', [encoding(0.5), encoding(0.1), encoding(0.12)], tolerance=0.3)
+
+    assert comparator.encoded == [b'selfie']
+    assert result['match'] and result['error'] is None
+    assert result['best_index'] == 1
+    assert result['distance'] == pytest.approx(0.0)
+    assert result['distances'] == pytest.approx([np.sqrt(128) * 0.4, 0.0, np.sqrt(128) * 0.02])
+
+
+def test_compare_many_without_a_match_or_candidates(comparator):
+    assert not comparator.compare_many(b'selfie', [encoding(0.9)], tolerance=0.3)['match']
+    assert comparator.compare_many(b'selfie', [])['error'] == 'No candidate encodings to compare against'
+    assert comparator.compare_many(b'no face', [encoding(0.1)])['error'] == 'No face found in selfie image'
+
+
+def test_compare_stored_reads_the_shared_matrix(comparator, tmp_path):
+    matrix = EmbeddingMatrix(str(tmp_path))
+    matrix.append_many([(4, encoding(0.9)), (7, encoding(0.1))])
+    result = comparator.compare_stored(b'selfie', matrix, [7, 5, 4], tolerance=0.3)
+
+    assert result['image_ids'] == [7, 4]
+    assert result['best_image_id'] == 7
+    assert result['match']
+
+
+
+class ScriptedDetector(FaceDetector):
+    """ Reports fixed boxes, scaled to the image it is given, and records its calls """
+
+    name = 'scripted'
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.calls = []
+
+    def detect(self, rgb, upsample=1, min_size=0):
+        self.calls.append((rgb.shape[:2], min_size))
+        height = rgb.shape[0]
+        return [tuple(int(v * height / 480) for v in box) for box in self.boxes]
+
+
+def face_card(size=(480, 640)):
+    """ A light card with a dark block where the scripted detector reports the face """
+    image = np.full(size + (3,), 220, dtype=np.uint8)
+    k = size[0] / 480
+    cv2.rectangle(image, (int(200 * k), int(100 * k)), (int(400 * k) - 1, int(300 * k) - 1), (60, 80, 120), -1)
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def test_detector_chain_tries_each_detector_until_one_finds_a_face():
+    empty, found = ScriptedDetector([]), ScriptedDetector([(100, 400, 300, 200)])
+    comparator = Image_compare(detect_max_side=320, detector=[empty, found])
+    rgb = np.zeros((480, 640, 3), dtype=np.uint8)
+
+    assert comparator.locate_faces(rgb) == [(100, 400, 300, 200)]
+    # Detection runs on the downscaled copy, min_size scaled along
+    assert empty.calls == found.calls == [((240, 320), 20)]
+
+
+def test_detector_names():
+    assert [d.name for d in detector_chain('hog, cnn')] == ['hog', 'cnn']
+    # No DNN model configured: falls back to the Haar cascade, or to HOG without one
+    assert detector_chain('dnn')[0].name in ('haar', 'hog')
+    with pytest.raises(ValueError):
+        get_detector('mtcnn')
+
+
+def test_small_faces_are_rejected_before_encoding(monkeypatch):
+    comparator = Image_compare(detector=ScriptedDetector([(100, 230, 130, 200)]), min_face_size=40)
+    monkeypatch.setattr(comparator, 'encode_chip', lambda chip, box: pytest.fail('encoded a small face'))
+
+    result = comparator.encode_face(face_card(), label='ID image')
+    assert result['face_count'] == 1
+    assert result['error'] == 'Face in ID image is too small'
+
+
+def test_no_face_found():
+    comparator = Image_compare(detector=ScriptedDetector([]))
+    result = comparator.encode_face(face_card(), label='selfie image')
+    assert (result['face_count'], result['error']) == (0, 'No face found in selfie image')
+
+
+def test_face_chip_is_padded_and_cut_from_full_resolution():
+    comparator = Image_compare(detect_max_side=320, detector=ScriptedDetector([(100, 400, 300, 200)]))
+    bgr = cv2.imdecode(np.frombuffer(face_card((960, 1280)), np.uint8), cv2.IMREAD_COLOR)
+    crop = comparator.crop_face(bgr)
+
+    assert crop['face_count'] == 1
+    assert crop['box'] == (200, 800, 600, 400)
+    # Half the box size of margin on each side, clipped to the image
+    assert crop['chip'].shape == (800, 800, 3)
+    assert crop['chip_box'] == (200, 600, 600, 200)
+    assert not np.shares_memory(crop['chip'], bgr)
+    # Converted to RGB: the face block is (120, 80, 60)
+    assert tuple(crop['chip'][400, 400]) == (120, 80, 60)
+
+
+def test_encoding_runs_on_the_aligned_chip():
+    comparator = Image_compare(detector=ScriptedDetector([(100, 400, 300, 200)]))
+    result = comparator.encode_face(face_card(), keep_chip=True)
+
+    assert result['error'] is None
+    assert result['encoding'].shape == (128,)
+    assert result['chip'].shape == (ALIGNED_SIZE, ALIGNED_SIZE, 3)
+    assert 'chip' not in comparator.encode_face(face_card())
@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import pytest
+
+import dataCollection.jobs as jobs
+from Database.flaskSQL import Document, Job, User, db
+from Database.userRepository import UserRepository
+
+
+@pytest.fixture
+def runner(app, monkeypatch):
+    def run_ocr(image, document_type=None):
+        if image == 'broken.jpg':
+            raise RuntimeError('worker died')
+        if image == 'blank.jpg':
+            return {'text': 'Error processing image: no text', 'name': 'Unknown', 'date_of_birth': None}
+        return {'text': f'JOHN DOE\n1990-01-02\n{document_type}', 'name': 'JOHN DOE', 'date_of_birth': '1990-01-02'}
+
+    monkeypatch.setattr(jobs, 'run_ocr', run_ocr)
+    runner = jobs.JobRunner(app)
+    # Threads instead of processes, so the stand-in OCR above is used
+    runner._pool = ThreadPoolExecutor(max_workers=2)
+    yield runner
+    runner.shutdown()
+
+
+def queue_job(job_id, document_url):
+    UserRepository().create_user({
+        'name': None,
+        'documents': [{'document_url': document_url, 'document_name': f'front_{job_id}',
+                       'document_type': 'ID', 'job_id': job_id}]
+    })
+    db.session.commit()
+
+
+def test_finished_job_fills_in_user_and_document(runner):
+    queue_job('a', 'card.jpg')
+    runner.submit('a', 'card.jpg', 'ID').result(5)
+    runner._pool.shutdown(wait=True)
+    db.session.expire_all()
+
+    job = db.session.get(Job, 'a')
+    assert job.status == 'done' and job.finished_at
+    user = db.session.get(User, job.user_id)
+    assert (user.name, user.date_of_birth) == ('JOHN DOE', date(1990, 1, 2))
+    assert db.session.get(Document, job.document_id).extracted_text.endswith('ID')
+
+
+@pytest.mark.parametrize('path, error', [('broken.jpg', 'worker died'), ('blank.jpg', 'Error processing image')])
+def test_failed_job_is_marked_failed(runner, path, error):
+    queue_job('b', path)
+    future = runner.submit('b', path)
+    runner._pool.shutdown(wait=True)
+    db.session.expire_all()
+
+    job = db.session.get(Job, 'b')
+    assert job.status == 'failed'
+    assert error in job.error
+    assert db.session.get(User, job.user_id).name is None
+    assert future.done()
+
+
+def test_queued_jobs_are_requeued(runner):
+    queue_job('c', 'ab/cd/card.jpg')
+    queue_job('d', 'ab/cd/other.jpg')
+    runner.submit('d', 'ab/cd/other.jpg')
+    runner._pool.shutdown(wait=True)
+
+    runner._pool = ThreadPoolExecutor(max_workers=2)
+    resolved = []
+    runner.requeue_pending(resolve=lambda url: resolved.append(url) or url)
+    runner._pool.shutdown(wait=True)
+    db.session.expire_all()
+
+    assert resolved == ['ab/cd/card.jpg']
+    assert db.session.get(Job, 'c').status == 'done'
+    assert db.session.get(Document, db.session.get(Job, 'c').document_id).extracted_text.endswith('ID')
@@ -0,0 +1,46 @@
+import hashlib
+import os
+
+import pytest
+import sqlalchemy as sa
+from alembic import command
+from alembic.config import Config
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def alembic_config(url=None):
+    config = Config(os.path.join(ROOT, 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(ROOT, 'migrations'))
+    if url:
+        config.cmd_opts = type('Options', (), {'x': [f'url={url}']})()
+    return config
+
+
+def test_upgrade_creates_schema_and_hashes_issued_tokens(tmp_path, monkeypatch):
+    monkeypatch.delenv('DATABASE_URI', raising=False)
+    url = f"sqlite:///{tmp_path / 'uiv.db'}"
+    command.upgrade(alembic_config(url), '0002')
+
+    engine = sa.create_engine(url)
+    with engine.begin() as conn:
+        conn.execute(sa.text("INSERT INTO user (user_id, name) VALUES (1, 'Test')"))
+        conn.execute(sa.text(
+            "INSERT INTO profile (\"profile_ID\", user_id, verification, token) VALUES (1, 1, 1, 'issued')"
+        ))
+
+    command.upgrade(alembic_config(url), 'head')
+    inspector = sa.inspect(engine)
+    assert 'ix_image_user_id' in {index['name'] for index in inspector.get_indexes('image')}
+    assert 'ix_profile_token_hash' in {index['name'] for index in inspector.get_indexes('profile')}
+    with engine.connect() as conn:
+        token_hash = conn.execute(sa.text('SELECT token_hash FROM profile')).scalar()
+    assert token_hash == hashlib.sha256(b'issued').hexdigest()
+    engine.dispose()
+
+
+@pytest.mark.parametrize('url', [None, 'sqlite:///uiv.db'])
+def test_database_must_be_given_explicitly(url, monkeypatch):
+    monkeypatch.delenv('DATABASE_URI', raising=False)
+    with pytest.raises(SystemExit):
+        command.upgrade(alembic_config(url), 'head')
@@ -0,0 +1,212 @@
+import io
+import sys
+import time
+import types
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+
+from Extraction.imageO import ImageExtractor, OCRCache, detect_text_lines
+from Extraction.ocrBackends import PytesseractBackend, TesserocrBackend, create_ocr_backend, parse_tesseract_config
+
+
+class CountingBackend:
+    """ OCR backend answering from a fixed text, tesseract isn't needed to test around it """
+
+    name = 'counting'
+
+    def __init__(self, text='JOHN DOE\n1990-01-02\n'):
+        self.text = text
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def image_to_string(self, image, config=''):
+        with self._lock:
+            self.calls.append((image.shape, config))
+        return self.text
+
+
+def card(text_lines=('JOHN DOE', '1990-01-02'), size=(400, 640)):
+    image = np.full(size + (3,), 255, dtype=np.uint8)
+    for i, line in enumerate(text_lines):
+        cv2.putText(image, line, (40, 120 + 110 * i), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 5)
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def test_cache_tiers(tmp_path):
+    path = str(tmp_path / 'ocr.sqlite')
+    cache = OCRCache(path, memory_items=1)
+    cache.put('a', 'text a')
+    cache.put('b', 'text b')
+
+    assert cache.get('b') == 'text b'
+    # Pushed out of memory by b, still on disk
+    assert cache.get('a') == 'text a'
+    assert cache.get('c') is None
+    assert cache.stats()['memory_hits'] == 1
+    assert cache.stats()['disk_hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+    # Shared with the other workers through the file
+    assert OCRCache(path).get('b') == 'text b'
+
+
+def test_cache_is_trimmed_by_last_use(tmp_path):
+    cache = OCRCache(str(tmp_path / 'ocr.sqlite'), memory_items=1, max_bytes=10 * 100)
+    for i in range(64):
+        cache.put(f'key {i}', 'x' * 100)
+    stats = cache.stats()
+    assert stats['disk_bytes'] <= 1000
+    assert cache.get('key 63') is not None
+    assert cache.get('key 0') is None
+
+
+def test_key_depends_on_image_and_config():
+    binary = np.zeros((4, 4), dtype=np.uint8)
+    assert OCRCache.key(binary) == OCRCache.key(binary.copy())
+    assert OCRCache.key(binary) != OCRCache.key(binary, '--psm 7')
+    assert OCRCache.key(binary) != OCRCache.key(binary.reshape(2, 8))
+
+
+def test_identical_image_is_recognized_once(tmp_path):
+    backend = CountingBackend()
+    extractor = ImageExtractor(cache=OCRCache(str(tmp_path / 'ocr.sqlite')), ocr_backend=backend, mode='full')
+    image = card()
+
+    assert extractor.process_and_extract(image) == backend.text
+    assert extractor.process_and_extract(io.BytesIO(image)) == backend.text
+    assert len(backend.calls) == 1
+
+    # Another worker process finds the text in the shared file
+    other = ImageExtractor(cache=OCRCache(str(tmp_path / 'ocr.sqlite')), ocr_backend=backend, mode='full')
+    assert other.process_and_extract(image) == backend.text
+    assert len(backend.calls) == 1
+
+
+class FakeTessBaseAPI:
+    """ Stands in for tesserocr.PyTessBaseAPI, recording how handles are used """
+
+    created = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.variables = {}
+        self.busy = False
+        FakeTessBaseAPI.created.append(self)
+
+    def SetVariable(self, name, value):
+        self.variables[name] = value
+        return True
+
+    def SetImage(self, image):
+        assert not self.busy, 'handle shared between threads'
+        self.busy = True
+
+    def GetUTF8Text(self):
+        time.sleep(0.01)
+        return 'JOHN DOE\n'
+
+    def Clear(self):
+        self.busy = False
+
+    def End(self):
+        pass
+
+
+@pytest.fixture
+def tesserocr(monkeypatch):
+    FakeTessBaseAPI.created = []
+    monkeypatch.setitem(sys.modules, 'tesserocr', types.SimpleNamespace(PyTessBaseAPI=FakeTessBaseAPI))
+    return FakeTessBaseAPI
+
+
+def test_parse_tesseract_config():
+    assert parse_tesseract_config('--psm 7 --oem 1 -c tessedit_char_whitelist=ABC') == (
+        7, 1, {'tessedit_char_whitelist': 'ABC'}
+    )
+    assert parse_tesseract_config('') == (None, None, {})
+    assert parse_tesseract_config('--dpi 300') == (None, None, {})
+
+
+def test_tesserocr_handles_are_pooled_per_config(tesserocr):
+    backend = TesserocrBackend(pool_size=2)
+    binary = np.zeros((8, 8), dtype=np.uint8)
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        texts = list(pool.map(lambda _: backend.image_to_string(binary, config='--psm 6'), range(24)))
+
+    assert texts == ['JOHN DOE\n'] * 24
+    assert len(tesserocr.created) == 2
+    assert all(api.kwargs == {'lang': 'eng', 'psm': 6} for api in tesserocr.created)
+
+    backend.image_to_string(binary, config='--psm 7 -c load_system_dawg=0')
+    assert tesserocr.created[-1].variables == {'load_system_dawg': '0'}
+    assert backend.stats() == {'backend': 'tesserocr', 'pool_size': 2, 'handles': 3, 'idle': 3}
+
+
+def test_backend_selection(tesserocr, monkeypatch):
+    assert isinstance(create_ocr_backend('pytesseract'), PytesseractBackend)
+    backend = create_ocr_backend('tesserocr', config='--psm 6')
+    assert isinstance(backend, TesserocrBackend)
+    # Warmed up for the configured settings
+    assert backend.stats()['idle'] == 1
+
+    monkeypatch.setitem(sys.modules, 'tesserocr', None)
+    assert isinstance(create_ocr_backend('tesserocr'), PytesseractBackend)
+    with pytest.raises(ValueError):
+        create_ocr_backend('easyocr')
+
+
+class ScriptedBackend(CountingBackend):
+    """ Answers each call with the next text in turn """
+
+    def __init__(self, texts):
+        super().__init__()
+        self.texts = iter(texts)
+
+    def image_to_string(self, image, config=''):
+        super().image_to_string(image, config)
+        return next(self.texts)
+
+
+def roi_extractor(backend, **kwargs):
+    return ImageExtractor(cache=OCRCache(), ocr_backend=backend, mode='roi', **kwargs)
+
+
+def test_detect_text_lines_in_reading_order():
+    binary = cv2.imdecode(np.frombuffer(card(('JOHN DOE', '1990-01-02', 'ID 12345')), np.uint8), cv2.IMREAD_GRAYSCALE)
+    boxes = detect_text_lines(binary)
+
+    assert len(boxes) == 3
+    assert [box[1] for box in boxes] == sorted(box[1] for box in boxes)
+    assert all(x1 - x0 > 2 * (y1 - y0) for x0, y0, x1, y1 in boxes)
+
+
+def test_template_fields_are_recognized_as_single_lines():
+    backend = ScriptedBackend(['JOHN DOE\n', '1990-01-02\n'])
+    templates = {'ID': {'name': [0.05, 0.15, 0.9, 0.2], 'date_of_birth': [0.05, 0.42, 0.9, 0.2]}}
+    extractor = roi_extractor(backend, templates=templates)
+
+    text = extractor.process_and_extract(card(), document_type='ID')
+    assert extractor.parse_ocr_data(text) == ('JOHN DOE', '1990-01-02')
+    assert [config for _, config in backend.calls] == ['--psm 7', '--psm 7']
+    assert all(shape[0] < 200 for shape, _ in backend.calls)
+
+
+def test_detected_lines_are_read_until_the_date():
+    backend = ScriptedBackend(['JOHN DOE\n', '1990-01-02\n', 'ID 12345\n'])
+    extractor = roi_extractor(backend, templates={})
+
+    text = extractor.process_and_extract(card(('JOHN DOE', '1990-01-02', 'ID 12345')), document_type='ID')
+    assert extractor.parse_ocr_data(text) == ('JOHN DOE', '1990-01-02')
+    assert len(backend.calls) == 2
+
+
+def test_card_without_text_lines_falls_back_to_full_ocr():
+    backend = ScriptedBackend(['full card text\n'])
+    extractor = roi_extractor(backend, templates={})
+
+    assert extractor.process_and_extract(card(())) == 'full card text\n'
+    assert backend.calls == [((400, 640), '')]
@@ -0,0 +1,52 @@
+import io
+
+import cv2
+import numpy as np
+import pytest
+
+from Extraction.preprocess import downscale, read_image, read_scaled, scale_boxes
+
+
+def encoded(width, height, ext='.jpg'):
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    image[:, :width // 2] = 255
+    return cv2.imencode(ext, image)[1].tobytes()
+
+
+def test_downscale_keeps_small_images():
+    image = np.zeros((300, 400, 3), dtype=np.uint8)
+    assert downscale(image, 800)[0] is image
+    assert downscale(image, None)[1] == 1.0
+
+
+@pytest.mark.parametrize('size, max_side, expected', [
+    ((4000, 3000), 800, (800, 600)),
+    ((3000, 4000), 800, (600, 800)),
+    ((1000, 500), 800, (800, 400)),
+])
+def test_read_scaled_bounds_the_longest_edge(size, max_side, expected):
+    image, scale = read_scaled(encoded(*size), max_side)
+    assert (image.shape[1], image.shape[0]) == expected
+    assert scale == pytest.approx(max(size) / max(expected))
+
+
+def test_read_scaled_grayscale_and_full_size():
+    image, scale = read_scaled(encoded(640, 480, '.png'), 0, grayscale=True)
+    assert image.shape == (480, 640)
+    assert scale == 1.0
+    assert read_scaled(b'not an image', 800) == (None, 1.0)
+
+
+def test_scale_boxes_maps_back_and_clamps():
+    assert scale_boxes([(10, 20, 30, 5)], 1.0, (100, 100)) == [(10, 20, 30, 5)]
+    assert scale_boxes([(10, 60, 45, 5)], 2.0, (80, 100)) == [(20, 100, 80, 10)]
+
+
+def test_images_are_decoded_from_memory_and_paths(tmp_path):
+    data = encoded(64, 48, '.png')
+    path = tmp_path / 'card.png'
+    path.write_bytes(data)
+
+    for source in (data, memoryview(data), io.BytesIO(data), str(path)):
+        assert read_image(source).shape == (48, 64, 3)
+    assert read_image(b'') is None
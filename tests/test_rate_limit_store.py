@@ -0,0 +1,61 @@
+import multiprocessing
+
+import pytest
+from limits import RateLimitItemPerHour, RateLimitItemPerMinute
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter, SlidingWindowCounterRateLimiter
+
+from Database.rateLimitStore import SQLiteStorage, storage_uri
+
+
+@pytest.fixture
+def uri(tmp_path):
+    return f"sqlite:///{tmp_path / 'ratelimit.db'}"
+
+
+def test_storage_uri_selects_the_sqlite_storage(uri, monkeypatch):
+    monkeypatch.setenv('RATELIMIT_STORAGE_URI', uri)
+    storage = storage_from_string(storage_uri())
+    assert isinstance(storage, SQLiteStorage)
+    assert storage.check()
+
+
+@pytest.mark.parametrize('strategy', [FixedWindowRateLimiter, SlidingWindowCounterRateLimiter])
+def test_limit_is_enforced(uri, strategy):
+    limiter = strategy(storage_from_string(uri))
+    limit = RateLimitItemPerMinute(3)
+
+    assert [limiter.hit(limit, '127.0.0.1') for _ in range(5)] == [True, True, True, False, False]
+    assert limiter.hit(limit, '10.0.0.1')
+    limiter.clear(limit, '127.0.0.1')
+    assert limiter.hit(limit, '127.0.0.1')
+
+
+def test_counters_are_capped_at_max_keys(uri):
+    storage = storage_from_string(f'{uri}?max_keys=10&purge_every=5')
+    for i in range(50):
+        storage.incr(f'client-{i}', 60)
+    assert storage.stats()['keys'] <= 10
+
+
+def hit_many(uri, hits, allowed):
+    limiter = SlidingWindowCounterRateLimiter(storage_from_string(uri))
+    limit = RateLimitItemPerHour(25)
+    for _ in range(hits):
+        if limiter.hit(limit, '127.0.0.1'):
+            with allowed.get_lock():
+                allowed.value += 1
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_limit_is_shared_by_worker_processes(uri):
+    context = multiprocessing.get_context('fork')
+    allowed = context.Value('i', 0)
+    workers = [context.Process(target=hit_many, args=(uri, 20, allowed)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+
+    assert [worker.exitcode for worker in workers] == [0] * 4
+    assert allowed.value == 25
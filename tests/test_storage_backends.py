@@ -0,0 +1,116 @@
+import io
+import os
+
+import pytest
+
+from Storage.backends import FileSystemBackend, ReadThroughCache, S3Backend, create_backend
+from Storage.contentStore import ContentStore
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def s3():
+    moto = pytest.importorskip('moto')
+    boto3 = pytest.importorskip('boto3')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='uploads')
+        yield client
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ReadThroughCache(str(tmp_path / 'cache'))
+
+
+def test_s3_store_round_trip(s3, cache):
+    store = ContentStore(S3Backend('uploads', prefix='blobs/', client=s3, cache=cache))
+    digest, key, created = store.put_bytes(b'front', '.jpg')
+
+    assert created and store.exists(digest, '.jpg')
+    assert s3.get_object(Bucket='uploads', Key=f'blobs/{key}')['Body'].read() == b'front'
+    assert store.put_bytes(b'front', '.jpg')[2] is False
+    assert store.read_range(key, 1, 3) == b'ron'
+
+    path = store.local_path(key)
+    assert path == cache.path(key)
+    with open(path, 'rb') as f:
+        assert f.read() == b'front'
+
+    store.delete(digest, '.jpg')
+    assert not store.exists(digest, '.jpg')
+    assert not os.path.exists(path)
+
+
+def test_large_stream_is_uploaded_in_parts(s3, cache, tmp_path):
+    store = ContentStore(S3Backend('uploads', client=s3, part_size=5 * MB, cache=cache), tmp_dir=str(tmp_path / 'spool'))
+    data = os.urandom(11 * MB)
+    digest, key, size, created = store.put_stream(io.BytesIO(data), '.pdf')
+
+    head = s3.head_object(Bucket='uploads', Key=key)
+    assert head['ContentLength'] == size == len(data)
+    assert head['ETag'].strip('"').endswith('-3')
+    # The spooled upload is kept in the cache, so it isn't downloaded again
+    with open(cache.path(key), 'rb') as f:
+        assert ContentStore.digest(f.read()) == digest
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_local_path_needs_a_cache(s3):
+    backend = S3Backend('uploads', client=s3)
+    backend.put_bytes('ab/cd/abcd.jpg', b'front')
+    assert backend.get_bytes('ab/cd/abcd.jpg') == b'front'
+    with pytest.raises(RuntimeError):
+        backend.local_path('ab/cd/abcd.jpg')
+
+
+def test_cache_fetches_once_and_evicts_least_recently_used(tmp_path):
+    cache = ReadThroughCache(str(tmp_path / 'cache'), max_bytes=250)
+    fetched = []
+
+    def fetch(key):
+        def write(path):
+            fetched.append(key)
+            with open(path, 'wb') as f:
+                f.write(bytes(100))
+        return write
+
+    paths = {}
+    for key in ('aa/aa/a', 'bb/bb/b'):
+        paths[key] = cache.fetch_path(key, fetch(key))
+        os.utime(paths[key], (len(paths), len(paths)))
+    assert cache.fetch_path('aa/aa/a', fetch('aa/aa/a')) == paths['aa/aa/a']
+    assert fetched == ['aa/aa/a', 'bb/bb/b']
+
+    cache.fetch_path('cc/cc/c', fetch('cc/cc/c'))
+    assert not os.path.exists(paths['bb/bb/b'])
+    assert os.path.exists(paths['aa/aa/a'])
+
+
+def test_failed_fetch_leaves_nothing_cached(cache):
+    def fetch(path):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+        raise OSError('connection reset')
+
+    with pytest.raises(OSError):
+        cache.fetch_path('ab/cd/abcd.jpg', fetch)
+    assert os.listdir(os.path.dirname(cache.path('ab/cd/abcd.jpg'))) == []
+
+
+def test_backend_is_selected_from_the_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv('UPLOAD_FOLDER_BLOBS', str(tmp_path / 'blobs'))
+    backend = create_backend()
+    assert isinstance(backend, FileSystemBackend)
+    assert backend.root == str(tmp_path / 'blobs')
+
+    pytest.importorskip('boto3')
+    monkeypatch.setenv('STORAGE_BACKEND', 's3')
+    monkeypatch.setenv('S3_BUCKET', 'uploads')
+    monkeypatch.setenv('S3_REGION', 'us-east-1')
+    monkeypatch.setenv('STORAGE_CACHE_DIR', str(tmp_path / 'cache'))
+    backend = create_backend()
+    assert isinstance(backend, S3Backend)
+    assert backend.bucket == 'uploads'
+    assert backend.cache.root == str(tmp_path / 'cache')
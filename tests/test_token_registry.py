@@ -0,0 +1,99 @@
+import multiprocessing
+
+import pytest
+
+from Database.tokenRegistry import TokenEpochs, TokenRegistry
+
+
+class FakeDB:
+    """ Current jti per user, counting reads """
+
+    def __init__(self, current=None):
+        self.current = dict(current or {})
+        self.reads = 0
+
+    def load(self, user_id):
+        self.reads += 1
+        return self.current.get(user_id)
+
+
+def test_current_token_is_checked_from_cache():
+    db = FakeDB({'7': 'a'})
+    registry = TokenRegistry(db.load, ttl=3600)
+
+    assert registry.is_current(7, 'a')
+    assert registry.is_current(7, 'a')
+    assert db.reads == 1
+    assert registry.stats()['hits'] == 1
+
+
+def test_issue_and_revoke_supersede_the_cached_token():
+    db = FakeDB({'7': 'a'})
+    registry = TokenRegistry(db.load, ttl=3600)
+    registry.is_current(7, 'a')
+
+    db.current['7'] = 'b'
+    registry.issue(7, 'b')
+    assert registry.is_current(7, 'b')
+    assert not registry.is_current(7, 'a')
+
+    del db.current['7']
+    registry.revoke(7)
+    assert not registry.is_current(7, 'b')
+
+
+def test_differing_token_reads_the_db():
+    # Issued by another host: the cached jti is stale until the DB is read
+    db = FakeDB({'7': 'a'})
+    registry = TokenRegistry(db.load, ttl=3600)
+    registry.is_current(7, 'a')
+
+    db.current['7'] = 'b'
+    assert registry.is_current(7, 'b')
+    assert db.reads == 2
+
+
+def test_entries_expire_after_ttl():
+    db = FakeDB({'7': 'a'})
+    registry = TokenRegistry(db.load, ttl=0)
+    registry.is_current(7, 'a')
+
+    del db.current['7']
+    assert not registry.is_current(7, 'a')
+
+
+def test_cache_is_bounded():
+    registry = TokenRegistry(FakeDB({str(i): 'a' for i in range(10)}).load, maxsize=3, ttl=3600)
+    for user_id in range(10):
+        registry.is_current(user_id, 'a')
+    assert registry.stats()['users'] == 3
+
+
+def check_after_revoke(path, ready, revoked, result):
+    db = FakeDB({'7': 'a'})
+    registry = TokenRegistry(db.load, ttl=3600, epochs=TokenEpochs(path))
+    registry.is_current(7, 'a')
+    ready.set()
+    revoked.wait(10)
+    # The revoking process can't clear this cache, only the DB and the epoch
+    del db.current['7']
+    result.value = registry.is_current(7, 'a')
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_revocation_reaches_other_worker_processes(tmp_path):
+    path = str(tmp_path / 'epochs')
+    context = multiprocessing.get_context('fork')
+    ready, revoked, result = context.Event(), context.Event(), context.Value('b', 1)
+    worker = context.Process(target=check_after_revoke, args=(path, ready, revoked, result))
+    worker.start()
+    assert ready.wait(10)
+
+    epochs = TokenEpochs(path)
+    TokenRegistry(FakeDB().load, epochs=epochs).revoke(7)
+    revoked.set()
+    worker.join(10)
+
+    assert worker.exitcode == 0
+    assert result.value == 0
+    assert epochs.get(7) == 1
@@ -0,0 +1,104 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import Flask, request
+from PIL import Image as PILImage
+
+from Storage.backends import ReadThroughCache
+from Storage.contentStore import ContentStore
+from Storage.uploadStream import UploadReader, UploadRejected, ValidatedUpload
+
+MB = 1024 * 1024
+
+
+def jpeg(size=(64, 64)):
+    buffer = io.BytesIO()
+    PILImage.effect_noise(size, 64).convert('RGB').save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def reader(store):
+    writer = ThreadPoolExecutor(max_workers=1)
+    yield UploadReader(store, writer, max_file_size=MB, max_request_size=3 * MB)
+    writer.shutdown()
+
+
+def read(reader, data, **kwargs):
+    with Flask(__name__).test_request_context('/', method='POST', data=data, content_type='multipart/form-data'):
+        return reader.read(request, {'documentFront', 'documentBack'}, **kwargs)
+
+
+def leftovers(store):
+    return os.listdir(store.tmp_dir)
+
+
+def test_accepted_upload_is_stored_not_buffered(reader, store):
+    front = jpeg()
+    form, uploads = read(reader, {'document_type': 'ID', 'documentFront': (io.BytesIO(front), 'Front.JPG')})
+
+    assert form == {'document_type': 'ID'}
+    upload = uploads['documentFront']
+    assert not hasattr(upload, 'data')
+    assert upload.write.result() == (ContentStore.key_for(upload.digest, '.jpg'), True)
+    assert (upload.size, upload.digest) == (len(front), ContentStore.digest(front))
+    with open(store.local_path(upload.key), 'rb') as f:
+        assert f.read() == front
+    assert leftovers(store) == []
+
+
+def test_reserve_runs_before_anything_is_stored(reader, store):
+    seen = []
+
+    def reserve(uploads):
+        seen.extend((upload.filename, store.exists(upload.digest, '.jpg')) for upload in uploads)
+
+    _, uploads = read(reader, {'documentFront': (io.BytesIO(jpeg()), 'f.jpg')}, reserve=reserve)
+    uploads['documentFront'].write.result()
+    assert seen == [('f.jpg', False)]
+
+
+def test_failed_reserve_stores_nothing(reader, store):
+    def reserve(uploads):
+        raise RuntimeError('database down')
+
+    with pytest.raises(RuntimeError):
+        read(reader, {'documentFront': (io.BytesIO(jpeg()), 'f.jpg')}, reserve=reserve)
+    assert leftovers(store) == []
+
+
+@pytest.mark.parametrize('back, status', [
+    ((b'MZ' + bytes(5000), 'back.jpg'), 400),
+    ((jpeg(), 'back.exe'), 400),
+    ((b'\xff\xd8\xff\xe0' + bytes(2 * MB), 'back.jpg'), 413),
+])
+def test_rejected_upload_leaves_nothing_behind(reader, store, back, status):
+    data = {'documentFront': (io.BytesIO(jpeg()), 'front.jpg'), 'documentBack': (io.BytesIO(back[0]), back[1])}
+    with pytest.raises(UploadRejected) as rejected:
+        read(reader, data)
+    assert rejected.value.status == status
+    assert leftovers(store) == []
+    assert not os.path.exists(store.backend.root) or not [
+        name for name in os.listdir(store.backend.root) if name != '.tmp'
+    ]
+
+
+def test_validated_upload_stops_at_the_limit():
+    stream = io.BytesIO(b'%PDF-1.4\n' + bytes(10000))
+    upload = ValidatedUpload(stream, 4096, {'application/pdf'})
+    with pytest.raises(UploadRejected):
+        while upload.read(1024):
+            pass
+    assert stream.tell() <= 4096 + 2048
+
+
+def test_cache_adopts_uploaded_file(tmp_path):
+    cache = ReadThroughCache(str(tmp_path / 'cache'))
+    spooled = tmp_path / 'spooled'
+    spooled.write_bytes(b'blob')
+    cache.adopt('ab/cd/abcd.jpg', str(spooled))
+
+    assert not spooled.exists()
+    assert cache.fetch_path('ab/cd/abcd.jpg', fetch=None) == cache.path('ab/cd/abcd.jpg')
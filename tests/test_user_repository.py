@@ -0,0 +1,153 @@
+import threading
+from concurrent.futures import TimeoutError
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from Database.flaskSQL import Blob, Document, Job, User, db
+from Database.userRepository import GroupCommitter, UserRepository
+
+
+def registration(document_name, name='Test'):
+    return {
+        'name': name, 'images': [],
+        'documents': [{'document_url': 'ab/cd/abcd.pdf', 'document_name': document_name, 'document_type': 'ID'}]
+    }
+
+
+@pytest.fixture
+def blocked_writer(monkeypatch):
+    """ Holds the group writer inside its first create_users() until released """
+    started, release = threading.Event(), threading.Event()
+    create_users = UserRepository.create_users
+
+    def slow_create_users(self, registrations):
+        registrations = list(registrations)
+        started.set()
+        release.wait(10)
+        return create_users(self, registrations)
+
+    monkeypatch.setattr(UserRepository, 'create_users', slow_create_users)
+    yield started, release
+    release.set()
+
+
+def test_create_users_inserts_many_registrations_at_once(app):
+    shared = {'content_hash': 'a' * 64, 'size': 10}
+    registrations = [{
+        'name': f'User {i}',
+        'images': [dict(shared, image_url='aa/aa/face.jpg')],
+        'documents': [dict(shared, document_url='aa/aa/face.jpg', document_name=f'front_{i}.jpg',
+                           document_type='ID', job_id=f'job{i}')]
+    } for i in range(3)]
+    results = UserRepository().create_users(registrations)
+    db.session.commit()
+
+    assert len({result['user_id'] for result in results}) == 3
+    for i, result in enumerate(results):
+        user = db.session.get(User, result['user_id'])
+        assert user.name == f'User {i}'
+        assert [image.image_id for image in user.images] == result['image_ids']
+        assert [document.document_id for document in user.documents] == result['document_ids']
+        assert db.session.get(Job, f'job{i}').document_id == result['document_ids'][0]
+    # One blob row, referenced by every image and document row
+    blob = db.session.get(Blob, 'a' * 64)
+    assert (blob.ref_count, blob.size, blob.storage_path) == (6, 10, 'aa/aa/face.jpg')
+
+
+def test_queued_registrations_share_a_commit(app, blocked_writer):
+    started, release = blocked_writer
+    committer = GroupCommitter(app)
+    first = committer.submit(registration('front_0.pdf', name='0'))
+    assert started.wait(5)
+    queued = [committer.submit(registration(f'front_{i}.pdf', name=str(i))) for i in range(1, 5)]
+    release.set()
+
+    assert first.result(5)['user_id']
+    assert all(future.result(5)['user_id'] for future in queued)
+    assert committer.stats()['groups'] == 2
+    assert committer.stats()['registrations'] == 5
+    assert User.query.count() == 5
+
+
+def test_registration_withdrawn_on_timeout_is_never_committed(app, blocked_writer):
+    started, release = blocked_writer
+    committer = GroupCommitter(app)
+    first = committer.submit(registration('front_0.pdf', name='0'))
+    assert started.wait(5)
+    with pytest.raises(TimeoutError):
+        committer.register(registration('front_1.pdf', name='1'), timeout=0.1)
+    release.set()
+
+    first.result(5)
+    committer.submit(registration('front_2.pdf', name='2')).result(5)
+    assert sorted(user.name for user in User.query.all()) == ['0', '2']
+
+
+def test_conflicting_registration_fails_alone_with_integrity_error(app):
+    committer = GroupCommitter(app, max_batch=8, max_delay=0.05)
+    futures = [committer.submit(registration(name, name=str(i)))
+               for i, name in enumerate(['front_a.pdf', 'front_b.pdf', 'front_a.pdf'])]
+
+    assert futures[0].result(5)['user_id'] and futures[1].result(5)['user_id']
+    with pytest.raises(IntegrityError):
+        futures[2].result(5)
+    assert User.query.count() == 2
+    assert Document.query.count() == 2
+
+
+@pytest.fixture
+def statements(app):
+    """ SQL statements run on the app's engine """
+    executed = []
+
+    def record(conn, cursor, statement, *args):
+        executed.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def registered_user(documents=3):
+    created = UserRepository().create_user({
+        'name': 'Test',
+        'images': [{'image_url': f'ab/cd/{i}.jpg'} for i in range(2)],
+        'documents': [{'document_url': f'ab/cd/{i}.pdf', 'document_name': f'doc_{i}.pdf',
+                       'document_type': 'ID', 'extracted_text': 'x' * 1000} for i in range(documents)]
+    })
+    user = db.session.get(User, created['user_id'])
+    user.profile.set_token('issued', datetime.utcnow() + timedelta(hours=1))
+    db.session.commit()
+    db.session.expunge_all()
+    return created['user_id']
+
+
+def test_find_user_loads_profile_and_images_in_one_select(app, statements):
+    user_id = registered_user()
+    statements.clear()
+
+    user = UserRepository().find_user(user_id, token='issued')
+    assert user.profile.token == 'issued'
+    assert sorted(image.image_url for image in user.images) == ['ab/cd/0.jpg', 'ab/cd/1.jpg']
+    assert len(statements) == 1
+
+    assert UserRepository().find_user(user_id, token='other') is None
+    assert UserRepository().find_user(user_id + 1) is None
+
+
+def test_documents_selects_requested_fields_by_page(app, statements):
+    user_id = registered_user(documents=5)
+    statements.clear()
+
+    page, has_more = UserRepository().documents(user_id, fields=('id', 'url'), limit=2, offset=2)
+    assert [document['url'] for document in page] == ['ab/cd/2.pdf', 'ab/cd/3.pdf']
+    assert has_more
+    assert len(statements) == 1
+    assert 'extracted_text' not in statements[0]
+
+    page, has_more = UserRepository().documents(user_id, fields=('type',), offset=4)
+    assert page == [{'type': 'ID'}]
+    assert not has_more
@@ -0,0 +1,23 @@
+import os
+import runpy
+from types import SimpleNamespace
+
+from dataCollection import wsgi
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gunicorn.conf.py')
+
+
+def test_only_first_worker_requeues_jobs(monkeypatch):
+    calls = []
+    monkeypatch.setattr(wsgi, 'after_fork', lambda requeue_jobs=False: calls.append(requeue_jobs))
+    config = runpy.run_path(CONFIG)
+    assert config['preload_app']
+
+    for age in (1, 2, 3):
+        config['post_fork'](None, SimpleNamespace(age=age))
+    assert calls == [True, False, False]
+
+
+def test_after_fork_before_app_is_loaded_is_a_no_op(monkeypatch):
+    monkeypatch.setattr(wsgi, '_collect', None)
+    wsgi.after_fork(requeue_jobs=True)